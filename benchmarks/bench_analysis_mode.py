@@ -0,0 +1,114 @@
+"""
+Compares the 'split' (three requests) and 'combined' (one request) analysis modes of AnalysisPipeline.
+
+For every mode the script analyzes the same input several times and reports the number of requests, the prompt
+and completion tokens and the latency per message, then compares the outputs of the two modes field by field
+so the mode of each topic can be chosen on evidence.
+
+Usage:
+    python bench_analysis_mode.py --llm-host http://localhost:8000/v1 --llm-model my-model [--input file] [--runs 5]
+"""
+import os
+import time
+import argparse
+from difflib import SequenceMatcher
+
+from common import TokenUsage, percentile
+from samples import SAMPLE_SRT
+from llm import AnalysisPipeline, ANALYSIS_MODES
+
+
+def jaccard(left: list, right: list) -> float:
+    """
+    Returns the Jaccard similarity of two lists, compared case-insensitively.
+    """
+    left = {str(item).casefold() for item in left}
+    right = {str(item).casefold() for item in right}
+    if not left and not right:
+        return 1.0
+    return len(left & right) / len(left | right)
+
+
+def similarity(left: str, right: str) -> float:
+    return SequenceMatcher(None, left or '', right or '').ratio()
+
+
+def parity(split: dict, combined: dict) -> dict:
+    """
+    Compares the outputs of the two modes.
+
+    Returns:
+        dict: A score between 0 and 1 per field, 1 meaning identical.
+    """
+    return {
+        'title': similarity(split['title'], combined['title']),
+        'summary': similarity(split['summary'], combined['summary']),
+        'keywords': jaccard(split['keywords'], combined['keywords']),
+        'tags': jaccard(split['tags'], combined['tags']),
+        'personage': jaccard(split['personage'], combined['personage']),
+        'spelling': jaccard(split['spelling'].items(), combined['spelling'].items()),
+        'grammar_errors': jaccard(
+            [(error['wrong_word'], error['alter_word']) for error in split['grammar_errors']],
+            [(error['wrong_word'], error['alter_word']) for error in combined['grammar_errors']]
+        ),
+        'segments': min(len(split['segments']), len(combined['segments']))
+                    / max(len(split['segments']), len(combined['segments']), 1)
+    }
+
+
+def run(pipeline: AnalysisPipeline, usage: TokenUsage, text: str, mode: str, runs: int):
+    """
+    Analyzes `text` `runs` times in `mode` and returns the last output and the measurements.
+    """
+    usage.reset()
+    latencies, output = [], None
+    for _ in range(runs):
+        start = time.perf_counter()
+        output = pipeline.analyze(text, mode)
+        latencies.append(time.perf_counter() - start)
+    stats = {
+        'requests': usage.requests / runs,
+        'prompt_tokens': usage.prompt_tokens / runs,
+        'completion_tokens': usage.completion_tokens / runs,
+        'p50_s': percentile(latencies, 50),
+        'p95_s': percentile(latencies, 95)
+    }
+    return output, stats
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--llm-host', default=os.getenv('LLM_HOST'))
+    parser.add_argument('--llm-model', default=os.getenv('LLM_MODEL'))
+    parser.add_argument('--api-key', default=os.getenv('LLM_API_KEY', '...'))
+    parser.add_argument('--input', help='text file to analyze; defaults to a sample transcript')
+    parser.add_argument('--runs', type=int, default=5)
+    args = parser.parse_args()
+
+    text = SAMPLE_SRT
+    if args.input:
+        with open(args.input, encoding='utf-8') as file:
+            text = file.read()
+
+    usage = TokenUsage()
+    pipeline = AnalysisPipeline(
+        api_key=args.api_key,
+        llm_model=args.llm_model,
+        llm_host=args.llm_host,
+        callbacks=[usage]
+    )
+
+    outputs = {}
+    print(f"{'mode':<10}{'requests':>10}{'prompt_tok':>12}{'compl_tok':>12}{'p50_s':>10}{'p95_s':>10}")
+    for mode in ANALYSIS_MODES:
+        outputs[mode], stats = run(pipeline, usage, text, mode, args.runs)
+        print(f"{mode:<10}{stats['requests']:>10.1f}{stats['prompt_tokens']:>12.0f}{stats['completion_tokens']:>12.0f}"
+              f"{stats['p50_s']:>10.2f}{stats['p95_s']:>10.2f}")
+
+    print('\nparity of combined against split (1.0 = identical):')
+    for field, score in parity(outputs['split'], outputs['combined']).items():
+        print(f"  {field:<16}{score:.2f}")
+
+
+if __name__ == '__main__':
+    main()
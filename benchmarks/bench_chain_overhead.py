@@ -0,0 +1,89 @@
+"""
+Measures the Python overhead of AnalysisPipeline calls, excluding the language model time.
+
+The language model is replaced by an in-process stand-in answering canned results immediately. The script
+compares building the parser, format instructions, prompt template, chain and thread pool on every call (the
+previous behavior) with the chains and executor built once by AnalysisPipeline.
+
+Usage:
+    python bench_chain_overhead.py [--iterations 2000]
+"""
+import time
+import argparse
+from concurrent.futures import ThreadPoolExecutor
+
+from langchain.prompts import PromptTemplate
+from langchain_core.output_parsers import JsonOutputParser
+
+from common import fake_llm
+from samples import SAMPLE_SRT
+from llm import AnalysisPipeline
+from model import NewsInfo, NewsSegments, GrammarErrors
+from prompt import ANALYZE_PROMPT, SEGMENTATION_PROMPT, GRAMMAR_CHECK_PROMPT
+
+TASKS = (
+    (ANALYZE_PROMPT, NewsInfo, False),
+    (SEGMENTATION_PROMPT, NewsSegments, True),
+    (GRAMMAR_CHECK_PROMPT, GrammarErrors, True),
+)
+
+
+def rebuild_call(llm, template: str, pydantic_object, format_instructions: bool, text: str) -> dict:
+    """
+    Runs one task the previous way, building the parser, prompt and chain for the call.
+    """
+    parser = JsonOutputParser(pydantic_object=pydantic_object)
+    partial_variables = {"format_instructions": parser.get_format_instructions()} if format_instructions else {}
+    prompt = PromptTemplate(template=template, input_variables=['text'], partial_variables=partial_variables)
+    chain = prompt | llm | parser
+    return chain.invoke({"text": text})
+
+
+def rebuild_analyze(llm, text: str) -> dict:
+    """
+    Runs the three tasks the previous way, with a new thread pool for the call.
+    """
+    with ThreadPoolExecutor() as executor:
+        futures = [executor.submit(rebuild_call, llm, *task, text) for task in TASKS]
+        result = {}
+        for future in futures:
+            result.update(future.result())
+        return result
+
+
+def measure(function, iterations: int) -> float:
+    """
+    Returns the mean duration of `function` in microseconds.
+    """
+    function()
+    start = time.perf_counter()
+    for _ in range(iterations):
+        function()
+    return (time.perf_counter() - start) / iterations * 1e6
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--iterations', type=int, default=2000)
+    args = parser.parse_args()
+
+    llm = fake_llm()
+    pipeline = AnalysisPipeline(api_key='...', llm_model='fake', llm_host='http://localhost', llm=llm)
+
+    cases = (
+        ('segment_text', lambda: rebuild_call(llm, *TASKS[1], SAMPLE_SRT), lambda: pipeline.segment_text(SAMPLE_SRT)),
+        ('grammar_check', lambda: rebuild_call(llm, *TASKS[2], SAMPLE_SRT), lambda: pipeline.grammar_check(SAMPLE_SRT)),
+        ('analyze', lambda: rebuild_analyze(llm, SAMPLE_SRT), lambda: pipeline.analyze(SAMPLE_SRT)),
+    )
+
+    print(f"{'call':<16}{'rebuilt_us':>12}{'prebuilt_us':>13}{'speedup':>9}")
+    for name, rebuilt, prebuilt in cases:
+        before = measure(rebuilt, args.iterations)
+        after = measure(prebuilt, args.iterations)
+        print(f"{name:<16}{before:>12.1f}{after:>13.1f}{before / after:>8.2f}x")
+
+    pipeline.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,113 @@
+"""
+Measures the end-to-end latency of consumed messages, from the send to the end of their processing.
+
+Messages are sent at a steady rate to an in-memory broker stand-in and consumed either by the previous document
+loop (a 3 second sleep, iteration until the topic is idle for a second, and a break after every message) or by
+the TopicPool runtime polling the consumer. The handler only waits a fixed processing time, so the figures show
+the latency and throughput added by the consume loop itself.
+
+Usage:
+    python bench_consume_latency.py [--messages 500] [--rate 100] [--work-ms 20] [--max-poll-records 500]
+                                    [--legacy-messages 5]
+"""
+import json
+import time
+import asyncio
+import argparse
+import threading
+
+from common import percentile
+from stubs import InMemoryBroker
+from runtime import TopicPool
+
+TOPIC = 'documents'
+
+
+def produce(broker: InMemoryBroker, messages: int, rate: float):
+    """
+    Sends `messages` records at `rate` per second, each carrying its send time.
+    """
+    for index in range(messages):
+        broker.send(TOPIC, json.dumps({'Id': index, 'sent': time.perf_counter()}).encode('utf-8'))
+        time.sleep(1 / rate)
+
+
+def latency_of(message) -> float:
+    return time.perf_counter() - json.loads(message.value)['sent']
+
+
+def legacy(messages: int, rate: float, work: float) -> list:
+    """
+    Consumes like the previous document worker did, one message per 3 second sleep and idle iteration.
+    """
+    broker = InMemoryBroker()
+    consumer = broker.consumer(TOPIC)
+    threading.Thread(target=produce, args=(broker, messages, rate), daemon=True).start()
+
+    latencies = []
+    while len(latencies) < messages:
+        time.sleep(3)
+        # Iterating the consumer ended once no record arrived for consumer_timeout_ms=1000
+        while True:
+            records = consumer.poll(timeout_ms=1000, max_records=1)
+            if not records:
+                break
+            for message in next(iter(records.values())):
+                time.sleep(work)
+                latencies.append(latency_of(message))
+            break
+    return latencies
+
+
+async def pooled(messages: int, rate: float, work: float, max_poll_records: int) -> list:
+    """
+    Consumes with the TopicPool runtime.
+    """
+    broker = InMemoryBroker()
+    latencies = []
+    finished = asyncio.Event()
+
+    async def handler(message):
+        await asyncio.sleep(work)
+        latencies.append(latency_of(message))
+        if len(latencies) == messages:
+            finished.set()
+
+    pool = TopicPool(lambda listener: broker.consumer(TOPIC, listener, max_poll_records=max_poll_records),
+                     handler, concurrency=16, queue_size=64, poll_timeout_ms=1000)
+    runner = asyncio.create_task(pool.run())
+    threading.Thread(target=produce, args=(broker, messages, rate), daemon=True).start()
+    await finished.wait()
+    runner.cancel()
+    await asyncio.gather(runner, return_exceptions=True)
+    return latencies
+
+
+def report(name: str, latencies: list, elapsed: float):
+    print(f"{name:<8}{len(latencies):>10}{len(latencies) / elapsed:>9.1f}{percentile(latencies, 50) * 1000:>10.1f}"
+          f"{percentile(latencies, 95) * 1000:>10.1f}{percentile(latencies, 99) * 1000:>10.1f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--messages', type=int, default=500)
+    parser.add_argument('--rate', type=float, default=100)
+    parser.add_argument('--work-ms', type=float, default=20)
+    parser.add_argument('--max-poll-records', type=int, default=500)
+    parser.add_argument('--legacy-messages', type=int, default=5, help='0 skips the previous loop')
+    args = parser.parse_args()
+    work = args.work_ms / 1000
+
+    print(f"{'loop':<8}{'messages':>10}{'msg_s':>9}{'p50_ms':>10}{'p95_ms':>10}{'p99_ms':>10}")
+    if args.legacy_messages:
+        start = time.perf_counter()
+        latencies = legacy(args.legacy_messages, args.rate, work)
+        report('legacy', latencies, time.perf_counter() - start)
+
+    start = time.perf_counter()
+    latencies = asyncio.run(pooled(args.messages, args.rate, work, args.max_poll_records))
+    report('pool', latencies, time.perf_counter() - start)
+
+
+if __name__ == '__main__':
+    main()
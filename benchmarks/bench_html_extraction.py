@@ -0,0 +1,108 @@
+"""
+Measures the extraction of the article text of documents on a corpus of saved HTML pages.
+
+Compares extracting in a worker thread (the previous behavior) with the HtmlExtractor process pool, and the
+plain-text fast path. For every variant the script reports the documents per second, the latency per document
+and the worst delay of a heartbeat scheduled on the event loop every 10 ms, which shows how much the extraction
+stalls the other topics served by the same process.
+
+Without --corpus, pages are synthesized from the sample transcript.
+
+Usage:
+    python bench_html_extraction.py [--corpus dir/with/html] [--documents 200] [--processes 4] [--concurrency 16]
+"""
+import os
+import glob
+import time
+import asyncio
+import argparse
+
+from common import percentile
+from samples import SAMPLE_SRT, raw_text
+from extraction import HtmlExtractor, extract_text
+
+
+def load_corpus(path: str, documents: int) -> list:
+    """
+    Returns `documents` HTML pages, cycling over the *.html files of `path` or over synthesized pages.
+    """
+    if path:
+        pages = []
+        for file_path in sorted(glob.glob(os.path.join(path, '**', '*.html'), recursive=True)):
+            with open(file_path, encoding='utf-8', errors='replace') as f:
+                pages.append(f.read())
+        if not pages:
+            raise SystemExit(f'no *.html file in {path}')
+    else:
+        paragraphs = ''.join(f'<p>{line}</p>\n' for line in raw_text(SAMPLE_SRT).splitlines() if line.strip())
+        pages = [
+            f'<html><head><title>News {index}</title></head><body>'
+            f'<nav>{"<a href=/>Home</a> " * 50}</nav><article><h1>News {index}</h1>{paragraphs * (index % 8 + 1)}'
+            f'</article><footer>{"<span>Footer</span>" * 50}</footer></body></html>'
+            for index in range(16)
+        ]
+    return [pages[index % len(pages)] for index in range(documents)]
+
+
+async def heartbeat(lags: list, interval: float = 0.01):
+    """
+    Records how late the event loop wakes up a task sleeping `interval` seconds.
+    """
+    loop = asyncio.get_running_loop()
+    while True:
+        start = loop.time()
+        await asyncio.sleep(interval)
+        lags.append(loop.time() - start - interval)
+
+
+async def run(extract, pages: list, concurrency: int):
+    """
+    Extracts every page with `extract`, `concurrency` at a time.
+    """
+    semaphore = asyncio.Semaphore(concurrency)
+    latencies, lags = [], []
+
+    async def one(page):
+        async with semaphore:
+            start = time.perf_counter()
+            await extract(page)
+            latencies.append(time.perf_counter() - start)
+
+    monitor = asyncio.create_task(heartbeat(lags))
+    start = time.perf_counter()
+    await asyncio.gather(*(one(page) for page in pages))
+    elapsed = time.perf_counter() - start
+    monitor.cancel()
+    return elapsed, latencies, lags
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--corpus', help='directory of saved HTML pages')
+    parser.add_argument('--documents', type=int, default=200)
+    parser.add_argument('--processes', type=int, default=os.cpu_count())
+    parser.add_argument('--concurrency', type=int, default=16)
+    args = parser.parse_args()
+
+    pages = load_corpus(args.corpus, args.documents)
+    texts = [extract_text(page) for page in pages[:min(len(pages), 16)]]
+    extractor = HtmlExtractor(max_workers=args.processes, timeout=None)
+    extractor.start()
+
+    variants = (
+        ('thread', pages, lambda page: asyncio.to_thread(extract_text, page)),
+        (f'process x{args.processes}', pages, extractor.extract),
+        ('plain text', [texts[index % len(texts)] for index in range(len(pages))], extractor.extract),
+    )
+
+    print(f"{'variant':<14}{'docs_s':>9}{'p50_ms':>9}{'p99_ms':>9}{'max_lag_ms':>12}")
+    for name, inputs, extract in variants:
+        elapsed, latencies, lags = asyncio.run(run(extract, inputs, args.concurrency))
+        print(f"{name:<14}{len(inputs) / elapsed:>9.1f}{percentile(latencies, 50) * 1000:>9.1f}"
+              f"{percentile(latencies, 99) * 1000:>9.1f}{max(lags, default=0) * 1000:>12.1f}")
+
+    extractor.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,224 @@
+"""
+Measures the throughput of the workers end to end, offline, for every concurrency setting.
+
+The real handlers of `workers` run in the TopicPool runtime. They run against local stand-ins of the external
+services:
+- an OpenAI-compatible language model answering valid NewsInfo, NewsSegments and GrammarErrors JSON after a
+  configurable latency and token rate
+- the stub STT server
+- an in-memory broker that takes the place of the Kafka consumer and producer
+
+The stand-in servers run in a separate process, so the CPU figures only cover the worker process and its
+extraction processes. The result caches are disabled, so every message reaches the stand-ins.
+
+For every concurrency setting, the messages are all sent before the pool starts. The script reports:
+- the messages per second
+- the p50, p95 and p99 processing latency of a message, from the start of its handling to the acknowledgement
+  of its result
+- the CPU use of the worker processes, in percent of one core
+- their peak resident memory, sampled every 100 ms (or the peak of the process so far without psutil)
+
+The structured logs of the workers are written to --log-file, or discarded.
+
+Usage:
+    python bench_pipeline.py [--topic audio] [--messages 200] [--concurrency 1,4,16,64] [--llm-latency 0.2]
+                             [--token-rate 100] [--stt-latency 0.5] [--warmup 8] [--log-file pipeline.log]
+"""
+import os
+import sys
+import time
+import asyncio
+import argparse
+import resource
+import contextlib
+import multiprocessing
+
+try:
+    import psutil
+except ImportError:
+    psutil = None
+
+from common import percentile
+from samples import SAMPLE_SRT, raw_text
+from stubs import InMemoryBroker, StubLlmServer, StubSttServer
+from runtime import TopicPool
+
+TOPICS = ('audio', 'video', 'document')
+
+
+def serve_stubs(urls, llm_latency: float, token_rate: float, stt_latency: float):
+    """
+    Starts the language model and STT stand-ins, sends their URLs through `urls` and serves until terminated.
+    """
+    llm = StubLlmServer(latency=llm_latency, token_rate=token_rate)
+    stt = StubSttServer(latency=stt_latency)
+    urls.put((llm.start(), stt.start()))
+    while True:
+        time.sleep(1)
+
+
+def make_message(topic: str, index: int) -> dict:
+    """
+    Returns a message of `topic`, unique per `index` so that no stage can reuse a previous result.
+    """
+    if topic == 'document':
+        paragraphs = ''.join(f'<p>{sentence}.</p>' for sentence in raw_text(SAMPLE_SRT).split('. '))
+        content = (f'<html><head><title>News {index}</title></head><body><nav>{"<a href=/>Home</a> " * 20}</nav>'
+                   f'<article><h1>News {index}</h1>{paragraphs}</article></body></html>')
+        return {'Id': index, 'RefId': f'ref-{index}', 'Metadata': {'Content': content}}
+    return {'Id': index, 'RefId': f'ref-{index}', 'Metadata': {'FilePath': f'http://media.local/{topic}/{index}.mp4'}}
+
+
+def cpu_seconds(exclude: set) -> float:
+    """
+    Returns the CPU time used by the process and its children not in `exclude`, or by the process alone
+    without psutil.
+    """
+    if psutil is None:
+        usage = resource.getrusage(resource.RUSAGE_SELF)
+        return usage.ru_utime + usage.ru_stime
+    total = 0.0
+    for process in [psutil.Process()] + psutil.Process().children(recursive=True):
+        if process.pid in exclude:
+            continue
+        with contextlib.suppress(psutil.Error):
+            times = process.cpu_times()
+            total += times.user + times.system
+    return total
+
+
+def rss_bytes(exclude: set) -> int:
+    """
+    Returns the resident memory of the process and its children not in `exclude`, or the peak resident memory
+    of the process so far without psutil.
+    """
+    if psutil is None:
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+    total = 0
+    for process in [psutil.Process()] + psutil.Process().children(recursive=True):
+        if process.pid in exclude:
+            continue
+        with contextlib.suppress(psutil.Error):
+            total += process.memory_info().rss
+    return total
+
+
+async def run(topic: str, handler, messages: int, concurrency: int, first_id: int, exclude: set) -> dict:
+    """
+    Sends `messages` messages to an in-memory broker and processes them with `concurrency` handlers in flight.
+
+    Returns:
+        dict: The elapsed time, the latencies of the messages, the number of failed messages, the CPU time and
+              the peak resident memory.
+    """
+    # Imported once the environment points the settings to the stand-ins, like workers
+    import kafka_helper
+
+    broker = InMemoryBroker()
+    kafka_helper.producer = broker.producer()
+    for index in range(first_id, first_id + messages):
+        broker.send(topic, kafka_helper.serializer.dumps(make_message(topic, index)))
+
+    latencies, failures = [], 0
+    finished = asyncio.Event()
+
+    async def measured(message):
+        nonlocal failures
+        start = time.perf_counter()
+        try:
+            return await handler(message)
+        except Exception:
+            failures += 1
+            raise
+        finally:
+            latencies.append(time.perf_counter() - start)
+            if len(latencies) == messages:
+                finished.set()
+
+    async def sample_memory(peak: list):
+        while True:
+            peak[0] = max(peak[0], rss_bytes(exclude))
+            await asyncio.sleep(0.1)
+
+    pool = TopicPool(lambda listener: broker.consumer(topic, listener), measured, concurrency=concurrency,
+                     queue_size=max(2 * concurrency, 16), poll_timeout_ms=100, name=topic)
+    peak = [0]
+    sampler = asyncio.create_task(sample_memory(peak))
+    cpu, start = cpu_seconds(exclude), time.perf_counter()
+    runner = asyncio.create_task(pool.run())
+    await finished.wait()
+    elapsed, cpu = time.perf_counter() - start, cpu_seconds(exclude) - cpu
+    for task in (runner, sampler):
+        task.cancel()
+    await asyncio.gather(runner, sampler, return_exceptions=True)
+    return {'elapsed': elapsed, 'latencies': latencies, 'failures': failures, 'cpu': cpu, 'rss': peak[0]}
+
+
+async def benchmark(args, exclude: set) -> list:
+    """
+    Runs the warm-up, then every concurrency setting, in the same event loop as the shared clients of `workers`.
+    """
+    # Imported once the environment points the settings to the stand-ins
+    import workers
+
+    resources = workers.Resources((args.topic,))
+    resources.start()
+    handler = workers.create_pipeline(args.topic, resources).process
+    concurrencies = [int(value) for value in args.concurrency.split(',')]
+    results, first_id = [], 0
+    try:
+        if args.warmup:
+            await run(args.topic, handler, args.warmup, concurrencies[0], first_id, exclude)
+            first_id += args.warmup
+        for concurrency in concurrencies:
+            results.append((concurrency, await run(args.topic, handler, args.messages, concurrency, first_id,
+                                                   exclude)))
+            first_id += args.messages
+    finally:
+        await resources.aclose()
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--topic', choices=TOPICS, default='audio')
+    parser.add_argument('--messages', type=int, default=200)
+    parser.add_argument('--concurrency', default='1,4,16,64')
+    parser.add_argument('--llm-latency', type=float, default=0.2)
+    parser.add_argument('--token-rate', type=float, default=100, help='completion tokens per second; 0 is instant')
+    parser.add_argument('--stt-latency', type=float, default=0.5)
+    parser.add_argument('--warmup', type=int, default=8, help='messages processed before the measured runs')
+    parser.add_argument('--log-file', help='file receiving the structured logs of the workers')
+    args = parser.parse_args()
+
+    urls = multiprocessing.Queue()
+    stubs = multiprocessing.Process(target=serve_stubs, args=(urls, args.llm_latency, args.token_rate,
+                                                              args.stt_latency), daemon=True)
+    stubs.start()
+    llm_url, stt_url = urls.get(timeout=30)
+
+    # The workers read their settings when imported, so the environment points them to the stand-ins first
+    os.environ.update({'LLM_HOST': llm_url, 'STT_URL': stt_url, 'CACHE_BACKEND': 'none'})
+    log = open(args.log_file, 'w') if args.log_file else open(os.devnull, 'w')
+    try:
+        with contextlib.redirect_stdout(log):
+            results = asyncio.run(benchmark(args, {stubs.pid}))
+    finally:
+        log.close()
+        stubs.terminate()
+
+    print(f"topic={args.topic} llm_latency={args.llm_latency}s token_rate={args.token_rate}/s "
+          f"stt_latency={args.stt_latency}s psutil={'yes' if psutil else 'no'}")
+    print(f"{'concurrency':<12}{'messages':>9}{'failed':>8}{'msg_s':>9}{'p50_ms':>10}{'p95_ms':>10}{'p99_ms':>10}"
+          f"{'cpu_%':>8}{'rss_MB':>9}")
+    for concurrency, result in results:
+        latencies, elapsed = result['latencies'], result['elapsed']
+        print(f"{concurrency:<12}{len(latencies):>9}{result['failures']:>8}{len(latencies) / elapsed:>9.1f}"
+              f"{percentile(latencies, 50) * 1000:>10.1f}{percentile(latencies, 95) * 1000:>10.1f}"
+              f"{percentile(latencies, 99) * 1000:>10.1f}{result['cpu'] / elapsed * 100:>8.1f}"
+              f"{result['rss'] / 1e6:>9.1f}")
+    sys.stdout.flush()
+
+
+if __name__ == '__main__':
+    main()
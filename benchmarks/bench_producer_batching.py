@@ -0,0 +1,101 @@
+"""
+Measures the bytes sent to the broker for results carrying a large subtitle, per batching and compression setting.
+
+The script encodes the same results into record batches with the record builder of kafka-python, the way the
+producer does before sending them, and reports the bytes on the wire, the number of batches (about the number of
+produce requests per partition) and the encoding throughput of every combination of batch size and compression.
+A batch size of one result matches the previous producer without linger.
+
+Usage:
+    python bench_producer_batching.py [--results 200] [--subtitle-seconds 1800] [--batch-sizes 16384,262144,1048576]
+"""
+import json
+import time
+import argparse
+
+from kafka.record.memory_records import MemoryRecordsBuilder
+from kafka.record.default_records import DefaultRecordBatch
+
+from samples import long_transcript, raw_text
+
+CODECS = {
+    'none': DefaultRecordBatch.CODEC_NONE,
+    'gzip': DefaultRecordBatch.CODEC_GZIP,
+    'snappy': DefaultRecordBatch.CODEC_SNAPPY,
+    'lz4': DefaultRecordBatch.CODEC_LZ4,
+    'zstd': DefaultRecordBatch.CODEC_ZSTD,
+}
+
+
+def make_results(count: int, seconds: int) -> list:
+    """
+    Returns `count` serialized results shaped like the audio results, with a subtitle of `seconds` seconds.
+    """
+    srt = long_transcript(seconds)
+    results = []
+    for index in range(count):
+        result = {"Id": index, 'RefId': index, "Metadata": {
+            "Subtitle": srt,
+            "Summary": raw_text(srt)[:800],
+            "Title": f"News {index}",
+            "Keyword": json.dumps(['city', 'law', 'planning']),
+            "Tags": json.dumps(['politics']),
+            "Spelling": json.dumps([]),
+            "Personage": json.dumps(['John Doe'])
+        }}
+        results.append((str(index).encode('utf-8'), json.dumps(result).encode('utf-8')))
+    return results
+
+
+def encode(results: list, codec: int, batch_size: int):
+    """
+    Encodes `results` into record batches of at most `batch_size` bytes.
+
+    Returns:
+        tuple: The total size in bytes and the number of batches.
+    """
+    total, batches = 0, 0
+    builder = None
+    for key, value in results:
+        timestamp = int(time.time() * 1000)
+        if builder is None or builder.append(timestamp, key, value, headers=[]) is None:
+            if builder is not None:
+                builder.close()
+                total, batches = total + builder.size_in_bytes(), batches + 1
+            # A result larger than the batch size gets a batch of its own, like in the producer
+            builder = MemoryRecordsBuilder(magic=2, compression_type=codec, batch_size=batch_size)
+            builder.append(timestamp, key, value, headers=[])
+    builder.close()
+    return total + builder.size_in_bytes(), batches + 1
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--results', type=int, default=200)
+    parser.add_argument('--subtitle-seconds', type=int, default=1800)
+    parser.add_argument('--batch-sizes', default='16384,262144,1048576')
+    parser.add_argument('--codecs', default=','.join(CODECS))
+    args = parser.parse_args()
+
+    results = make_results(args.results, args.subtitle_seconds)
+    payload = sum(len(key) + len(value) for key, value in results)
+    batch_sizes = [1] + [int(size) for size in args.batch_sizes.split(',')]
+    print(f"{args.results} results, {payload / 1e6:.1f} MB of JSON")
+
+    print(f"{'codec':<8}{'batch_size':>12}{'batches':>9}{'wire_MB':>10}{'ratio':>8}{'encode_MB_s':>13}")
+    for name in args.codecs.split(','):
+        for batch_size in batch_sizes:
+            try:
+                start = time.perf_counter()
+                size, batches = encode(results, CODECS[name], batch_size)
+                elapsed = time.perf_counter() - start
+            except Exception as e:
+                # The codec library is an optional dependency of kafka-python
+                print(f"{name:<8}unavailable: {e}")
+                break
+            print(f"{name:<8}{batch_size:>12}{batches:>9}{size / 1e6:>10.2f}{payload / size:>8.2f}"
+                  f"{payload / elapsed / 1e6:>13.1f}")
+
+
+if __name__ == '__main__':
+    main()
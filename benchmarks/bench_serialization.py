@@ -0,0 +1,89 @@
+"""
+Compares the JSON serialization of messages and results with every installed backend.
+
+Payloads are realistic for a 1-hour transcript: a consumed document message whose content is the transcript text,
+and a result carrying the full subtitle. The previous path decodes the message bytes to str before parsing them,
+encodes the nested fields with json.dumps and the result with json.dumps followed by an encode. The serializer
+backends decode bytes directly and encode to compact UTF-8 bytes.
+
+Usage:
+    python bench_serialization.py [--seconds 3600] [--iterations 200]
+"""
+import json
+import time
+import argparse
+
+import common  # noqa: F401  # makes the application modules importable
+from samples import long_transcript, raw_text
+from serialization import available_backends, create_serializer
+
+
+def previous_roundtrip(message: bytes, srt: str, analysis: dict) -> bytes:
+    data = json.loads(message.decode())
+    result = {"Id": data['Id'], 'RefId': data['RefId'], "Metadata": {
+        "Subtitle": srt,
+        "Summary": analysis['summary'],
+        "Title": analysis['title'],
+        "Keyword": json.dumps(analysis['keywords']),
+        "Tags": json.dumps(analysis['tags']),
+        "Spelling": json.dumps(analysis['spelling']),
+        "Personage": json.dumps(analysis['personage'])
+    }}
+    return json.dumps(result).encode('utf-8')
+
+
+def serializer_roundtrip(serializer, message: bytes, srt: str, analysis: dict) -> bytes:
+    data = serializer.loads(message)
+    result = {"Id": data['Id'], 'RefId': data['RefId'], "Metadata": {
+        "Subtitle": srt,
+        "Summary": analysis['summary'],
+        "Title": analysis['title'],
+        "Keyword": serializer.dumps_field(analysis['keywords']),
+        "Tags": serializer.dumps_field(analysis['tags']),
+        "Spelling": serializer.dumps_field(analysis['spelling']),
+        "Personage": serializer.dumps_field(analysis['personage'])
+    }}
+    return serializer.dumps(result)
+
+
+def measure(function, iterations: int) -> float:
+    """
+    Returns the mean duration of `function` in milliseconds.
+    """
+    function()
+    start = time.perf_counter()
+    for _ in range(iterations):
+        function()
+    return (time.perf_counter() - start) / iterations * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--seconds', type=int, default=3600)
+    parser.add_argument('--iterations', type=int, default=200)
+    args = parser.parse_args()
+
+    srt = long_transcript(args.seconds)
+    text = raw_text(srt)
+    message = json.dumps({"Id": 1, "RefId": 1, "Metadata": {"Content": text, "FilePath": ""}}).encode('utf-8')
+    analysis = {
+        'summary': text[:1000], 'title': 'News', 'keywords': ['city', 'law', 'planning'], 'tags': ['politics'],
+        'spelling': [{'error': 'teh', 'correction': 'the'}] * 20, 'personage': ['John Doe']
+    }
+    print(f"message {len(message) / 1e3:.0f} kB, subtitle {len(srt.encode('utf-8')) / 1e3:.0f} kB")
+
+    variants = [('previous', lambda: previous_roundtrip(message, srt, analysis))]
+    for name in available_backends():
+        serializer = create_serializer(name)
+        variants.append((name, lambda serializer=serializer: serializer_roundtrip(serializer, message, srt, analysis)))
+
+    baseline = None
+    print(f"{'path':<10}{'ms':>9}{'speedup':>9}{'result_kB':>11}")
+    for name, roundtrip in variants:
+        elapsed = measure(roundtrip, args.iterations)
+        baseline = baseline or elapsed
+        print(f"{name:<10}{elapsed:>9.3f}{baseline / elapsed:>8.2f}x{len(roundtrip()) / 1e3:>11.0f}")
+
+
+if __name__ == '__main__':
+    main()
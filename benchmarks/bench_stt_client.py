@@ -0,0 +1,85 @@
+"""
+Measures the STT client against the local stub STT server.
+
+Compares a new connection per request (the previous behavior) with the pooled SttClient, and reports the
+elapsed time, the number of TCP connections opened and the number of failed transcriptions, optionally with
+a share of 503 answers to exercise the retries.
+
+Usage:
+    python bench_stt_client.py [--requests 200] [--latency 0.05] [--error-rate 0.1] [--concurrency 8]
+"""
+import time
+import asyncio
+import argparse
+
+import httpx
+
+from common import percentile
+from stubs import StubSttServer
+from stt import SttClient, SttError
+
+
+async def unpooled(url: str, requests: int, concurrency: int):
+    """
+    Sends every request on a new connection, without retries.
+    """
+    semaphore = asyncio.Semaphore(concurrency)
+    latencies, failures = [], 0
+
+    async def one(index):
+        nonlocal failures
+        async with semaphore:
+            start = time.perf_counter()
+            async with httpx.AsyncClient(timeout=None) as client:
+                response = await client.post(url, data={'input': f'http://media/{index}.mp4'})
+            latencies.append(time.perf_counter() - start)
+            if response.status_code != 200:
+                failures += 1
+
+    await asyncio.gather(*(one(index) for index in range(requests)))
+    return latencies, failures
+
+
+async def pooled(url: str, requests: int, concurrency: int):
+    """
+    Sends every request through a shared SttClient.
+    """
+    client = SttClient(url, max_concurrency=concurrency, backoff_base=0.05)
+    latencies, failures = [], 0
+
+    async def one(index):
+        nonlocal failures
+        start = time.perf_counter()
+        try:
+            await client.transcribe(f'http://media/{index}.mp4')
+        except SttError:
+            failures += 1
+        latencies.append(time.perf_counter() - start)
+
+    await asyncio.gather(*(one(index) for index in range(requests)))
+    await client.aclose()
+    return latencies, failures
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--requests', type=int, default=200)
+    parser.add_argument('--latency', type=float, default=0.05)
+    parser.add_argument('--error-rate', type=float, default=0.0)
+    parser.add_argument('--concurrency', type=int, default=8)
+    args = parser.parse_args()
+
+    print(f"{'client':<10}{'elapsed_s':>10}{'p50_ms':>9}{'p99_ms':>9}{'connections':>13}{'failures':>10}")
+    for name, run in (('unpooled', unpooled), ('pooled', pooled)):
+        server = StubSttServer(latency=args.latency, error_rate=args.error_rate)
+        url = server.start()
+        start = time.perf_counter()
+        latencies, failures = asyncio.run(run(url, args.requests, args.concurrency))
+        elapsed = time.perf_counter() - start
+        server.stop()
+        print(f"{name:<10}{elapsed:>10.2f}{percentile(latencies, 50) * 1000:>9.1f}{percentile(latencies, 99) * 1000:>9.1f}"
+              f"{server.connections:>13}{failures:>10}")
+
+
+if __name__ == '__main__':
+    main()
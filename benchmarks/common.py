@@ -0,0 +1,69 @@
+"""
+Shared helpers of the benchmark scripts.
+
+The benchmarks import the application modules from the `main` directory, the same way `app.py` does when it is
+started from there.
+
+Classes:
+    TokenUsage: LangChain callback handler summing the token usage reported by the language model.
+
+Functions:
+    fake_llm: Returns an in-process stand-in of the chat model answering canned results.
+    percentile: Returns a percentile of a list of samples.
+"""
+import os
+import sys
+import threading
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'main'))
+
+from langchain_core.callbacks import BaseCallbackHandler
+from langchain_core.runnables import RunnableLambda
+
+from samples import canned_response
+
+
+class TokenUsage(BaseCallbackHandler):
+    """
+    Callback handler summing the prompt and completion tokens reported by an OpenAI-compatible model.
+
+    Attributes:
+        requests (int): Number of completed requests.
+        prompt_tokens (int): Total number of prompt tokens.
+        completion_tokens (int): Total number of completion tokens.
+    """
+    def __init__(self):
+        self.requests = 0
+        self.prompt_tokens = 0
+        self.completion_tokens = 0
+        self._lock = threading.Lock()
+
+    def on_llm_end(self, response, **kwargs):
+        usage = (response.llm_output or {}).get('token_usage') or {}
+        with self._lock:
+            self.requests += 1
+            self.prompt_tokens += usage.get('prompt_tokens', 0)
+            self.completion_tokens += usage.get('completion_tokens', 0)
+
+    def reset(self):
+        with self._lock:
+            self.requests = self.prompt_tokens = self.completion_tokens = 0
+
+
+def fake_llm():
+    """
+    Returns an in-process stand-in of the chat model that answers the canned result of the prompted task
+    immediately, so only the Python overhead of the pipeline is measured.
+    """
+    return RunnableLambda(lambda prompt_value: canned_response(prompt_value.to_string()))
+
+
+def percentile(samples: list, q: float) -> float:
+    """
+    Returns the `q` percentile (0-100) of `samples` using the nearest-rank method.
+    """
+    if not samples:
+        return 0.0
+    ordered = sorted(samples)
+    rank = max(int(round(q / 100 * len(ordered) + 0.5)) - 1, 0)
+    return ordered[min(rank, len(ordered) - 1)]
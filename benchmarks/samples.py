@@ -0,0 +1,113 @@
+"""
+Sample inputs of the benchmark scripts.
+
+Constants:
+    SAMPLE_SRT (str): A short news transcript in the subtitle format returned by the STT service.
+    CANNED_RESULTS (dict): Valid results of every analysis task, answered by the fake language models.
+
+Functions:
+    long_transcript: Builds a transcript of the requested duration by repeating SAMPLE_SRT with shifted timestamps.
+    raw_text: Removes the timestamp ranges of a transcript.
+    prompt_task: Tells which analysis task a rendered prompt belongs to.
+    canned_response: Returns the JSON answer of a fake language model to a rendered prompt.
+"""
+import re
+import json
+
+SAMPLE_SRT = """00:00:01 --> 00:00:05 At the meeting, voters of New York City highly appreciated the city of New York
+00:00:05 --> 00:00:08 and the central ministries and branches for their responsibility and active participation,
+00:00:09 --> 00:00:11 in preparing and building the state law, which has been approved by the National Assembly.
+00:00:12 --> 00:00:16 Voters suggested that the city's National Assembly delegation direct departments, branches, and levels
+00:00:16 --> 00:00:20 from the city to districts, towns, and communes to strengthen propaganda,
+00:00:20 --> 00:00:21 dissemination, and implementation of the state law.
+00:00:22 --> 00:00:25 Regarding the arrangement of administrative units at district and commune levels,
+00:00:25 --> 00:00:36 Voters proposed that the city's National Assembly delegation accelerate the approval process of the city's project, facilitating local units to organize party congresses at all levels in early 2025.
+00:00:37 --> 00:00:54 Voters also hoped that the National Assembly would continue to provide opinions for the government to complete, approve, and implement the New York state planning for the period 2021-2030 with a vision to 2050, and the overall adjustment project of the general planning of New York state until 2045 with a vision to 2065.
+00:00:55 --> 00:01:04 On behalf of the city's National Assembly delegation, Secretary of the City Party Committee John Doe acknowledged the voters' opinions and said that they would be explained to voters after the 8th session of the National Assembly.
+00:01:04 --> 00:01:15 Additionally, the Secretary informed voters that in the first nine months of the year, the city's socio-economic situation maintained growth and stability with many highlights despite being heavily affected by natural disasters.
+00:01:15 --> 00:01:22 Especially, the city of New York successfully organized the 70th anniversary of the state's liberation, leaving many impressions on the state's people and the whole country."""
+
+SAMPLE_DURATION = 82
+TIMESTAMP = re.compile(r'(\d{2}):(\d{2}):(\d{2})')
+
+
+def _shift(match, offset: int) -> str:
+    hours, minutes, seconds = (int(part) for part in match.groups())
+    total = hours * 3600 + minutes * 60 + seconds + offset
+    return f'{total // 3600:02d}:{total % 3600 // 60:02d}:{total % 60:02d}'
+
+
+def long_transcript(seconds: int = 3600) -> str:
+    """
+    Builds a transcript of about `seconds` seconds by repeating SAMPLE_SRT with shifted timestamps.
+
+    Args:
+        seconds (int): Duration of the transcript.
+
+    Returns:
+        str: The transcript in subtitle format.
+    """
+    parts = []
+    for offset in range(0, seconds, SAMPLE_DURATION):
+        parts.append(TIMESTAMP.sub(lambda match: _shift(match, offset), SAMPLE_SRT))
+    return '\n'.join(parts)
+
+
+def raw_text(srt: str) -> str:
+    """
+    Removes the timestamp ranges of a transcript, like the `raw` text returned by the STT service.
+    """
+    return ' '.join(re.sub(r'^\S+ --> \S+ ', '', line) for line in srt.splitlines())
+
+
+CANNED_RESULTS = {
+    'analyze': {
+        'summary': 'Voters asked the city delegation to speed up the administrative reorganization and state planning.',
+        'title': 'Voters meet the National Assembly delegation',
+        'keywords': ['National Assembly', 'voters', 'state law'],
+        'tags': ['politics', 'New York'],
+        'spelling': {},
+        'personage': ['John Doe']
+    },
+    'segment': {
+        'segments': [
+            {
+                'start': '00:00:01', 'end': '00:00:21',
+                'content': 'Voters praised the preparation of the state law and asked for its dissemination.',
+                'title': 'State law', 'keywords': 'state law, voters', 'tags': 'politics'
+            },
+            {
+                'start': '00:00:22', 'end': '00:01:22',
+                'content': 'Voters asked to accelerate the reorganization; the Secretary reported on the economy.',
+                'title': 'Administrative units', 'keywords': 'reorganization, economy', 'tags': 'politics'
+            }
+        ]
+    },
+    'grammar': {
+        'grammar_errors': [{'wrong_word': 'indentify', 'alter_word': 'identify'}]
+    }
+}
+CANNED_RESULTS['combined'] = {**CANNED_RESULTS['analyze'], **CANNED_RESULTS['segment'], **CANNED_RESULTS['grammar']}
+
+PROMPT_MARKERS = (
+    ('combined', 'Act as a news analyzer'),
+    ('segment', 'Act as a text analyzer'),
+    ('grammar', 'Act as a grammar and spelling corrector'),
+)
+
+
+def prompt_task(prompt: str) -> str:
+    """
+    Tells which analysis task a rendered prompt belongs to: 'analyze', 'segment', 'grammar' or 'combined'.
+    """
+    for task, marker in PROMPT_MARKERS:
+        if marker in prompt:
+            return task
+    return 'analyze'
+
+
+def canned_response(prompt: str) -> str:
+    """
+    Returns the JSON answer of a fake language model to the rendered `prompt`.
+    """
+    return json.dumps(CANNED_RESULTS[prompt_task(prompt)])
@@ -0,0 +1,407 @@
+"""
+Local stand-ins of the external services, for benchmarks and manual testing.
+
+Classes:
+    StubSttServer: HTTP server answering like the speech-to-text (STT) service.
+    StubLlmServer: HTTP server answering like an OpenAI-compatible chat completions endpoint.
+    InMemoryBroker: In-process stand-in of a Kafka broker.
+    StubConsumer: Consumer of an InMemoryBroker with the polling interface of KafkaConsumer.
+    StubProducer: Producer of an InMemoryBroker with the sending interface of KafkaProducer.
+
+Usage:
+    python stubs.py stt [--port 8001] [--latency 0.5] [--error-rate 0.1]
+    python stubs.py llm [--port 8002] [--latency 0.2] [--token-rate 50]
+"""
+import json
+import time
+import random
+import argparse
+import threading
+from collections import namedtuple
+from urllib.parse import parse_qs
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+from kafka.structs import TopicPartition
+
+from samples import SAMPLE_SRT, raw_text, canned_response
+
+StubRecord = namedtuple('StubRecord', ['topic', 'partition', 'offset', 'timestamp', 'key', 'value'])
+
+
+class StubSttServer:
+    """
+    HTTP server answering every POST like the STT service, with the transcript of SAMPLE_SRT.
+
+    Attributes:
+        host (str): The interface to listen on.
+        port (int): The port to listen on; 0 picks a free port.
+        latency (float): Seconds waited before answering, simulating the transcription time.
+        error_rate (float): Probability of answering 503 instead of the transcript.
+        requests (int): Number of requests received.
+        connections (int): Number of TCP connections accepted.
+
+    Methods:
+        start() -> str:
+            Starts serving in a background thread and returns the URL of the service.
+        stop():
+            Stops the server.
+    """
+    def __init__(self, host: str = '127.0.0.1', port: int = 0, latency: float = 0.0, error_rate: float = 0.0,
+                 srt: str = SAMPLE_SRT):
+        self.host = host
+        self.port = port
+        self.latency = latency
+        self.error_rate = error_rate
+        self.srt = srt
+        self.requests = 0
+        self.connections = 0
+        self._lock = threading.Lock()
+        self._server = None
+
+    def start(self) -> str:
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+
+            def setup(self):
+                super().setup()
+                with stub._lock:
+                    stub.connections += 1
+
+            def do_POST(self):
+                length = int(self.headers.get('Content-Length', 0))
+                payload = parse_qs(self.rfile.read(length).decode('utf-8'))
+                with stub._lock:
+                    stub.requests += 1
+                time.sleep(stub.latency)
+
+                if random.random() < stub.error_rate:
+                    self._answer(503, {'code': 503, 'message': 'unavailable'})
+                elif not payload.get('input'):
+                    self._answer(200, {'code': 400, 'message': 'missing input'})
+                else:
+                    self._answer(200, {'code': 200, 'data': {'raw': raw_text(stub.srt), 'srt': stub.srt}})
+
+            def _answer(self, status: int, body: dict):
+                data = json.dumps(body).encode('utf-8')
+                self.send_response(status)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+            def log_message(self, format, *args):
+                pass
+
+        self._server = ThreadingHTTPServer((self.host, self.port), Handler)
+        self._server.daemon_threads = True
+        self.port = self._server.server_address[1]
+        threading.Thread(target=self._server.serve_forever, daemon=True).start()
+        return f'http://{self.host}:{self.port}/'
+
+    def stop(self):
+        if self._server is not None:
+            self._server.shutdown()
+            self._server.server_close()
+
+
+class StubLlmServer:
+    """
+    HTTP server answering every POST to a `chat/completions` path like an OpenAI-compatible model, with the
+    canned result of the prompted analysis task, so the real ChatOpenAI client and output parsers are exercised.
+
+    The answer takes `latency` seconds plus the time to generate its completion tokens at `token_rate` tokens
+    per second. Streamed requests are answered with server-sent events, one chunk of about 4 tokens at a time.
+    Token counts are estimated at 4 characters per token.
+
+    Attributes:
+        host (str): The interface to listen on.
+        port (int): The port to listen on; 0 picks a free port.
+        latency (float): Seconds waited before the first token, simulating the prompt processing.
+        token_rate (float): Completion tokens generated per second; 0 answers at once.
+        requests (int): Number of requests received.
+
+    Methods:
+        start() -> str:
+            Starts serving in a background thread and returns the base URL of the API, to use as LLM_HOST.
+        stop():
+            Stops the server.
+    """
+    def __init__(self, host: str = '127.0.0.1', port: int = 0, latency: float = 0.0, token_rate: float = 0.0):
+        self.host = host
+        self.port = port
+        self.latency = latency
+        self.token_rate = token_rate
+        self.requests = 0
+        self._lock = threading.Lock()
+        self._server = None
+
+    def start(self) -> str:
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+
+            def do_POST(self):
+                length = int(self.headers.get('Content-Length', 0))
+                body = json.loads(self.rfile.read(length) or b'{}')
+                if not self.path.rstrip('/').endswith('chat/completions'):
+                    self._answer(404, {'error': {'message': f'unknown path {self.path}'}})
+                    return
+                with stub._lock:
+                    stub.requests += 1
+
+                prompt = '\n'.join(str(message.get('content', '')) for message in body.get('messages', []))
+                content = canned_response(prompt)
+                usage = {'prompt_tokens': len(prompt) // 4, 'completion_tokens': len(content) // 4}
+                usage['total_tokens'] = usage['prompt_tokens'] + usage['completion_tokens']
+                completion = {'id': f'chatcmpl-{stub.requests}', 'created': int(time.time()),
+                              'model': body.get('model', 'stub')}
+                time.sleep(stub.latency)
+
+                if body.get('stream'):
+                    self._stream(completion, content, usage)
+                else:
+                    time.sleep(stub._generation_time(usage['completion_tokens']))
+                    self._answer(200, {**completion, 'object': 'chat.completion', 'usage': usage, 'choices': [{
+                        'index': 0, 'finish_reason': 'stop',
+                        'message': {'role': 'assistant', 'content': content}
+                    }]})
+
+            def _stream(self, completion: dict, content: str, usage: dict):
+                # Without a content length the end of the stream is the end of the connection
+                self.close_connection = True
+                self.send_response(200)
+                self.send_header('Content-Type', 'text/event-stream')
+                self.send_header('Connection', 'close')
+                self.end_headers()
+                for start in range(0, len(content), 16):
+                    piece = content[start:start + 16]
+                    time.sleep(stub._generation_time(len(piece) // 4))
+                    self._event({**completion, 'object': 'chat.completion.chunk', 'choices': [{
+                        'index': 0, 'finish_reason': None, 'delta': {'role': 'assistant', 'content': piece}
+                    }]})
+                self._event({**completion, 'object': 'chat.completion.chunk', 'usage': usage, 'choices': [{
+                    'index': 0, 'finish_reason': 'stop', 'delta': {}
+                }]})
+                self.wfile.write(b'data: [DONE]\n\n')
+
+            def _event(self, chunk: dict):
+                self.wfile.write(b'data: ' + json.dumps(chunk).encode('utf-8') + b'\n\n')
+                self.wfile.flush()
+
+            def _answer(self, status: int, body: dict):
+                data = json.dumps(body).encode('utf-8')
+                self.send_response(status)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+            def log_message(self, format, *args):
+                pass
+
+        self._server = ThreadingHTTPServer((self.host, self.port), Handler)
+        self._server.daemon_threads = True
+        self.port = self._server.server_address[1]
+        threading.Thread(target=self._server.serve_forever, daemon=True).start()
+        return f'http://{self.host}:{self.port}/v1'
+
+    def stop(self):
+        if self._server is not None:
+            self._server.shutdown()
+            self._server.server_close()
+
+    def _generation_time(self, tokens: int) -> float:
+        return tokens / self.token_rate if self.token_rate else 0.0
+
+
+class InMemoryBroker:
+    """
+    In-process stand-in of a Kafka broker, holding the records of every partition in memory.
+
+    Records are spread over the partitions of a topic by key, or round-robin without key. A consumer
+    created by `consumer` is assigned every partition of its topic and starts from the committed offsets.
+
+    Attributes:
+        partitions (int): Number of partitions of every topic.
+
+    Methods:
+        send(topic, value, key=None) -> StubRecord:
+            Appends a record to a partition of `topic` and returns it.
+        consumer(topic, listener=None, max_poll_records=500) -> StubConsumer:
+            Creates a consumer of `topic`, subscribed with `listener`.
+        producer() -> StubProducer:
+            Creates a producer sending to the broker.
+        records(topic) -> list:
+            Returns the records of `topic` in every partition.
+        committed(topic) -> dict:
+            Returns the committed offset of every partition of `topic`.
+    """
+    def __init__(self, partitions: int = 1):
+        self.partitions = partitions
+        self._logs = {}
+        self._committed = {}
+        self._next = 0
+        self._condition = threading.Condition()
+
+    def send(self, topic: str, value: bytes, key: bytes = None) -> StubRecord:
+        with self._condition:
+            if key is not None:
+                partition = hash(key) % self.partitions
+            else:
+                partition, self._next = self._next % self.partitions, self._next + 1
+            log = self._logs.setdefault(TopicPartition(topic, partition), [])
+            record = StubRecord(topic, partition, len(log), int(time.time() * 1000), key, value)
+            log.append(record)
+            self._condition.notify_all()
+            return record
+
+    def consumer(self, topic: str, listener=None, max_poll_records: int = 500):
+        consumer = StubConsumer(self, max_poll_records=max_poll_records)
+        consumer.subscribe([topic], listener=listener)
+        return consumer
+
+    def producer(self):
+        return StubProducer(self)
+
+    def records(self, topic: str) -> list:
+        with self._condition:
+            return [record for tp, log in self._logs.items() if tp.topic == topic for record in log]
+
+    def committed(self, topic: str) -> dict:
+        with self._condition:
+            return {tp: offset for tp, offset in self._committed.items() if tp.topic == topic}
+
+
+class StubConsumer:
+    """
+    Consumer of an InMemoryBroker implementing the subset of KafkaConsumer used by the runtime:
+    subscribe, poll, seek, pause, resume, paused, assignment, position, highwater, commit and close.
+    """
+    def __init__(self, broker: InMemoryBroker, max_poll_records: int = 500):
+        self.broker = broker
+        self.config = {'max_poll_records': max_poll_records}
+        self._positions = {}
+        self._paused = set()
+
+    def subscribe(self, topics: list, listener=None):
+        with self.broker._condition:
+            for topic in topics:
+                for partition in range(self.broker.partitions):
+                    tp = TopicPartition(topic, partition)
+                    self._positions[tp] = self.broker._committed.get(tp, 0)
+        if listener is not None:
+            listener.on_partitions_assigned(set(self._positions))
+
+    def poll(self, timeout_ms: int = 0, max_records: int = None) -> dict:
+        """
+        Returns the next records of the partitions that are not paused, waiting up to `timeout_ms` for one.
+        """
+        max_records = max_records or self.config['max_poll_records']
+        deadline = time.monotonic() + timeout_ms / 1000
+        with self.broker._condition:
+            while True:
+                records, count = {}, 0
+                for tp, position in self._positions.items():
+                    if tp in self._paused or count >= max_records:
+                        continue
+                    fetched = self.broker._logs.get(tp, [])[position:position + max_records - count]
+                    if fetched:
+                        records[tp] = fetched
+                        self._positions[tp] = position + len(fetched)
+                        count += len(fetched)
+                remaining = deadline - time.monotonic()
+                if records or remaining <= 0:
+                    return records
+                self.broker._condition.wait(remaining)
+
+    def seek(self, tp, offset: int):
+        self._positions[tp] = offset
+
+    def pause(self, *tps):
+        self._paused.update(tps)
+
+    def resume(self, *tps):
+        self._paused.difference_update(tps)
+
+    def paused(self) -> set:
+        return set(self._paused)
+
+    def assignment(self) -> set:
+        return set(self._positions)
+
+    def position(self, tp) -> int:
+        return self._positions[tp]
+
+    def highwater(self, tp) -> int:
+        with self.broker._condition:
+            return len(self.broker._logs.get(tp, []))
+
+    def commit(self, offsets: dict = None):
+        with self.broker._condition:
+            for tp, offset in (offsets or {}).items():
+                self.broker._committed[tp] = getattr(offset, 'offset', offset)
+
+    def close(self):
+        pass
+
+
+class StubFuture:
+    """
+    Already resolved send future of a StubProducer, calling its callbacks as soon as they are added.
+    """
+    def __init__(self, record: StubRecord):
+        self.record = record
+
+    def add_callback(self, callback):
+        callback(self.record)
+        return self
+
+    def add_errback(self, errback):
+        return self
+
+    def get(self, timeout: float = None) -> StubRecord:
+        return self.record
+
+
+class StubProducer:
+    """
+    Producer of an InMemoryBroker implementing the subset of KafkaProducer used by the workers: send and flush.
+    Records are appended to the broker at once and acknowledged immediately.
+    """
+    def __init__(self, broker: InMemoryBroker):
+        self.broker = broker
+
+    def send(self, topic: str, value: bytes, key: bytes = None) -> StubFuture:
+        return StubFuture(self.broker.send(topic, value, key=key))
+
+    def flush(self, timeout: float = None):
+        pass
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('service', choices=['stt', 'llm'])
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8001)
+    parser.add_argument('--latency', type=float, default=0.0)
+    parser.add_argument('--error-rate', type=float, default=0.0, help='stt only')
+    parser.add_argument('--token-rate', type=float, default=0.0, help='llm only')
+    args = parser.parse_args()
+
+    if args.service == 'stt':
+        server = StubSttServer(args.host, args.port, args.latency, args.error_rate)
+    else:
+        server = StubLlmServer(args.host, args.port, args.latency, args.token_rate)
+    print(f'{args.service} stub listening on {server.start()}')
+    try:
+        while True:
+            time.sleep(1)
+    except KeyboardInterrupt:
+        server.stop()
+
+
+if __name__ == '__main__':
+    main()
@@ -1,53 +1,144 @@
-from kafka_helper import consumer_audio, consumer_video, consumer_document
+from kafka_helper import create_consumer, flush, serializer
 """
-This script initializes and starts three separate threads to handle audio, video, and document processing using 
-Kafka consumers. The threads run continuously until a KeyboardInterrupt is received, at which point the Kafka 
-consumers are closed and the threads are joined with a timeout.
+This script starts the asyncio runtime that handles audio, video, and document processing using Kafka consumers.
+Each topic runs its own processing pool and keeps up to a configurable number of messages in flight, so STT
+requests and language model calls of many messages overlap instead of being handled one at a time. Offsets are
+committed in order once the results are produced.
+
+By default the three topics share the event loop of a single process. When more than one process is configured
+for a topic, the script becomes a launcher: it starts the configured number of worker processes per topic, each
+with its own consumer in the shared consumer group, so the partitions of a topic are spread over every core and
+every pod. Revoked partitions are handed off gracefully during rebalances.
 
 Modules:
-    kafka_helper: Contains Kafka consumer instances for audio, video, and document processing.
-    workers: Contains worker functions for processing audio, video, and documents.
+    kafka_helper: Creates the Kafka consumers of the audio, video, and document topics.
+    runtime: Contains the per-topic processing pool.
+    metrics: Serves the metrics of the process on a /metrics endpoint.
+    workers: Contains the pipelines processing audio, video, and documents, and the clients they share.
 
 Functions:
-    audio_worker: Function to process audio data.
-    video_worker: Function to process video data.
-    document_worker: Function to process document data.
-
-Threads:
-    thread1: Thread to run the audio_worker function.
-    thread2: Thread to run the video_worker function.
-    thread3: Thread to run the document_worker function.
+    create_pool: Creates the processing pool of a topic.
+    main: Runs the processing pools of the given topics concurrently.
+    serve: Runs the processing pools of the given topics in the current process.
+    launch: Starts and supervises the worker processes.
 
 Execution:
-    The script starts the threads and keeps the main program running with an infinite loop. 
-    On receiving a KeyboardInterrupt, it closes the Kafka consumers and joins the threads with a timeout.
+    python app.py [--topics audio,video,document] [--processes N]
+    The script runs until interrupted. On receiving a KeyboardInterrupt or SIGTERM, every process cancels its
+    in-flight messages, commits the offsets of the processed messages, closes its Kafka consumers and flushes
+    the results pending in its producer.
 """
-from workers import audio_worker, video_worker, document_worker
-import threading
-import time
-
-thread1 = threading.Thread(target=audio_worker)
-thread2 = threading.Thread(target=video_worker)
-thread3 = threading.Thread(target=document_worker)
-
-# Start the threads
-thread1.start()
-thread2.start()
-thread3.start()
-
-try:
-    # Keep the main program running to allow threads to continue working
-    while True:
-        time.sleep(1)
-except KeyboardInterrupt:
-    pass
-finally:
-    consumer_audio.close()
-    consumer_video.close()
-    consumer_document.close()
-    # Optionally, join threads if you want to wait for them to finish after cleanup
-    thread1.join(timeout=1)
-    thread2.join(timeout=1)
-    thread3.join(timeout=1)
-
-    print("All functions have been terminated.")
\ No newline at end of file
+from constant import (
+    MAX_IN_FLIGHT, QUEUE_SIZE, COMMIT_INTERVAL_MS, HANDOFF_TIMEOUT_MS, REDELIVERY_BACKOFF_MS, PROCESSES,
+    PRODUCER_FLUSH_TIMEOUT_MS, METRICS_HOST, METRICS_PORT, LLM_HEALTH_INTERVAL_MS, settings
+)
+from runtime import TopicPool
+from metrics import start_server
+from tracing import log
+from workers import PIPELINES, Resources, create_pipeline
+import multiprocessing
+import argparse
+import asyncio
+import signal
+
+
+def create_pool(topic: str, resources: Resources) -> TopicPool:
+    """
+    Creates the processing pool of `topic` from the configured limits, processing the messages with the pipeline
+    of the topic.
+    """
+    return TopicPool(
+        lambda listener: create_consumer(topic, listener=listener),
+        create_pipeline(topic, resources).process,
+        concurrency=MAX_IN_FLIGHT[topic],
+        queue_size=QUEUE_SIZE[topic],
+        commit_interval=COMMIT_INTERVAL_MS / 1000,
+        handoff_timeout=HANDOFF_TIMEOUT_MS / 1000,
+        redelivery_backoff=REDELIVERY_BACKOFF_MS / 1000,
+        name=topic
+    )
+
+
+async def main(topics, resources: Resources):
+    """
+    Runs the processing pools of `topics` concurrently until cancelled, checking the health of the language
+    model endpoints in the background. SIGTERM cancels the pools like a KeyboardInterrupt does.
+    """
+    asyncio.get_running_loop().add_signal_handler(signal.SIGTERM, asyncio.current_task().cancel)
+    monitor = None
+    if LLM_HEALTH_INTERVAL_MS:
+        monitor = asyncio.create_task(resources.llm_router.monitor(LLM_HEALTH_INTERVAL_MS / 1000))
+    try:
+        await asyncio.gather(*(create_pool(topic, resources).run() for topic in topics))
+    finally:
+        if monitor is not None:
+            monitor.cancel()
+        await resources.aclose()
+        await asyncio.to_thread(flush, PRODUCER_FLUSH_TIMEOUT_MS / 1000)
+
+
+def serve(topics, metrics_port: int = METRICS_PORT):
+    """
+    Runs the processing pools of `topics` in the current process until interrupted, serving the metrics of the
+    process on `metrics_port` unless METRICS_PORT is 0. The clients are created here, so a worker process started
+    by `launch` only creates the clients of its own topic.
+    """
+    log('settings', topics=list(topics), **settings.dict())
+    log('serializer', backend=serializer.name)
+    resources = Resources(topics)
+    # The extraction processes start before the metrics server and the event loop start their threads
+    resources.start()
+    if METRICS_PORT:
+        start_server(METRICS_HOST, metrics_port)
+    try:
+        asyncio.run(main(topics, resources))
+    except (KeyboardInterrupt, asyncio.CancelledError):
+        pass
+    finally:
+        for name, cache in (('analyze', resources.analyze_cache), ('stt', resources.stt_cache)):
+            if cache is not None:
+                log('cache_stats', cache=name, **cache.stats())
+
+        log('terminated', topics=list(topics))
+
+
+def launch(processes: dict):
+    """
+    Starts `processes[topic]` worker processes per topic and waits for them.
+    SIGTERM is forwarded to the worker processes so they commit and leave the consumer group before exiting.
+    """
+    context = multiprocessing.get_context('spawn')
+    names = [(topic, f'{topic}-{index}') for topic, count in processes.items() for index in range(count)]
+    # Every worker process serves its own metrics, on the ports following METRICS_PORT
+    workers = [
+        context.Process(target=serve, args=((topic,), METRICS_PORT + number + 1), name=name)
+        for number, (topic, name) in enumerate(names)
+    ]
+    for worker in workers:
+        worker.start()
+    log('processes_started', processes=[worker.name for worker in workers])
+
+    signal.signal(signal.SIGTERM, lambda signum, frame: [worker.terminate() for worker in workers])
+    try:
+        for worker in workers:
+            worker.join()
+    except KeyboardInterrupt:
+        # The worker processes received the interrupt as well
+        for worker in workers:
+            worker.join()
+
+    log('terminated', processes=[worker.name for worker in workers])
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Runs the news analyzer workers.")
+    parser.add_argument('--topics', default=','.join(PIPELINES), help='comma separated topics to consume')
+    parser.add_argument('--processes', type=int, help='worker processes per topic; overrides PROCESSES_<TOPIC>')
+    args = parser.parse_args()
+
+    topics = tuple(topic.strip() for topic in args.topics.split(',') if topic.strip())
+    processes = {topic: args.processes or PROCESSES[topic] for topic in topics}
+    if all(count == 1 for count in processes.values()):
+        serve(topics)
+    else:
+        launch(processes)
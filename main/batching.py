@@ -0,0 +1,95 @@
+"""
+This module groups the analyze calls of concurrently processed messages into micro-batches.
+
+Messages fetched by one poll reach the analysis step at about the same time. Instead of sending their requests
+one message at a time, the workers submit their text to a MicroBatcher which waits up to a short window for
+more texts with the same analysis settings and sends them together with AnalysisPipeline.aanalyze_many, so an
+inference server with continuous batching receives them together.
+
+The metadata of every text, e.g. the trace of its message, is attached to the requests of that text, and the
+batches run outside of the context of the message that happened to start them.
+
+Classes:
+    MicroBatcher: Groups concurrent analyze calls into batches bounded in size and waiting time.
+"""
+import asyncio
+import contextvars
+
+
+class MicroBatcher:
+    """
+    Groups concurrent analyze calls into micro-batches.
+
+    Attributes:
+        pipeline (AnalysisPipeline): The pipeline analyzing the batches.
+        max_batch_size (int): Number of texts that triggers sending a batch immediately.
+        max_wait_ms (int): Maximum time a text waits for the batch to fill up.
+
+    Methods:
+        analyze(text: str, mode: str = None, tasks=None, metadata: dict = None) -> dict:
+            Analyzes `text` as part of the next batch with the same mode and tasks.
+    """
+    def __init__(self, pipeline, max_batch_size: int = 16, max_wait_ms: int = 50):
+        self.pipeline = pipeline
+        self.max_batch_size = max_batch_size
+        self.max_wait_ms = max_wait_ms
+        self._pending = {}
+        self._timers = {}
+        self._tasks = set()
+
+    async def analyze(self, text: str, mode: str = None, tasks=None, metadata: dict = None) -> dict:
+        """
+        Analyzes the given text as part of a batch.
+
+        Args:
+            text (str): The text to be analyzed.
+            mode (str): 'split' or 'combined'; defaults to the mode of the pipeline.
+            tasks (Iterable[str]): The sub-analyses to run; defaults to the tasks of the pipeline.
+            metadata (dict): Optional metadata attached to the requests of `text`.
+
+        Returns:
+            dict: The result of the analysis of `text`.
+
+        Raises:
+            Exception: The error of the analysis of `text`; the other texts of the batch are not affected.
+        """
+        key = (mode, tuple(tasks) if tasks is not None else None)
+        future = asyncio.get_running_loop().create_future()
+        batch = self._pending.setdefault(key, [])
+        batch.append((text, metadata, future))
+
+        if len(batch) >= self.max_batch_size:
+            self._flush(key)
+        elif len(batch) == 1:
+            self._timers[key] = asyncio.get_running_loop().call_later(self.max_wait_ms / 1000, self._flush, key)
+        return await future
+
+    def _flush(self, key: tuple):
+        """
+        Sends the pending batch of `key`.
+        """
+        timer = self._timers.pop(key, None)
+        if timer is not None:
+            timer.cancel()
+        batch = self._pending.pop(key, None)
+        if batch:
+            task = contextvars.Context().run(asyncio.create_task, self._run(key, batch))
+            self._tasks.add(task)
+            task.add_done_callback(self._tasks.discard)
+
+    async def _run(self, key: tuple, batch: list):
+        mode, tasks = key
+        texts = [text for text, _, _ in batch]
+        metadata = [item for _, item, _ in batch]
+        try:
+            results = await self.pipeline.aanalyze_many(texts, mode, tasks, return_exceptions=True, metadata=metadata)
+        except Exception as e:
+            results = [e] * len(batch)
+
+        for (_, _, future), result in zip(batch, results):
+            if future.done():
+                continue
+            if isinstance(result, Exception):
+                future.set_exception(result)
+            else:
+                future.set_result(result)
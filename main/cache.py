@@ -0,0 +1,245 @@
+"""
+This module provides the result caches placed in front of the language model and speech-to-text calls.
+
+Keys are content hashes built with `make_key`, so the same article or media file re-published, retried or
+replayed after a restart is served from the cache instead of being analyzed again. Two backends are available:
+an in-process LRU cache and an SQLite cache that survives restarts. Both evict the least recently used entries
+beyond `max_entries` and treat entries older than `ttl` seconds as missing.
+
+The async callers use `aget` and `aset`, which run the queries of the SQLite cache in a worker thread, so the
+disk I/O never blocks the event loop. The in-memory cache answers them directly.
+
+Classes:
+    ResultCache: Base class keeping the hit and miss counters.
+    MemoryCache: In-process LRU/TTL cache.
+    SQLiteCache: On-disk LRU/TTL cache backed by SQLite.
+
+Functions:
+    normalize_text: Normalizes text so that insignificant differences do not change its key.
+    make_key: Builds a cache key from its parts.
+    create_cache: Creates a cache from the backend name.
+"""
+import json
+import time
+import asyncio
+import sqlite3
+import hashlib
+import threading
+import unicodedata
+from collections import OrderedDict
+
+
+def normalize_text(text: str) -> str:
+    """
+    Normalizes the unicode form and the whitespace of the given text.
+
+    Args:
+        text (str): The text to normalize.
+
+    Returns:
+        str: The text in NFC form with every run of whitespace collapsed into a single space.
+    """
+    return ' '.join(unicodedata.normalize('NFC', text).split())
+
+
+def make_key(*parts: str) -> str:
+    """
+    Builds a cache key from its parts, e.g. the task, the model name, the prompt version and the input.
+
+    Args:
+        *parts (str): The parts identifying the cached result.
+
+    Returns:
+        str: The SHA-256 hex digest of the parts.
+    """
+    digest = hashlib.sha256()
+    for part in parts:
+        digest.update(str(part).encode('utf-8'))
+        digest.update(b'\0')
+    return digest.hexdigest()
+
+
+class ResultCache:
+    """
+    Base class of the result caches.
+
+    Attributes:
+        hits (int): Number of lookups answered from the cache.
+        misses (int): Number of lookups that found no valid entry.
+        blocking (bool): Whether the lookups block on I/O, so the async methods run them in a worker thread.
+
+    Methods:
+        get(key: str):
+            Returns the cached value of `key`, or None.
+        set(key: str, value):
+            Stores a JSON serializable value under `key`.
+        aget(key: str), aset(key: str, value):
+            Asynchronous counterparts of `get` and `set`, which never block the event loop.
+        stats() -> dict:
+            Returns the hit and miss counters and the hit ratio.
+    """
+    blocking = False
+
+    def __init__(self):
+        self.hits = 0
+        self.misses = 0
+        # The lookups come from the event loop and from the worker threads at once
+        self._counters_lock = threading.Lock()
+
+    def get(self, key: str):
+        value = self._get(key)
+        with self._counters_lock:
+            if value is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+        return value
+
+    def set(self, key: str, value):
+        self._set(key, value)
+
+    async def aget(self, key: str):
+        if self.blocking:
+            return await asyncio.to_thread(self.get, key)
+        return self.get(key)
+
+    async def aset(self, key: str, value):
+        if self.blocking:
+            await asyncio.to_thread(self.set, key, value)
+        else:
+            self.set(key, value)
+
+    def stats(self) -> dict:
+        with self._counters_lock:
+            hits, misses = self.hits, self.misses
+        total = hits + misses
+        return {
+            'hits': hits,
+            'misses': misses,
+            'hit_ratio': hits / total if total else 0.0
+        }
+
+    def _get(self, key: str):
+        raise NotImplementedError
+
+    def _set(self, key: str, value):
+        raise NotImplementedError
+
+
+class MemoryCache(ResultCache):
+    """
+    In-process LRU cache with a time to live.
+
+    Attributes:
+        max_entries (int): Maximum number of entries kept.
+        ttl (float): Number of seconds an entry stays valid; None keeps entries until evicted.
+    """
+    def __init__(self, max_entries: int = 10000, ttl: float = None):
+        super().__init__()
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _get(self, key: str):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            expires_at, value = entry
+            if expires_at is not None and expires_at < time.time():
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return value
+
+    def _set(self, key: str, value):
+        expires_at = time.time() + self.ttl if self.ttl else None
+        with self._lock:
+            self._entries[key] = (expires_at, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+
+class SQLiteCache(ResultCache):
+    """
+    On-disk LRU cache with a time to live, backed by an SQLite database.
+
+    Attributes:
+        path (str): Path of the SQLite database file.
+        table (str): Name of the table holding the entries, so several caches can share a database.
+        max_entries (int): Maximum number of entries kept.
+        ttl (float): Number of seconds an entry stays valid; None keeps entries until evicted.
+    """
+    blocking = True
+
+    def __init__(self, path: str, table: str = 'cache', max_entries: int = 100000, ttl: float = None):
+        super().__init__()
+        self.path = path
+        self.table = table
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._connection = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._connection.execute('PRAGMA journal_mode=WAL')
+        self._connection.execute(
+            f'CREATE TABLE IF NOT EXISTS {table} '
+            '(key TEXT PRIMARY KEY, value TEXT NOT NULL, expires_at REAL, accessed_at REAL NOT NULL)'
+        )
+        self._connection.execute(f'CREATE INDEX IF NOT EXISTS {table}_accessed_at ON {table} (accessed_at)')
+
+    def _get(self, key: str):
+        now = time.time()
+        with self._lock:
+            row = self._connection.execute(
+                f'SELECT value, expires_at FROM {self.table} WHERE key = ?', (key,)
+            ).fetchone()
+            if row is None:
+                return None
+            value, expires_at = row
+            if expires_at is not None and expires_at < now:
+                self._connection.execute(f'DELETE FROM {self.table} WHERE key = ?', (key,))
+                return None
+            self._connection.execute(f'UPDATE {self.table} SET accessed_at = ? WHERE key = ?', (now, key))
+        return json.loads(value)
+
+    def _set(self, key: str, value):
+        now = time.time()
+        expires_at = now + self.ttl if self.ttl else None
+        with self._lock:
+            self._connection.execute(
+                f'INSERT OR REPLACE INTO {self.table} (key, value, expires_at, accessed_at) VALUES (?, ?, ?, ?)',
+                (key, json.dumps(value), expires_at, now)
+            )
+            self._connection.execute(
+                f'DELETE FROM {self.table} WHERE key IN '
+                f'(SELECT key FROM {self.table} ORDER BY accessed_at DESC LIMIT -1 OFFSET ?)',
+                (self.max_entries,)
+            )
+
+
+def create_cache(backend: str, namespace: str, path: str = None, max_entries: int = 10000, ttl: float = None):
+    """
+    Creates a result cache.
+
+    Args:
+        backend (str): 'memory', 'sqlite' or 'none'.
+        namespace (str): Name separating this cache from the others sharing the same database.
+        path (str): Path of the SQLite database file, used by the 'sqlite' backend.
+        max_entries (int): Maximum number of entries kept.
+        ttl (float): Number of seconds an entry stays valid; None or 0 keeps entries until evicted.
+
+    Returns:
+        ResultCache: The cache, or None when caching is disabled.
+
+    Raises:
+        ValueError: If the backend is unknown.
+    """
+    if backend == 'none':
+        return None
+    if backend == 'memory':
+        return MemoryCache(max_entries=max_entries, ttl=ttl)
+    if backend == 'sqlite':
+        return SQLiteCache(path, table=namespace, max_entries=max_entries, ttl=ttl)
+    raise ValueError(f'unknown cache backend: {backend}')
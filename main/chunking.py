@@ -0,0 +1,233 @@
+"""
+This module splits long inputs into chunks for the map-reduce analysis mode and merges the chunk results.
+
+Subtitle text is split on its cue blocks so that no subtitle is cut and every chunk keeps the timestamps the
+segmentation relies on. Plain text is split on paragraphs, then on sentences and finally on words
+when a single piece is still too long. Chunks are packed up to a token budget.
+
+Functions:
+    estimate_tokens: Estimates the number of tokens of a text.
+    is_srt: Tells whether a text is subtitle text, with or without .srt counters.
+    split_cues: Splits subtitle text into its cue blocks.
+    split_srt: Splits subtitle text on cue boundaries.
+    split_paragraphs: Splits plain text on paragraphs.
+    split_text: Splits a text with the splitter matching its format.
+    merge_segments: Merges the NewsSegments results of the chunks.
+    merge_grammar_errors: Merges and deduplicates the GrammarErrors results of the chunks.
+    merge_news_info: Merges the NewsInfo results of the chunks.
+"""
+import re
+from typing import Callable, List
+
+SRT_TIMESTAMP = re.compile(r'^\s*\d{1,2}:\d{2}:\d{2}(?:[,.]\d+)?\s*-->')
+PARAGRAPH_BREAK = re.compile(r'\n\s*\n')
+SENTENCE_BREAK = re.compile(r'(?<=[.!?…])\s+')
+
+
+def estimate_tokens(text: str) -> int:
+    """
+    Estimates the number of tokens of the given text, assuming four characters per token.
+
+    Args:
+        text (str): The text to measure.
+
+    Returns:
+        int: The estimated number of tokens.
+    """
+    return (len(text) + 3) // 4
+
+
+def _is_counter(line: str, next_line: str) -> bool:
+    """
+    Tells whether `line` is the numeric counter of a standard .srt cue, i.e. a number followed by a timestamp range.
+    """
+    return line.strip().isdigit() and bool(SRT_TIMESTAMP.match(next_line))
+
+
+def is_srt(text: str) -> bool:
+    """
+    Tells whether the given text is subtitle text: its first line starts with a timestamp range, or its second
+    one does after the counter of a standard .srt file.
+    """
+    lines = [line for line in text.splitlines() if line.strip()][:2]
+    if not lines:
+        return False
+    return bool(SRT_TIMESTAMP.match(lines[0])) or len(lines) == 2 and _is_counter(*lines)
+
+
+def split_cues(text: str) -> List[str]:
+    """
+    Splits subtitle text into its cue blocks, without the blank lines between them.
+
+    A cue opens with the counter of a standard .srt file, or with its timestamp range when it has no counter;
+    the following lines up to the next cue are its text.
+
+    Args:
+        text (str): The subtitle text.
+
+    Returns:
+        List[str]: The cues, each made of its lines.
+    """
+    lines = [line for line in text.splitlines() if line.strip()]
+    cues, counted = [], False
+    for index, line in enumerate(lines):
+        next_line = lines[index + 1] if index + 1 < len(lines) else ''
+        if _is_counter(line, next_line):
+            cues.append([line])
+            counted = True
+        elif SRT_TIMESTAMP.match(line) and not counted or not cues:
+            cues.append([line])
+        else:
+            cues[-1].append(line)
+            counted = False
+    return ['\n'.join(cue) for cue in cues]
+
+
+def _pack(pieces: List[str], max_tokens: int, count_tokens: Callable[[str], int], separator: str) -> List[str]:
+    """
+    Packs consecutive pieces into chunks of at most `max_tokens` tokens.
+    A single piece larger than the budget becomes a chunk of its own.
+    """
+    chunks, current, size = [], [], 0
+    for piece in pieces:
+        tokens = count_tokens(piece)
+        if current and size + tokens > max_tokens:
+            chunks.append(separator.join(current))
+            current, size = [], 0
+        current.append(piece)
+        size += tokens
+    if current:
+        chunks.append(separator.join(current))
+    return chunks
+
+
+def split_srt(text: str, max_tokens: int, count_tokens: Callable[[str], int] = estimate_tokens) -> List[str]:
+    """
+    Splits subtitle text into chunks on the boundaries of its cues, see `split_cues`. Cues are never cut.
+
+    Args:
+        text (str): The subtitle text.
+        max_tokens (int): Token budget of a chunk.
+        count_tokens (Callable[[str], int]): Function counting the tokens of a text.
+
+    Returns:
+        List[str]: The chunks.
+    """
+    return _pack(split_cues(text), max_tokens, count_tokens, '\n')
+
+
+def split_paragraphs(text: str, max_tokens: int, count_tokens: Callable[[str], int] = estimate_tokens) -> List[str]:
+    """
+    Splits plain text into chunks on paragraphs.
+
+    A paragraph larger than the budget is split on sentences, and a sentence larger than the budget on words.
+
+    Args:
+        text (str): The plain text.
+        max_tokens (int): Token budget of a chunk.
+        count_tokens (Callable[[str], int]): Function counting the tokens of a text.
+
+    Returns:
+        List[str]: The chunks.
+    """
+    pieces = []
+    for paragraph in PARAGRAPH_BREAK.split(text.strip()):
+        if count_tokens(paragraph) <= max_tokens:
+            pieces.append(paragraph)
+            continue
+        for sentence in SENTENCE_BREAK.split(paragraph):
+            if count_tokens(sentence) <= max_tokens:
+                pieces.append(sentence)
+            else:
+                pieces.extend(_pack(sentence.split(), max_tokens, count_tokens, ' '))
+    return _pack(pieces, max_tokens, count_tokens, '\n\n')
+
+
+def split_text(text: str, max_tokens: int, count_tokens: Callable[[str], int] = estimate_tokens) -> List[str]:
+    """
+    Splits the given text with `split_srt` if it is subtitle text, with `split_paragraphs` otherwise.
+    """
+    if is_srt(text):
+        return split_srt(text, max_tokens, count_tokens)
+    return split_paragraphs(text, max_tokens, count_tokens)
+
+
+def _timestamp_key(timestamp: str) -> tuple:
+    """
+    Sort key of an HH:MM:SS timestamp; malformed timestamps sort last.
+    """
+    try:
+        return tuple(int(part) for part in timestamp.split(',')[0].split('.')[0].split(':'))
+    except (AttributeError, ValueError):
+        return (float('inf'),)
+
+
+def merge_segments(results: List[dict]) -> dict:
+    """
+    Merges the NewsSegments results of the chunks, ordered by start timestamp.
+
+    Args:
+        results (List[dict]): The NewsSegments results of the chunks.
+
+    Returns:
+        dict: A NewsSegments result holding the segments of every chunk.
+    """
+    segments = [segment for result in results for segment in result.get('segments', [])]
+    segments.sort(key=lambda segment: _timestamp_key(segment.get('start')))
+    return {'segments': segments}
+
+
+def merge_grammar_errors(results: List[dict]) -> dict:
+    """
+    Merges the GrammarErrors results of the chunks, keeping the first occurrence of every correction.
+
+    Args:
+        results (List[dict]): The GrammarErrors results of the chunks.
+
+    Returns:
+        dict: A GrammarErrors result without duplicated corrections.
+    """
+    seen, errors = set(), []
+    for result in results:
+        for error in result.get('grammar_errors', []):
+            key = (error.get('wrong_word'), error.get('alter_word'))
+            if key not in seen:
+                seen.add(key)
+                errors.append(error)
+    return {'grammar_errors': errors}
+
+
+def _unique(items: list) -> list:
+    seen, unique = set(), []
+    for item in items:
+        key = item.casefold() if isinstance(item, str) else item
+        if key not in seen:
+            seen.add(key)
+            unique.append(item)
+    return unique
+
+
+def merge_news_info(results: List[dict], summary: dict) -> dict:
+    """
+    Merges the NewsInfo results of the chunks.
+
+    Args:
+        results (List[dict]): The NewsInfo results of the chunks.
+        summary (dict): The NewsInfo result of the reduce call made on the chunk summaries,
+            providing the overall summary and title.
+
+    Returns:
+        dict: A NewsInfo result with the overall summary and title, and the deduplicated keywords, tags,
+              spelling corrections and personages of every chunk.
+    """
+    spelling = {}
+    for result in results:
+        spelling.update(result.get('spelling', {}))
+    return {
+        'summary': summary['summary'],
+        'title': summary['title'],
+        'keywords': _unique([kw for result in results for kw in result.get('keywords', [])]),
+        'tags': _unique([tag for result in results for tag in result.get('tags', [])]),
+        'spelling': spelling,
+        'personage': _unique([name for result in results for name in result.get('personage', [])])
+    }
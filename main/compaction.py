@@ -0,0 +1,171 @@
+"""
+This module compacts the texts sent to the language model, since the input tokens drive both the cost and the
+latency of every request.
+
+Subtitle text loses the timestamp ranges the sub-analyses do not need: the text analysis and the grammar check
+get the plain transcript, while the segmentation keeps a compact index, one timestamp range per sentence instead
+of one per subtitle line, in the same 'HH:MM:SS --> HH:MM:SS text' form. Consecutive subtitles repeating the same
+words, a common artifact of speech-to-text, are merged. Plain text loses the boilerplate lines left by the
+article extraction and the lines repeating an earlier one. Whitespace is normalized in both cases.
+
+Classes:
+    Compactor: Compacts the input of a sub-analysis and reports the tokens saved.
+
+Functions:
+    normalize_whitespace: Collapses the runs of spaces and blank lines of a text.
+    parse_srt: Parses subtitle text into (start, end, text) entries.
+    compact_srt: Compacts subtitle text, with or without a timestamp index.
+    compact_plain: Removes the boilerplate and repeated lines of plain text.
+"""
+import re
+from typing import Callable, List, Tuple
+
+from chunking import estimate_tokens, is_srt, split_cues
+from metrics import INPUT_TOKENS_SAVED
+from tracing import log
+
+SRT_ENTRY = re.compile(
+    r'^\s*(\d{1,2}:\d{2}:\d{2})(?:[,.]\d+)?\s*-->\s*(\d{1,2}:\d{2}:\d{2})(?:[,.]\d+)?\s*(.*)$'
+)
+SPACES = re.compile(r'[^\S\n]+')
+BLANK_LINES = re.compile(r'\n\s*\n\s*')
+SENTENCE_END = ('.', '!', '?', '…', '."', '?"', '!"')
+
+# Whole lines left behind by the article extraction
+BOILERPLATE = re.compile(
+    r'^(advertisement|quảng cáo|share|chia sẻ|read more|xem thêm|tin liên quan|related( news| articles)?|'
+    r'bình luận|comments?|print|in bài|follow us|theo dõi|subscribe|đăng ký|tags?|từ khóa)\s*:?$',
+    re.IGNORECASE
+)
+
+
+def normalize_whitespace(text: str) -> str:
+    """
+    Replaces the runs of spaces and tabs with a single space, strips every line and keeps at most one blank
+    line between paragraphs.
+    """
+    lines = (line.strip() for line in SPACES.sub(' ', text).splitlines())
+    return BLANK_LINES.sub('\n\n', '\n'.join(lines)).strip()
+
+
+def parse_srt(text: str) -> List[Tuple[str, str, str]]:
+    """
+    Parses subtitle text into (start, end, text) entries, with HH:MM:SS timestamps, one per cue of
+    `split_cues`. The lines following the timestamp range of a cue are its text; the numeric counters of
+    standard .srt files are dropped, and so are the lines before the first cue.
+    """
+    entries = []
+    for cue in split_cues(text):
+        lines = cue.split('\n')
+        index = next((index for index, line in enumerate(lines) if SRT_ENTRY.match(line)), None)
+        if index is None:
+            continue
+        match = SRT_ENTRY.match(lines[index])
+        words = ' '.join(line.strip() for line in [match.group(3), *lines[index + 1:]] if line.strip())
+        entries.append((match.group(1), match.group(2), words))
+    return entries
+
+
+def _merge_repeats(entries: list) -> list:
+    """
+    Merges the consecutive entries with the same words into one entry spanning them.
+    """
+    merged = []
+    for start, end, words in entries:
+        if merged and words.casefold() == merged[-1][2].casefold():
+            merged[-1][1] = end
+        elif words:
+            merged.append([start, end, words])
+    return merged
+
+
+def compact_srt(text: str, keep_index: bool, index_chars: int = 200) -> str:
+    """
+    Compacts subtitle text.
+
+    Args:
+        text (str): The subtitle text.
+        keep_index (bool): Whether to keep the timestamps. The entries are then grouped into lines ending on a
+            sentence end, or once they reach `index_chars` characters, each with the range of its entries.
+            Otherwise the plain transcript is returned.
+        index_chars (int): The length of a line above which it is closed without a sentence end.
+
+    Returns:
+        str: The compacted text.
+    """
+    entries = _merge_repeats(parse_srt(text))
+    if not keep_index:
+        return ' '.join(words for _, _, words in entries)
+
+    lines, group = [], None
+    for start, end, words in entries:
+        if group is None:
+            group = [start, end, words]
+        else:
+            group[1], group[2] = end, f'{group[2]} {words}'
+        if group[2].endswith(SENTENCE_END) or len(group[2]) >= index_chars:
+            lines.append(f'{group[0]} --> {group[1]} {group[2]}')
+            group = None
+    if group is not None:
+        lines.append(f'{group[0]} --> {group[1]} {group[2]}')
+    return '\n'.join(lines)
+
+
+def compact_plain(text: str) -> str:
+    """
+    Removes the boilerplate lines and the lines repeating an earlier one from plain text, keeping the
+    paragraph breaks.
+    """
+    seen = set()
+    lines = []
+    for line in normalize_whitespace(text).split('\n'):
+        key = line.casefold()
+        if line and (BOILERPLATE.match(line) or key in seen):
+            continue
+        seen.add(key)
+        lines.append(line)
+    return BLANK_LINES.sub('\n\n', '\n'.join(lines)).strip()
+
+
+class Compactor:
+    """
+    Compacts the input of the sub-analyses of AnalysisPipeline before it is sent to the language model.
+
+    Every compaction is observed in INPUT_TOKENS_SAVED and logged with the trace id of its message, so the
+    tokens saved per message add up from the `input_compacted` records of its trace.
+
+    A request covering several tasks keeps the index when one of its tasks needs it, so a combined request
+    without the segmentation gets the plain transcript.
+
+    Attributes:
+        index_tasks (tuple): The tasks keeping the timestamp index of subtitle text.
+        index_chars (int): The length of an index line above which it is closed without a sentence end.
+        count_tokens (Callable[[str], int]): Function counting the tokens of a text.
+
+    Methods:
+        compact(task: str, text: str, trace_id: str = None, tasks: tuple = None) -> str:
+            Returns the compacted input of the request `task`, which answers `tasks`, by default `task` alone.
+    """
+    def __init__(self, index_tasks=('segment',), index_chars: int = 200,
+                 count_tokens: Callable[[str], int] = estimate_tokens):
+        self.index_tasks = tuple(index_tasks)
+        self.index_chars = index_chars
+        self.count_tokens = count_tokens
+
+    def __str__(self):
+        # Part of the cache keys, as the compaction changes the answers
+        return f'compact:{self.index_chars}'
+
+    def compact(self, task: str, text: str, trace_id: str = None, tasks: tuple = None) -> str:
+        if is_srt(text):
+            keep_index = any(name in self.index_tasks for name in tasks or (task,))
+            compacted = compact_srt(text, keep_index, self.index_chars)
+        else:
+            compacted = compact_plain(text)
+
+        before, after = self.count_tokens(text), self.count_tokens(compacted)
+        INPUT_TOKENS_SAVED.observe(before - after, task=task)
+        fields = {'trace_id': trace_id} if trace_id else {}
+        log('input_compacted', task=task, tokens_before=before, tokens_after=after,
+            tokens_saved=before - after, **fields)
+        return compacted
@@ -1,5 +1,12 @@
 import os
-from pydantic import BaseSettings, validator, ValidationError
+from typing import Dict
+
+from tracing import log
+
+try:
+    from pydantic.v1 import BaseSettings, validator, ValidationError
+except ImportError:
+    from pydantic import BaseSettings, validator, ValidationError
 
 class Settings(BaseSettings):
     """
@@ -7,11 +14,100 @@ class Settings(BaseSettings):
 
     Attributes:
         KAFKA_SERVER (str): The Kafka server URL.
+        KAFKA_GROUP_ID (str): The consumer group shared by every process and pod consuming the topics.
+        PARTITION_ASSIGNMENT (str): The partition assignment strategy: 'sticky', 'roundrobin' or 'range'.
+        PROCESSES (dict): Dictionary of the number of worker processes per topic.
+        HANDOFF_TIMEOUT_MS (int): Maximum time a rebalance waits for the messages of revoked partitions to finish.
+        REDELIVERY_BACKOFF_MS (int): Delay before a message that failed is consumed again, doubled on every
+            consecutive failure of its partition up to one minute.
         CONSUME_TOPIC (dict): Dictionary of topics to consume from.
         PRODUCE_TOPIC (dict): Dictionary of topics to produce to.
+        DEAD_LETTER_TOPIC (dict): Dictionary of the dead-letter topics receiving the messages that failed a stage
+            after its retries, with the error and the original record. Only the failures delivered to it are
+            committed: with an empty topic a failed message stays uncommitted, holding back the commits of its
+            partition, and is replayed after a restart or a rebalance.
         LLM_HOST (str): The host URL for the language model.
         LLM_MODEL (str): The specific language model to use.
+        LLM_HOSTS (list): The OpenAI-compatible endpoints the requests are spread over, from a comma separated
+            list; defaults to LLM_HOST alone.
+        LLM_TASK_MODELS (dict): The model of a task when it differs from LLM_MODEL, from a comma separated list of
+            task=model pairs among the tasks 'analyze', 'segment', 'grammar' and 'combined'.
+        LLM_BALANCING (str): How a request picks its endpoint: 'least_outstanding' or 'latency'.
+        LLM_BREAKER_FAILURES (int): Consecutive failures of an endpoint opening its circuit.
+        LLM_BREAKER_COOLDOWN_MS (int): Time an open circuit keeps requests away from its endpoint.
+        LLM_HEALTH_INTERVAL_MS (int): Interval of the health checks of the endpoints; 0 disables them.
+        LLM_TIMEOUT (float): Seconds allowed for a language model request; 0 waits indefinitely.
+        LLM_MAX_RETRIES (int): Number of retries of a language model request after a 429 or 5xx response or a
+            connection error.
+        LLM_MAX_TOKENS (dict): The completion budget of a task, from a comma separated list of task=tokens pairs
+            among the tasks 'analyze', 'segment', 'grammar' and 'combined'.
+        LLM_CONTEXT_TOKENS (int): The context window of the models; a prompt that would not fit in it with the
+            completion budget of its task is refused before it is sent. 0 disables the check.
+        TOKENIZER (str): Local tokenizer counting the prompt tokens: 'tiktoken:<encoding>' from the tiktoken cache,
+            'hf:<path>' to a tokenizer.json file, 'estimate' for four characters per token, or 'auto'.
+        LLM_REQUESTS_PER_SECOND (float): Maximum rate of language model requests per process; 0 is unlimited.
+        LLM_TOKENS_PER_MINUTE (int): Maximum estimated prompt and completion tokens sent to the language model per
+            minute and per process; 0 is unlimited.
+        LLM_MIN_CONCURRENCY (int): Lowest limit of concurrent language model requests per process.
+        LLM_MAX_CONCURRENCY (int): Highest limit of concurrent language model requests per process. The limit
+            adapts in between, growing while responses are healthy and backing off on errors or rising latency.
+        LLM_LATENCY_TOLERANCE (float): Ratio of the smoothed latency to its baseline above which the concurrency
+            limit backs off; 0 only backs off on errors.
         STT_URL (str): The URL for the speech-to-text service.
+        STT_CONNECT_TIMEOUT (float): Seconds allowed to connect to the speech-to-text service.
+        STT_READ_TIMEOUT (float): Seconds allowed for a transcription; 0 waits indefinitely.
+        STT_MAX_RETRIES (int): Number of retries of a transcription after a 5xx response or a connection error.
+        STT_MAX_CONCURRENCY (int): Maximum number of concurrent requests toward the speech-to-text service.
+        MAX_IN_FLIGHT (dict): Dictionary of the maximum number of messages processed concurrently per topic.
+        QUEUE_SIZE (dict): Dictionary of the maximum number of consumed, uncommitted messages per topic.
+            Partition fetching is paused while this limit is reached.
+        COMMIT_INTERVAL_MS (int): Minimum interval between two offset commits of a topic.
+        MAX_POLL_RECORDS (int): Maximum number of records returned by a single poll.
+        FETCH_MIN_BYTES (int): Minimum amount of data the broker gathers before answering a fetch.
+        FETCH_MAX_WAIT_MS (int): Maximum time the broker waits for FETCH_MIN_BYTES before answering a fetch.
+        PRODUCER_LINGER_MS (int): Time the producer waits for more results to fill a batch before sending it.
+        PRODUCER_BATCH_SIZE (int): Maximum size in bytes of a batch of results sent to one partition.
+        PRODUCER_COMPRESSION (str): Compression of the produced batches: 'none', 'gzip', 'snappy', 'lz4' or 'zstd'.
+        PRODUCER_RETRIES (int): Number of times the producer resends a batch after a transient error.
+        PRODUCER_MAX_REQUEST_SIZE (int): Maximum size in bytes of a produce request, which bounds a single result.
+        PRODUCER_FLUSH_TIMEOUT_MS (int): Maximum time spent delivering the pending results on shutdown.
+        PROFILE_EVERY (int): Profile one message out of PROFILE_EVERY with cProfile; 0 disables profiling.
+        PROFILE_DIR (str): Directory of the profiles of the profiled messages.
+        METRICS_HOST (str): The interface the /metrics endpoint listens on.
+        METRICS_PORT (int): The port of the /metrics endpoint; 0 disables it. The worker processes started by the
+            launcher listen on the following ports, one each.
+        JSON_BACKEND (str): JSON library of the messages and results: 'orjson', 'msgspec', 'json' or 'auto'
+            for the fastest one installed.
+        CACHE_BACKEND (str): Backend of the analysis and STT result caches: 'memory', 'sqlite' or 'none'.
+        CACHE_PATH (str): Path of the SQLite database used by the 'sqlite' cache backend.
+        CACHE_TTL (int): Number of seconds a cached result stays valid; 0 keeps results until evicted.
+        CACHE_MAX_ENTRIES (int): Maximum number of results kept per cache.
+        ANALYSIS_MODE (dict): Dictionary of the analysis mode per topic: 'split' (three requests) or 'combined' (one request).
+        ANALYSIS_TASKS (dict): Dictionary of the sub-analyses run per topic, among 'analyze', 'segment' and 'grammar'.
+            Defaults to the tasks whose output the worker publishes.
+        STREAM_SEGMENTS (Dict[str, bool]): Dictionary telling per media topic whether every segment of the
+            transcript is published as a partial result as soon as the model completed it. With 'segment' among
+            the ANALYSIS_TASKS of the topic, the streamed segments are also the Segments of the final result.
+        EARLY_PUBLISH (Dict[str, bool]): Dictionary telling per topic whether a preliminary result (Version 1) is
+            published as soon as the text analysis completed, before the enriched result (Version 2) of the
+            slower sub-analyses.
+        BATCH_SIZE (int): Maximum number of messages whose analysis requests are sent together.
+        BATCH_WAIT_MS (int): Maximum time a message waits for its analysis batch to fill up.
+        BATCH_CONCURRENCY (int): Maximum number of concurrent language model requests of one batch.
+        CHUNK_TOKENS (int): Token budget of a chunk when long inputs are analyzed in map-reduce mode; 0 disables chunking.
+        COMPACT_INPUT (bool): Whether the inputs of the sub-analyses are compacted before they are sent to the
+            language model: timestamps, repeated lines, boilerplate and whitespace. The media topics then analyze
+            the subtitle of the transcript, whose repeated subtitles are merged.
+        COMPACT_INDEX_CHARS (int): Length of a line of the timestamp index kept for the segmentation above which
+            the line is closed without a sentence end.
+        EXTRACT_PROCESSES (int): Number of processes extracting the text of HTML documents; 0 extracts in a thread.
+        EXTRACT_TIMEOUT_MS (int): Maximum time allowed to extract the text of a document; 0 waits indefinitely.
+        STAGE_CONCURRENCY (dict): Dictionary of the concurrency limits of the worker stages per topic, from comma
+            separated stage=limit pairs among the stages 'decode', 'transcribe', 'extract', 'analyze', 'serialize'
+            and 'sink'. A stage without limit is only bounded by MAX_IN_FLIGHT.
+        STAGE_RETRIES (dict): Dictionary of the retries of the worker stages per topic after a transient error,
+            from comma separated stage=retries pairs. A stage without retries fails on its first error.
+        STAGE_RETRY_BACKOFF_MS (int): Delay before the first retry of a stage, doubled on every retry.
 
     Methods:
         validate_url(cls, v):
@@ -19,17 +115,145 @@ class Settings(BaseSettings):
             Raises:
                 ValueError: If the URL does not start with 'http://' or 'https://'.
 
+        validate_llm_hosts(cls, v, values):
+            Parses the comma separated endpoints, defaulting to LLM_HOST, and validates their URLs.
+            Raises:
+                ValueError: If an endpoint does not start with 'http://' or 'https://'.
+
+        validate_task_models(cls, v):
+            Parses the comma separated task=model pairs and validates the task names.
+            Raises:
+                ValueError: If a pair is malformed or a task is unknown.
+
+        validate_max_tokens(cls, v):
+            Parses the comma separated task=tokens pairs and validates the task names and budgets.
+            Raises:
+                ValueError: If a pair is malformed, a task is unknown or a budget is lower than 1.
+
+        validate_tokenizer(cls, v):
+            Validates that the tokenizer is 'auto', 'estimate', 'tiktoken:<encoding>' or 'hf:<path>'.
+            Raises:
+                ValueError: If the tokenizer is not one of these.
+
+        validate_balancing(cls, v):
+            Validates that the balancing is 'least_outstanding' or 'latency'.
+            Raises:
+                ValueError: If the balancing is unknown.
+
         validate_topics(cls, v):
             Validates that the given value is a dictionary.
             Raises:
                 ValueError: If the value is not a dictionary.
+
+        validate_partition_assignment(cls, v):
+            Validates that the partition assignment strategy is 'sticky', 'roundrobin' or 'range'.
+            Raises:
+                ValueError: If the strategy is unknown.
+
+        validate_compression(cls, v):
+            Validates that the producer compression is 'none', 'gzip', 'snappy', 'lz4' or 'zstd'.
+            Raises:
+                ValueError: If the compression is unknown.
+
+        validate_json_backend(cls, v):
+            Validates that the JSON backend is 'auto', 'orjson', 'msgspec' or 'json'.
+            Raises:
+                ValueError: If the backend is unknown.
+
+        validate_cache_backend(cls, v):
+            Validates that the cache backend is one of 'memory', 'sqlite' or 'none'.
+            Raises:
+                ValueError: If the backend is unknown.
+
+        validate_analysis_mode(cls, v):
+            Validates that every per-topic analysis mode is 'split' or 'combined'.
+            Raises:
+                ValueError: If a mode is unknown.
+
+        validate_analysis_tasks(cls, v):
+            Parses the comma separated task list of every topic and validates the task names.
+            Raises:
+                ValueError: If a task is unknown or a topic has no task.
+
+        validate_stage_limits(cls, v, field):
+            Parses the comma separated stage=limit pairs of every topic and validates the stages and limits.
+            Raises:
+                ValueError: If a pair is malformed, a stage is unknown, a concurrency limit is lower than 1 or a
+                retry count is negative.
+
+        validate_in_flight(cls, v):
+            Validates that every per-topic concurrency, queue or process limit is a positive integer.
+            Raises:
+                ValueError: If a limit is lower than 1.
     """
     KAFKA_SERVER: str
+    KAFKA_GROUP_ID: str = 'demo-group'
+    PARTITION_ASSIGNMENT: str = 'sticky'
+    PROCESSES: dict
+    HANDOFF_TIMEOUT_MS: int = 30000
+    REDELIVERY_BACKOFF_MS: int = 1000
     CONSUME_TOPIC: dict
     PRODUCE_TOPIC: dict
+    DEAD_LETTER_TOPIC: dict
     LLM_HOST: str
     LLM_MODEL: str
+    LLM_HOSTS: list
+    LLM_TASK_MODELS: dict
+    LLM_BALANCING: str = 'least_outstanding'
+    LLM_BREAKER_FAILURES: int = 5
+    LLM_BREAKER_COOLDOWN_MS: int = 30000
+    LLM_HEALTH_INTERVAL_MS: int = 10000
+    LLM_TIMEOUT: float = 300.0
+    LLM_MAX_RETRIES: int = 4
+    LLM_MAX_TOKENS: dict
+    LLM_CONTEXT_TOKENS: int = 0
+    TOKENIZER: str = 'auto'
+    LLM_REQUESTS_PER_SECOND: float = 0
+    LLM_TOKENS_PER_MINUTE: int = 0
+    LLM_MIN_CONCURRENCY: int = 1
+    LLM_MAX_CONCURRENCY: int = 32
+    LLM_LATENCY_TOLERANCE: float = 2.0
     STT_URL: str
+    STT_CONNECT_TIMEOUT: float = 5.0
+    STT_READ_TIMEOUT: float = 600.0
+    STT_MAX_RETRIES: int = 3
+    STT_MAX_CONCURRENCY: int = 8
+    MAX_IN_FLIGHT: dict
+    QUEUE_SIZE: dict
+    COMMIT_INTERVAL_MS: int = 1000
+    MAX_POLL_RECORDS: int = 500
+    FETCH_MIN_BYTES: int = 1
+    FETCH_MAX_WAIT_MS: int = 500
+    PRODUCER_LINGER_MS: int = 20
+    PRODUCER_BATCH_SIZE: int = 262144
+    PRODUCER_COMPRESSION: str = 'lz4'
+    PRODUCER_RETRIES: int = 5
+    PRODUCER_MAX_REQUEST_SIZE: int = 4194304
+    PRODUCER_FLUSH_TIMEOUT_MS: int = 30000
+    JSON_BACKEND: str = 'auto'
+    PROFILE_EVERY: int = 0
+    PROFILE_DIR: str = 'profiles'
+    METRICS_HOST: str = '0.0.0.0'
+    METRICS_PORT: int = 9100
+    CACHE_BACKEND: str = 'memory'
+    CACHE_PATH: str = 'cache.sqlite3'
+    CACHE_TTL: int = 0
+    CACHE_MAX_ENTRIES: int = 10000
+    ANALYSIS_MODE: dict
+    ANALYSIS_TASKS: dict
+    STREAM_SEGMENTS: Dict[str, bool]
+    EARLY_PUBLISH: Dict[str, bool]
+    BATCH_SIZE: int = 16
+    BATCH_WAIT_MS: int = 50
+    BATCH_CONCURRENCY: int = 16
+    CHUNK_TOKENS: int = 6000
+    COMPACT_INPUT: bool = True
+    COMPACT_INDEX_CHARS: int = 200
+    EXTRACT_PROCESSES: int = 2
+    EXTRACT_TIMEOUT_MS: int = 30000
+    STAGE_CONCURRENCY: dict
+    STAGE_RETRIES: dict
+    STAGE_RETRY_BACKOFF_MS: int = 1000
 
     @validator('KAFKA_SERVER', 'LLM_HOST', 'STT_URL')
     def validate_url(cls, v):
@@ -37,15 +261,144 @@ class Settings(BaseSettings):
             raise ValueError('must be a valid URL')
         return v
 
-    @validator('CONSUME_TOPIC', 'PRODUCE_TOPIC')
+    @validator('LLM_HOSTS', pre=True)
+    def validate_llm_hosts(cls, v, values):
+        hosts = [host.strip() for host in (v or '').split(',') if host.strip()] or [values.get('LLM_HOST')]
+        for host in hosts:
+            if not host or not host.startswith(('http://', 'https://')):
+                raise ValueError(f"'{host}' must be a valid URL")
+        return hosts
+
+    @validator('LLM_TASK_MODELS', pre=True)
+    def validate_task_models(cls, v):
+        models = {}
+        for pair in (v or '').split(','):
+            if not pair.strip():
+                continue
+            task, _, model = pair.partition('=')
+            task, model = task.strip(), model.strip()
+            if not model:
+                raise ValueError(f"'{pair}' must be a task=model pair")
+            if task not in ('analyze', 'segment', 'grammar', 'combined'):
+                raise ValueError(f"unknown task '{task}'")
+            models[task] = model
+        return models
+
+    @validator('LLM_MAX_TOKENS', pre=True)
+    def validate_max_tokens(cls, v):
+        budgets = {}
+        for pair in (v or '').split(','):
+            if not pair.strip():
+                continue
+            task, _, tokens = pair.partition('=')
+            task, tokens = task.strip(), tokens.strip()
+            if task not in ('analyze', 'segment', 'grammar', 'combined'):
+                raise ValueError(f"unknown task '{task}'")
+            if not tokens.isdigit() or int(tokens) < 1:
+                raise ValueError(f"'{pair}' must be a task=tokens pair with a positive budget")
+            budgets[task] = int(tokens)
+        return budgets
+
+    @validator('TOKENIZER')
+    def validate_tokenizer(cls, v):
+        backend, _, argument = v.partition(':')
+        if v not in ('auto', 'estimate') and not (backend in ('tiktoken', 'hf') and argument):
+            raise ValueError("must be 'auto', 'estimate', 'tiktoken:<encoding>' or 'hf:<path>'")
+        return v
+
+    @validator('LLM_BALANCING')
+    def validate_balancing(cls, v):
+        if v not in ('least_outstanding', 'latency'):
+            raise ValueError("must be 'least_outstanding' or 'latency'")
+        return v
+
+    @validator('CONSUME_TOPIC', 'PRODUCE_TOPIC', 'DEAD_LETTER_TOPIC')
     def validate_topics(cls, v):
         if not isinstance(v, dict):
             raise ValueError('must be a dictionary')
         return v
 
+    @validator('PARTITION_ASSIGNMENT')
+    def validate_partition_assignment(cls, v):
+        if v not in ('sticky', 'roundrobin', 'range'):
+            raise ValueError("must be one of 'sticky', 'roundrobin' or 'range'")
+        return v
+
+    @validator('PRODUCER_COMPRESSION')
+    def validate_compression(cls, v):
+        if v not in ('none', 'gzip', 'snappy', 'lz4', 'zstd'):
+            raise ValueError("must be one of 'none', 'gzip', 'snappy', 'lz4' or 'zstd'")
+        return v
+
+    @validator('JSON_BACKEND')
+    def validate_json_backend(cls, v):
+        if v not in ('auto', 'orjson', 'msgspec', 'json'):
+            raise ValueError("must be one of 'auto', 'orjson', 'msgspec' or 'json'")
+        return v
+
+    @validator('CACHE_BACKEND')
+    def validate_cache_backend(cls, v):
+        if v not in ('memory', 'sqlite', 'none'):
+            raise ValueError("must be one of 'memory', 'sqlite' or 'none'")
+        return v
+
+    @validator('ANALYSIS_MODE')
+    def validate_analysis_mode(cls, v):
+        for topic, mode in v.items():
+            if mode not in ('split', 'combined'):
+                raise ValueError(f"{topic} must be 'split' or 'combined'")
+        return v
+
+    @validator('ANALYSIS_TASKS')
+    def validate_analysis_tasks(cls, v):
+        parsed = {}
+        for topic, tasks in v.items():
+            tasks = tuple(task.strip() for task in tasks.split(',') if task.strip())
+            if not tasks:
+                raise ValueError(f'{topic} must select at least one task')
+            for task in tasks:
+                if task not in ('analyze', 'segment', 'grammar'):
+                    raise ValueError(f"{topic} has unknown task '{task}'")
+            parsed[topic] = tasks
+        return parsed
+
+    @validator('STAGE_CONCURRENCY', 'STAGE_RETRIES')
+    def validate_stage_limits(cls, v, field):
+        minimum = 1 if field.name == 'STAGE_CONCURRENCY' else 0
+        parsed = {}
+        for topic, pairs in v.items():
+            parsed[topic] = {}
+            for pair in (pairs or '').split(','):
+                if not pair.strip():
+                    continue
+                stage, _, limit = pair.partition('=')
+                stage = stage.strip()
+                if stage not in ('decode', 'transcribe', 'extract', 'analyze', 'serialize', 'sink'):
+                    raise ValueError(f"{topic} has unknown stage '{stage}'")
+                if not limit.strip().isdigit() or int(limit) < minimum:
+                    raise ValueError(f"{topic} must set '{stage}' to an integer of at least {minimum}")
+                parsed[topic][stage] = int(limit)
+        return parsed
+
+    @validator('MAX_IN_FLIGHT', 'QUEUE_SIZE', 'PROCESSES')
+    def validate_in_flight(cls, v):
+        for topic, limit in v.items():
+            if int(limit) < 1:
+                raise ValueError(f'{topic} must be at least 1')
+        return {topic: int(limit) for topic, limit in v.items()}
+
 try:
     settings = Settings(
         KAFKA_SERVER=os.getenv('KAFKA_SERVER'),
+        KAFKA_GROUP_ID=os.getenv('KAFKA_GROUP_ID', 'demo-group'),
+        PARTITION_ASSIGNMENT=os.getenv('PARTITION_ASSIGNMENT', 'sticky'),
+        PROCESSES={
+            'audio': os.getenv('PROCESSES_AUDIO', 1),
+            'video': os.getenv('PROCESSES_VIDEO', 1),
+            'document': os.getenv('PROCESSES_DOCUMENT', 1)
+        },
+        HANDOFF_TIMEOUT_MS=os.getenv('HANDOFF_TIMEOUT_MS', 30000),
+        REDELIVERY_BACKOFF_MS=os.getenv('REDELIVERY_BACKOFF_MS', 1000),
         CONSUME_TOPIC={
             'audio': os.getenv('CONSUME_TOPIC_AUDIO'),
             'video': os.getenv('CONSUME_TOPIC_VIDEO'),
@@ -56,17 +409,171 @@ try:
             'video': os.getenv('PRODUCE_TOPIC_VIDEO'),
             'document': os.getenv('PRODUCE_TOPIC_DOCUMENT')
         },
+        DEAD_LETTER_TOPIC={
+            'audio': os.getenv('DEAD_LETTER_TOPIC_AUDIO', ''),
+            'video': os.getenv('DEAD_LETTER_TOPIC_VIDEO', ''),
+            'document': os.getenv('DEAD_LETTER_TOPIC_DOCUMENT', '')
+        },
         LLM_HOST=os.getenv('LLM_HOST'),
         LLM_MODEL=os.getenv('LLM_MODEL'),
-        STT_URL=os.getenv('STT_URL')
+        LLM_HOSTS=os.getenv('LLM_HOSTS', ''),
+        LLM_TASK_MODELS=os.getenv('LLM_TASK_MODELS', ''),
+        LLM_BALANCING=os.getenv('LLM_BALANCING', 'least_outstanding'),
+        LLM_BREAKER_FAILURES=os.getenv('LLM_BREAKER_FAILURES', 5),
+        LLM_BREAKER_COOLDOWN_MS=os.getenv('LLM_BREAKER_COOLDOWN_MS', 30000),
+        LLM_HEALTH_INTERVAL_MS=os.getenv('LLM_HEALTH_INTERVAL_MS', 10000),
+        LLM_TIMEOUT=os.getenv('LLM_TIMEOUT', 300.0),
+        LLM_MAX_RETRIES=os.getenv('LLM_MAX_RETRIES', 4),
+        LLM_MAX_TOKENS=os.getenv('LLM_MAX_TOKENS', 'analyze=1024,segment=4096,grammar=2048,combined=6144'),
+        LLM_CONTEXT_TOKENS=os.getenv('LLM_CONTEXT_TOKENS', 0),
+        TOKENIZER=os.getenv('TOKENIZER', 'auto'),
+        LLM_REQUESTS_PER_SECOND=os.getenv('LLM_REQUESTS_PER_SECOND', 0),
+        LLM_TOKENS_PER_MINUTE=os.getenv('LLM_TOKENS_PER_MINUTE', 0),
+        LLM_MIN_CONCURRENCY=os.getenv('LLM_MIN_CONCURRENCY', 1),
+        LLM_MAX_CONCURRENCY=os.getenv('LLM_MAX_CONCURRENCY', 32),
+        LLM_LATENCY_TOLERANCE=os.getenv('LLM_LATENCY_TOLERANCE', 2.0),
+        STT_URL=os.getenv('STT_URL'),
+        STT_CONNECT_TIMEOUT=os.getenv('STT_CONNECT_TIMEOUT', 5.0),
+        STT_READ_TIMEOUT=os.getenv('STT_READ_TIMEOUT', 600.0),
+        STT_MAX_RETRIES=os.getenv('STT_MAX_RETRIES', 3),
+        STT_MAX_CONCURRENCY=os.getenv('STT_MAX_CONCURRENCY', 8),
+        MAX_IN_FLIGHT={
+            'audio': os.getenv('MAX_IN_FLIGHT_AUDIO', 16),
+            'video': os.getenv('MAX_IN_FLIGHT_VIDEO', 16),
+            'document': os.getenv('MAX_IN_FLIGHT_DOCUMENT', 32)
+        },
+        QUEUE_SIZE={
+            'audio': os.getenv('QUEUE_SIZE_AUDIO', 64),
+            'video': os.getenv('QUEUE_SIZE_VIDEO', 64),
+            'document': os.getenv('QUEUE_SIZE_DOCUMENT', 128)
+        },
+        COMMIT_INTERVAL_MS=os.getenv('COMMIT_INTERVAL_MS', 1000),
+        MAX_POLL_RECORDS=os.getenv('MAX_POLL_RECORDS', 500),
+        FETCH_MIN_BYTES=os.getenv('FETCH_MIN_BYTES', 1),
+        FETCH_MAX_WAIT_MS=os.getenv('FETCH_MAX_WAIT_MS', 500),
+        PRODUCER_LINGER_MS=os.getenv('PRODUCER_LINGER_MS', 20),
+        PRODUCER_BATCH_SIZE=os.getenv('PRODUCER_BATCH_SIZE', 262144),
+        PRODUCER_COMPRESSION=os.getenv('PRODUCER_COMPRESSION', 'lz4'),
+        PRODUCER_RETRIES=os.getenv('PRODUCER_RETRIES', 5),
+        PRODUCER_MAX_REQUEST_SIZE=os.getenv('PRODUCER_MAX_REQUEST_SIZE', 4194304),
+        PRODUCER_FLUSH_TIMEOUT_MS=os.getenv('PRODUCER_FLUSH_TIMEOUT_MS', 30000),
+        JSON_BACKEND=os.getenv('JSON_BACKEND', 'auto'),
+        PROFILE_EVERY=os.getenv('PROFILE_EVERY', 0),
+        PROFILE_DIR=os.getenv('PROFILE_DIR', 'profiles'),
+        METRICS_HOST=os.getenv('METRICS_HOST', '0.0.0.0'),
+        METRICS_PORT=os.getenv('METRICS_PORT', 9100),
+        CACHE_BACKEND=os.getenv('CACHE_BACKEND', 'memory'),
+        CACHE_PATH=os.getenv('CACHE_PATH', 'cache.sqlite3'),
+        CACHE_TTL=os.getenv('CACHE_TTL', 0),
+        CACHE_MAX_ENTRIES=os.getenv('CACHE_MAX_ENTRIES', 10000),
+        ANALYSIS_MODE={
+            'audio': os.getenv('ANALYSIS_MODE_AUDIO', 'split'),
+            'video': os.getenv('ANALYSIS_MODE_VIDEO', 'split'),
+            'document': os.getenv('ANALYSIS_MODE_DOCUMENT', 'split')
+        },
+        ANALYSIS_TASKS={
+            'audio': os.getenv('ANALYSIS_TASKS_AUDIO', 'analyze'),
+            'video': os.getenv('ANALYSIS_TASKS_VIDEO', 'analyze'),
+            'document': os.getenv('ANALYSIS_TASKS_DOCUMENT', 'analyze')
+        },
+        STREAM_SEGMENTS={
+            'audio': os.getenv('STREAM_SEGMENTS_AUDIO', 'false'),
+            'video': os.getenv('STREAM_SEGMENTS_VIDEO', 'false')
+        },
+        EARLY_PUBLISH={
+            'audio': os.getenv('EARLY_PUBLISH_AUDIO', 'false'),
+            'video': os.getenv('EARLY_PUBLISH_VIDEO', 'false'),
+            'document': os.getenv('EARLY_PUBLISH_DOCUMENT', 'false')
+        },
+        BATCH_SIZE=os.getenv('BATCH_SIZE', 16),
+        BATCH_WAIT_MS=os.getenv('BATCH_WAIT_MS', 50),
+        BATCH_CONCURRENCY=os.getenv('BATCH_CONCURRENCY', 16),
+        CHUNK_TOKENS=os.getenv('CHUNK_TOKENS', 6000),
+        COMPACT_INPUT=os.getenv('COMPACT_INPUT', 'true'),
+        COMPACT_INDEX_CHARS=os.getenv('COMPACT_INDEX_CHARS', 200),
+        EXTRACT_PROCESSES=os.getenv('EXTRACT_PROCESSES', 2),
+        EXTRACT_TIMEOUT_MS=os.getenv('EXTRACT_TIMEOUT_MS', 30000),
+        STAGE_CONCURRENCY={
+            'audio': os.getenv('STAGE_CONCURRENCY_AUDIO', ''),
+            'video': os.getenv('STAGE_CONCURRENCY_VIDEO', ''),
+            'document': os.getenv('STAGE_CONCURRENCY_DOCUMENT', '')
+        },
+        STAGE_RETRIES={
+            'audio': os.getenv('STAGE_RETRIES_AUDIO', ''),
+            'video': os.getenv('STAGE_RETRIES_VIDEO', ''),
+            'document': os.getenv('STAGE_RETRIES_DOCUMENT', '')
+        },
+        STAGE_RETRY_BACKOFF_MS=os.getenv('STAGE_RETRY_BACKOFF_MS', 1000)
     )
 except ValidationError as e:
-    print(f"Configuration error: {e}")
-
-# Example usage with added print text
-print(f"KAFKA_SERVER: {settings.KAFKA_SERVER}")
-print(f"CONSUME_TOPIC: {settings.CONSUME_TOPIC}")
-print(f"PRODUCE_TOPIC: {settings.PRODUCE_TOPIC}")
-print(f"LLM_HOST: {settings.LLM_HOST}")
-print(f"LLM_MODEL: {settings.LLM_MODEL}")
-print(f"STT_URL: {settings.STT_URL}")
\ No newline at end of file
+    log('configuration_error', level='error', error=str(e))
+    raise
+
+KAFKA_SERVER = settings.KAFKA_SERVER
+KAFKA_GROUP_ID = settings.KAFKA_GROUP_ID
+PARTITION_ASSIGNMENT = settings.PARTITION_ASSIGNMENT
+PROCESSES = settings.PROCESSES
+HANDOFF_TIMEOUT_MS = settings.HANDOFF_TIMEOUT_MS
+REDELIVERY_BACKOFF_MS = settings.REDELIVERY_BACKOFF_MS
+CONSUME_TOPIC = settings.CONSUME_TOPIC
+PRODUCE_TOPIC = settings.PRODUCE_TOPIC
+DEAD_LETTER_TOPIC = settings.DEAD_LETTER_TOPIC
+LLM_HOST = settings.LLM_HOST
+LLM_MODEL = settings.LLM_MODEL
+LLM_HOSTS = settings.LLM_HOSTS
+LLM_TASK_MODELS = settings.LLM_TASK_MODELS
+LLM_BALANCING = settings.LLM_BALANCING
+LLM_BREAKER_FAILURES = settings.LLM_BREAKER_FAILURES
+LLM_BREAKER_COOLDOWN_MS = settings.LLM_BREAKER_COOLDOWN_MS
+LLM_HEALTH_INTERVAL_MS = settings.LLM_HEALTH_INTERVAL_MS
+LLM_TIMEOUT = settings.LLM_TIMEOUT
+LLM_MAX_RETRIES = settings.LLM_MAX_RETRIES
+LLM_MAX_TOKENS = settings.LLM_MAX_TOKENS
+LLM_CONTEXT_TOKENS = settings.LLM_CONTEXT_TOKENS
+TOKENIZER = settings.TOKENIZER
+LLM_REQUESTS_PER_SECOND = settings.LLM_REQUESTS_PER_SECOND
+LLM_TOKENS_PER_MINUTE = settings.LLM_TOKENS_PER_MINUTE
+LLM_MIN_CONCURRENCY = settings.LLM_MIN_CONCURRENCY
+LLM_MAX_CONCURRENCY = settings.LLM_MAX_CONCURRENCY
+LLM_LATENCY_TOLERANCE = settings.LLM_LATENCY_TOLERANCE
+STT_URL = settings.STT_URL
+STT_CONNECT_TIMEOUT = settings.STT_CONNECT_TIMEOUT
+STT_READ_TIMEOUT = settings.STT_READ_TIMEOUT
+STT_MAX_RETRIES = settings.STT_MAX_RETRIES
+STT_MAX_CONCURRENCY = settings.STT_MAX_CONCURRENCY
+MAX_IN_FLIGHT = settings.MAX_IN_FLIGHT
+QUEUE_SIZE = settings.QUEUE_SIZE
+COMMIT_INTERVAL_MS = settings.COMMIT_INTERVAL_MS
+MAX_POLL_RECORDS = settings.MAX_POLL_RECORDS
+FETCH_MIN_BYTES = settings.FETCH_MIN_BYTES
+FETCH_MAX_WAIT_MS = settings.FETCH_MAX_WAIT_MS
+PRODUCER_LINGER_MS = settings.PRODUCER_LINGER_MS
+PRODUCER_BATCH_SIZE = settings.PRODUCER_BATCH_SIZE
+PRODUCER_COMPRESSION = settings.PRODUCER_COMPRESSION
+PRODUCER_RETRIES = settings.PRODUCER_RETRIES
+PRODUCER_MAX_REQUEST_SIZE = settings.PRODUCER_MAX_REQUEST_SIZE
+PRODUCER_FLUSH_TIMEOUT_MS = settings.PRODUCER_FLUSH_TIMEOUT_MS
+JSON_BACKEND = settings.JSON_BACKEND
+PROFILE_EVERY = settings.PROFILE_EVERY
+PROFILE_DIR = settings.PROFILE_DIR
+METRICS_HOST = settings.METRICS_HOST
+METRICS_PORT = settings.METRICS_PORT
+CACHE_BACKEND = settings.CACHE_BACKEND
+CACHE_PATH = settings.CACHE_PATH
+CACHE_TTL = settings.CACHE_TTL
+CACHE_MAX_ENTRIES = settings.CACHE_MAX_ENTRIES
+ANALYSIS_MODE = settings.ANALYSIS_MODE
+ANALYSIS_TASKS = settings.ANALYSIS_TASKS
+STREAM_SEGMENTS = settings.STREAM_SEGMENTS
+EARLY_PUBLISH = settings.EARLY_PUBLISH
+BATCH_SIZE = settings.BATCH_SIZE
+BATCH_WAIT_MS = settings.BATCH_WAIT_MS
+BATCH_CONCURRENCY = settings.BATCH_CONCURRENCY
+CHUNK_TOKENS = settings.CHUNK_TOKENS
+COMPACT_INPUT = settings.COMPACT_INPUT
+COMPACT_INDEX_CHARS = settings.COMPACT_INDEX_CHARS
+EXTRACT_PROCESSES = settings.EXTRACT_PROCESSES
+EXTRACT_TIMEOUT_MS = settings.EXTRACT_TIMEOUT_MS
+STAGE_CONCURRENCY = settings.STAGE_CONCURRENCY
+STAGE_RETRIES = settings.STAGE_RETRIES
+STAGE_RETRY_BACKOFF_MS = settings.STAGE_RETRY_BACKOFF_MS
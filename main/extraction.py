@@ -0,0 +1,171 @@
+"""
+This module extracts the article text of the documents.
+
+Parsing an HTML page with lxml and extracting its text with newspaper is CPU-bound and holds the GIL for a long
+time on large pages, which would stall the event loop serving every topic of the process, even from a worker
+thread. The extraction therefore runs in a dedicated process pool with a per-document timeout. Content that is
+already plain text skips the extraction altogether.
+
+A process running past the timeout cannot be interrupted, so the pool it belongs to is retired: the next
+documents go to a new pool, and the processes of the old one are killed once its other documents finished or
+timed out, so pathological pages never hold the extraction processes for good.
+
+The pool processes are forked from a forkserver which only imports this module, never from the application
+process: forking a process that already runs the event loop, the metrics server and the HTTP client threads
+could copy a lock held by one of them into the child. The pool is started before any of these threads.
+
+Classes:
+    ExtractionError: Raised when the text of a document cannot be extracted in time.
+    HtmlExtractor: Extracts the text of documents in a process pool.
+
+Functions:
+    is_html: Tells whether a content contains HTML markup.
+    extract_text: Extracts the article text of an HTML page.
+"""
+import re
+import asyncio
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, wait
+from concurrent.futures.process import BrokenProcessPool
+
+import newspaper
+
+HTML_TAG = re.compile(r'<(?:!--|!doctype\b|/?[a-z][a-z0-9]*(?:\s[^<>]*)?/?>)', re.IGNORECASE)
+
+
+class ExtractionError(Exception):
+    """
+    Raised when the text of a document cannot be extracted in time.
+    """
+
+
+def is_html(content: str) -> bool:
+    """
+    Tells whether `content` contains HTML markup, as opposed to plain text.
+    """
+    return HTML_TAG.search(content) is not None
+
+
+def extract_text(html: str, language: str = 'vi') -> str:
+    """
+    Extracts the article text of an HTML page with newspaper.
+
+    Args:
+        html (str): The HTML page.
+        language (str): The language of the article.
+
+    Returns:
+        str: The article text.
+    """
+    return newspaper.article(url='', input_html=html, language=language).text
+
+
+class HtmlExtractor:
+    """
+    Extracts the article text of documents in a process pool.
+
+    Attributes:
+        max_workers (int): Number of extraction processes; 0 extracts in a thread of the current process.
+        timeout (float): Seconds allowed to extract a document; None waits indefinitely.
+        language (str): The language of the articles.
+        function (Callable[[str, str], str]): Extracts the text of an HTML page in a given language, in the
+            extraction processes, which import it by name.
+
+    Methods:
+        start():
+            Starts the extraction processes.
+        extract(content: str) -> str:
+            Returns the article text of `content`.
+        close():
+            Shuts the extraction processes down.
+    """
+    def __init__(self, max_workers: int = 2, timeout: float = 30.0, language: str = 'vi', function=extract_text):
+        self.max_workers = max_workers
+        self.timeout = timeout
+        self.language = language
+        self.function = function
+        self._executor = self._create_executor() if max_workers else None
+        # The extractions running in every pool, and the tasks retiring the pools of timed out extractions
+        self._running = {}
+        self._retiring = set()
+
+    def start(self):
+        """
+        Starts every extraction process and waits until they are ready. Called before the process starts its
+        threads; otherwise the processes start with the first documents.
+        """
+        if self._executor is not None:
+            wait([self._executor.submit(is_html, '') for _ in range(self.max_workers)])
+
+    async def extract(self, content: str) -> str:
+        """
+        Returns the article text of `content`. Plain text is returned as is, HTML is extracted in the pool.
+
+        Args:
+            content (str): The content of the document, plain text or an HTML page.
+
+        Returns:
+            str: The article text.
+
+        Raises:
+            ExtractionError: If the extraction exceeds the timeout or its process died. The pool of a timed out
+                extraction is retired, which kills its process.
+        """
+        if not is_html(content):
+            return content.strip()
+
+        loop = asyncio.get_running_loop()
+        executor = self._executor
+        future = loop.run_in_executor(executor, self.function, content, self.language)
+        running = self._running.setdefault(executor, set())
+        running.add(future)
+        try:
+            return await asyncio.wait_for(future, self.timeout)
+        except asyncio.TimeoutError:
+            if executor is not None and executor is self._executor:
+                self._executor = self._create_executor()
+                task = loop.create_task(self._retire(executor))
+                self._retiring.add(task)
+                task.add_done_callback(self._retiring.discard)
+            raise ExtractionError(f'extraction exceeded {self.timeout}s') from None
+        except BrokenProcessPool as e:
+            # A process died, e.g. out of memory; the next documents get a new pool
+            if executor is self._executor:
+                self._executor = self._create_executor()
+                executor.shutdown(wait=False, cancel_futures=True)
+            raise ExtractionError(f'extraction process died: {e}') from e
+        finally:
+            running.discard(future)
+
+    def close(self):
+        for task in self._retiring:
+            task.cancel()
+        for executor in (self._executor, *self._running):
+            if executor is not None:
+                self._terminate(executor)
+
+    async def _retire(self, executor: ProcessPoolExecutor):
+        """
+        Kills the processes of `executor` once the other extractions running in it finished or timed out.
+        """
+        try:
+            others = [future for future in self._running.get(executor, ()) if not future.done()]
+            if others:
+                await asyncio.wait(others, timeout=self.timeout)
+        finally:
+            self._running.pop(executor, None)
+            self._terminate(executor)
+
+    @staticmethod
+    def _terminate(executor: ProcessPoolExecutor):
+        # ProcessPoolExecutor cannot stop a running call, so its processes are terminated after the shutdown
+        processes = list((executor._processes or {}).values())
+        executor.shutdown(wait=False, cancel_futures=True)
+        for process in processes:
+            process.terminate()
+
+    def _create_executor(self) -> ProcessPoolExecutor:
+        # The processes only run extract_text, so the forkserver preloads this module and not the application
+        context = multiprocessing.get_context('forkserver')
+        context.set_forkserver_preload(['extraction'])
+        return ProcessPoolExecutor(self.max_workers, mp_context=context)
@@ -1,52 +1,161 @@
-from constant import KAFKA_SERVER, CONSUME_TOPIC
+from constant import (
+  KAFKA_SERVER, CONSUME_TOPIC, KAFKA_GROUP_ID, PARTITION_ASSIGNMENT,
+  MAX_POLL_RECORDS, FETCH_MIN_BYTES, FETCH_MAX_WAIT_MS,
+  PRODUCER_LINGER_MS, PRODUCER_BATCH_SIZE, PRODUCER_COMPRESSION, PRODUCER_RETRIES, PRODUCER_MAX_REQUEST_SIZE,
+  JSON_BACKEND
+)
 """
 This module provides helper functions for interacting with Kafka, including creating Kafka consumers and a producer.
 
 Constants:
   KAFKA_SERVER (str): The address of the Kafka server.
   CONSUME_TOPIC (dict): A dictionary containing the topics to consume from.
+  KAFKA_GROUP_ID (str): The consumer group shared by every process consuming a topic.
+  PARTITION_ASSIGNMENT (str): The partition assignment strategy of the consumer group.
+  MAX_POLL_RECORDS (int): The maximum number of records returned by a single poll.
+  FETCH_MIN_BYTES (int): The minimum amount of data the broker gathers before answering a fetch.
+  FETCH_MAX_WAIT_MS (int): The maximum time the broker waits for FETCH_MIN_BYTES before answering a fetch.
+  PRODUCER_LINGER_MS, PRODUCER_BATCH_SIZE, PRODUCER_COMPRESSION, PRODUCER_RETRIES, PRODUCER_MAX_REQUEST_SIZE:
+    The batching, compression and delivery settings of the producer.
+  JSON_BACKEND (str): The JSON library of the messages and results.
 
-Kafka Consumers:
-  consumer_audio (KafkaConsumer): A Kafka consumer for the 'audio' topic.
-  consumer_video (KafkaConsumer): A Kafka consumer for the 'video' topic.
-  consumer_document (KafkaConsumer): A Kafka consumer for the 'document' topic.
+Serializer:
+  serializer (Serializer): Decodes the consumed messages and encodes the produced results, straight from and to
+    bytes, with orjson or msgspec when installed.
 
 Kafka Producer:
-  producer (KafkaProducer): A Kafka producer for publishing messages to Kafka topics.
+  producer (KafkaProducer): A Kafka producer for publishing messages to Kafka topics, created on first use so that
+    importing the workers does not connect to the broker. Results produced within PRODUCER_LINGER_MS of each other
+    are sent as one compressed batch per partition, which matters for the results carrying a full subtitle.
+
+Functions:
+  create_consumer: Creates a Kafka consumer of one topic in the configured consumer group.
+  get_producer: Returns the producer, creating it on first use.
+  publish: Sends a message with the producer and waits for the broker acknowledgement without blocking the event loop.
+  flush: Delivers the pending messages of the producer.
 """
 from kafka import KafkaConsumer, KafkaProducer
-import json
-
-# Create kafka consummer
-consumer_audio = KafkaConsumer(
-  CONSUME_TOPIC['audio'],
-  bootstrap_servers=[KAFKA_SERVER],
-  group_id="demo-group",
-  auto_offset_reset="earliest",
-  enable_auto_commit=False,
-  consumer_timeout_ms=1000
-)
+from kafka.coordinator.assignors.range import RangePartitionAssignor
+from kafka.coordinator.assignors.roundrobin import RoundRobinPartitionAssignor
+from kafka.coordinator.assignors.sticky.sticky_assignor import StickyPartitionAssignor
+from serialization import create_serializer
+from tracing import span
+import asyncio
 
-consumer_video = KafkaConsumer(
-  CONSUME_TOPIC['video'],
-  bootstrap_servers=[KAFKA_SERVER],
-  group_id="demo-group",
-  auto_offset_reset="earliest",
-  enable_auto_commit=False,
-  consumer_timeout_ms=1000
-)
+ASSIGNORS = {
+  'sticky': StickyPartitionAssignor,
+  'roundrobin': RoundRobinPartitionAssignor,
+  'range': RangePartitionAssignor
+}
+
+
+def create_consumer(topic: str, listener=None) -> KafkaConsumer:
+  """
+  Creates a Kafka consumer of `topic` in the `KAFKA_GROUP_ID` consumer group.
+
+  Every process creates its own consumers; the partitions of a topic are spread over all the consumers of the
+  group, whatever the process or pod they run in. The preferred assignment strategy comes first, with range
+  assignment as a fallback while members of the group are being upgraded.
+
+  The consumer is meant to be polled: a poll returns as soon as records are fetched, and the broker answers a
+  fetch once FETCH_MIN_BYTES are available or FETCH_MAX_WAIT_MS elapsed, which bounds the idle latency.
+
+  Args:
+    topic (str): The topic name, one of the keys of CONSUME_TOPIC ('audio', 'video' or 'document').
+    listener (ConsumerRebalanceListener): Optional listener notified when partitions are revoked or assigned.
+
+  Returns:
+    KafkaConsumer: The consumer, subscribed to the topic.
+  """
+  assignors = [ASSIGNORS[PARTITION_ASSIGNMENT]]
+  if PARTITION_ASSIGNMENT != 'range':
+    assignors.append(RangePartitionAssignor)
+
+  consumer = KafkaConsumer(
+    bootstrap_servers=[KAFKA_SERVER],
+    group_id=KAFKA_GROUP_ID,
+    auto_offset_reset="earliest",
+    enable_auto_commit=False,
+    max_poll_records=MAX_POLL_RECORDS,
+    fetch_min_bytes=FETCH_MIN_BYTES,
+    fetch_max_wait_ms=FETCH_MAX_WAIT_MS,
+    partition_assignment_strategy=assignors
+  )
+  consumer.subscribe([CONSUME_TOPIC[topic]], listener=listener)
+  return consumer
+
+serializer = create_serializer(JSON_BACKEND)
+
+# Kafka publisher, created by get_producer; the benchmarks replace it with an in-memory stand-in
+producer = None
+
+
+def get_producer() -> KafkaProducer:
+  """
+  Returns the producer, creating it on first use.
+  """
+  global producer
+  if producer is None:
+    producer = KafkaProducer(
+        bootstrap_servers=KAFKA_SERVER,  # Replace with your Kafka broker address
+        linger_ms=PRODUCER_LINGER_MS,
+        batch_size=PRODUCER_BATCH_SIZE,
+        compression_type=None if PRODUCER_COMPRESSION == 'none' else PRODUCER_COMPRESSION,
+        retries=PRODUCER_RETRIES,
+        max_request_size=PRODUCER_MAX_REQUEST_SIZE
+    )
+  return producer
+
+
+async def publish(topic: str, value, key: bytes = None):
+  """
+  Serializes `value` as JSON, unless it is serialized already, sends it to `topic` and waits until the broker
+  acknowledged it. The serialization and the delivery run in the 'serialize' and 'produce' spans of the current
+  message.
+
+  The producer delivers in a background thread; its delivery callbacks resolve an asyncio future on the
+  running event loop, so awaiting the delivery does not occupy a thread. The handlers only return once their
+  results are acknowledged, so the offset of a message is never committed before its result is delivered,
+  and a failed delivery surfaces as an error of the message instead of being lost.
+
+  Args:
+    topic (str): The topic to send to.
+    value (Union[dict, bytes]): The message, serialized with `serializer`, or its serialized bytes.
+    key (bytes): Optional message key.
+
+  Returns:
+    RecordMetadata: The metadata of the acknowledged record.
+
+  Raises:
+    KafkaError: If the message could not be delivered.
+  """
+  loop = asyncio.get_running_loop()
+  delivered = loop.create_future()
+
+  def resolve(metadata):
+    if not delivered.done():
+      delivered.set_result(metadata)
+
+  def reject(error):
+    if not delivered.done():
+      delivered.set_exception(error)
+
+  if isinstance(value, bytes):
+    payload = value
+  else:
+    with span('serialize'):
+      payload = serializer.dumps(value)
+  with span('produce', topic=topic, bytes=len(payload)):
+    future = get_producer().send(topic, payload, key=key)
+    future.add_callback(lambda metadata: loop.call_soon_threadsafe(resolve, metadata))
+    future.add_errback(lambda error: loop.call_soon_threadsafe(reject, error))
+    return await delivered
 
-consumer_document = KafkaConsumer(
-  CONSUME_TOPIC['document'],
-  bootstrap_servers=[KAFKA_SERVER],
-  group_id="demo-group",
-  auto_offset_reset="earliest",
-  enable_auto_commit=False,
-  consumer_timeout_ms=1000
-)
 
-# Create kafka publisher
-producer = KafkaProducer(
-    bootstrap_servers=KAFKA_SERVER,  # Replace with your Kafka broker address
-    value_serializer=lambda v: json.dumps(v).encode('utf-8')  # Serialize messages as JSON
-)
\ No newline at end of file
+def flush(timeout: float = None):
+  """
+  Delivers the messages pending in the producer, waiting at most `timeout` seconds.
+  Does nothing if no message was ever published.
+  """
+  if producer is not None:
+    producer.flush(timeout=timeout)
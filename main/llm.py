@@ -1,22 +1,84 @@
 from math import gamma
+import re
+import json
+import httpx
+import asyncio
+import contextvars
+from itertools import combinations
+from typing import List, AsyncIterator
 from langchain_openai import ChatOpenAI
 from langchain.prompts import PromptTemplate
 from concurrent.futures import ThreadPoolExecutor
+from langchain_core.runnables import RunnableLambda
+from langchain_core.exceptions import OutputParserException
 from langchain_core.output_parsers import JsonOutputParser
 from prompt import (
     ANALYZE_PROMPT,
     SEO_PROMPT,
     SEGMENTATION_PROMPT,
-    GRAMMAR_CHECK_PROMPT
+    GRAMMAR_CHECK_PROMPT,
+    REPAIR_PROMPT,
+    combined_prompt,
+    PROMPT_VERSION
+)
+from tracing import log
+from cache import make_key, normalize_text
+from ratelimit import LimitedTransport, AsyncLimitedTransport
+from tokenizer import TokenCounter
+from chunking import (
+    split_text,
+    merge_segments,
+    merge_grammar_errors,
+    merge_news_info
 )
 from model import (
     NewsInfo,
     InputText,
     SeoScore,
     NewsSegments,
-    GrammarErrors
+    GrammarErrors,
+    TASK_MODELS,
+    combined_model
 )
 
+try:
+    import json_repair
+except ImportError:
+    json_repair = None
+
+ANALYSIS_MODES = ('split', 'combined')
+ANALYSIS_TASKS = ('analyze', 'segment', 'grammar')
+
+# Metadata attached to the runs of the chains invoked in the current context, e.g. the trace of a message
+RUN_METADATA = contextvars.ContextVar('run_metadata', default=None)
+
+
+class InputTooLongError(ValueError):
+    """
+    Raised when the prompt of a task would not fit in the context window of the model with its answer.
+    """
+
+
+def repair_json(text: str) -> dict:
+    """
+    Repairs the usual defects of a JSON answer: text or code fences around the object and trailing commas.
+    Falls back to the json_repair package when it is installed.
+
+    Raises:
+        ValueError: If no JSON object can be recovered from `text`.
+    """
+    start, end = text.find('{'), text.rfind('}')
+    if start != -1 and end > start:
+        try:
+            return json.loads(re.sub(r',\s*([}\]])', r'\1', text[start:end + 1]))
+        except ValueError:
+            pass
+    if json_repair is not None:
+        result = json_repair.loads(text)
+        if isinstance(result, dict) and result:
+            return result
+    raise ValueError('no JSON object in the answer')
+
 class AnalysisPipeline:
     """
     A class to handle the analysis pipeline for text using OpenAI's language model.
@@ -24,6 +86,47 @@ class AnalysisPipeline:
         api_key (str): The API key for accessing the OpenAI service.
         llm_model (str): The language model to be used.
         llm_host (str): The host URL for the language model.
+        cache (ResultCache): Optional cache of the analyze results, keyed by the normalized text,
+            the model name and the prompt version.
+        chunk_tokens (int): Token budget of a chunk in map-reduce mode. Inputs estimated above this budget are
+            split into chunks that are analyzed in parallel and merged; None always sends the whole input.
+        mode (str): Default analysis mode. 'split' sends the text analysis, grammar check and segmentation as
+            three requests; 'combined' sends a single request covering all three.
+        tasks (tuple): Default sub-analyses run by `analyze`, among 'analyze' (news information),
+            'segment' (segmentation) and 'grammar' (grammar check).
+        callbacks (list): Optional LangChain callback handlers attached to the chains, e.g. to record token usage
+            or the latency of the sub-analyses. The chains are tagged with their task name.
+        limiter (LlmLimiter): Optional rate and concurrency limiter of the language model requests, shared with
+            the other pipelines of the process. Every HTTP request of the ChatOpenAI client goes through it,
+            retries included.
+        router (LlmRouter): Optional router spreading the requests of every task over several endpoints, with
+            the model of each task; replaces the ChatOpenAI instance built from the settings above, which is then
+            not created.
+        compactor (Compactor): Optional compaction of the input of every sub-analysis before it is sent to the
+            language model; the segmentation, alone or in a combined request, keeps a compact timestamp index of
+            subtitle text.
+        token_counter (TokenCounter): Counts the tokens of the prompts and of the chunks; defaults to the estimate
+            of four characters per token.
+        max_tokens (dict): The completion budget of every task among 'analyze', 'segment', 'grammar' and
+            'combined'; a task without budget answers up to the limit of the server.
+        context_tokens (int): The context window of the model. A prompt that would not fit in it with the
+            completion budget of its task is refused with InputTooLongError instead of being sent; None
+            disables the check. Long inputs are chunked before, when `chunk_tokens` is set.
+        prompt_tokens (dict): The tokens of every task prompt without its input text; the 'combined' entry is the
+            prompt covering every task.
+        timeout (float): Seconds allowed for a language model request; None waits indefinitely.
+        max_retries (int): Number of retries of a language model request after a 429 or 5xx response or a
+            connection error.
+        llm (Runnable): Optional chat model used instead of the ChatOpenAI instance built from the settings above.
+        chains (dict): The prompt | model | parser chains of the 'analyze', 'segment', 'grammar' and 'combined'
+            tasks, built once and reused by every call. An answer that is not valid JSON is repaired, or the
+            model is asked once to rewrite it, before the task fails.
+        combined_chains (dict): The 'combined' chain of every selection of two or more tasks, whose prompt and
+            answer schema only cover these tasks; `chains['combined']` covers all three.
+        executor (ThreadPoolExecutor): Executor shared by the synchronous analyze calls; `max_workers`
+            sets its size.
+        batch_size (int): Maximum number of inputs sent in one batch call by `analyze_many`.
+        batch_concurrency (int): Maximum number of concurrent requests of one batch call.
     Methods:
         segment_text(text: str) -> NewsSegments:
             Segments the input text into news segments.
@@ -31,29 +134,109 @@ class AnalysisPipeline:
             Checks the input text for grammar errors.
         analyze_text(text: str) -> NewsInfo:
             Analyzes the input text to extract news information.
-        analyze(text: str) -> dict:
-            Performs text analysis, grammar check, and segmentation concurrently and returns the combined result.
+        analyze_combined(text: str, tasks=ANALYSIS_TASKS) -> dict:
+            Performs the selected tasks among text analysis, grammar check, and segmentation in a single request.
+        analyze(text: str, mode: str = None, tasks=None) -> dict:
+            Performs the selected tasks among text analysis, grammar check, and segmentation and returns the
+            combined result.
+        analyze_chunked(text: str, mode: str = 'split', tasks=ANALYSIS_TASKS) -> dict:
+            Performs the analysis in map-reduce mode over chunks of the input text.
+        predict_tokens(task: str, text: str) -> int:
+            Predicts the prompt tokens of `task` for the input text.
+        analyze_many(texts: List[str], mode: str = None, tasks=None, return_exceptions: bool = False,
+                     metadata: list = None) -> list:
+            Analyzes many texts, sending the requests of each task together as batches.
+        asegment_text, agrammar_check, aanalyze_text, aanalyze_combined, aanalyze, aanalyze_chunked, aanalyze_many:
+            Asynchronous counterparts of the methods above, using the async invoke path of the language model.
+        astream_segments(text: str) -> AsyncIterator[dict]:
+            Segments the input text, yielding every NewsSegment as soon as the model completed it.
+        close():
+            Shuts down the shared executor.
     """
     def __init__(
         self,
         api_key, 
         llm_model, 
-        llm_host
+        llm_host,
+        cache=None,
+        chunk_tokens=None,
+        mode='split',
+        tasks=ANALYSIS_TASKS,
+        callbacks=None,
+        limiter=None,
+        router=None,
+        compactor=None,
+        token_counter=None,
+        max_tokens=None,
+        context_tokens=None,
+        timeout=None,
+        max_retries=2,
+        llm=None,
+        max_workers=None,
+        batch_size=16,
+        batch_concurrency=16
     ):
+        if mode not in ANALYSIS_MODES:
+            raise ValueError(f'unknown analysis mode: {mode}')
         self.api_key = api_key
         self.llm_model = llm_model
         self.llm_host = llm_host
+        self.cache = cache
+        self.chunk_tokens = chunk_tokens
+        self.mode = mode
+        self.tasks = tasks
+        self.batch_size = batch_size
+        self.batch_concurrency = batch_concurrency
+        self.callbacks = callbacks
 
-        # Initialize the OpenAI ChatCompletion instance
-        self.openai_llm = ChatOpenAI(
-            model=llm_model,
-            temperature=0,
-            max_tokens=None,
-            timeout=None,
-            max_retries=2,
-            api_key=api_key,
-            base_url=llm_host,
-        )
+        self.limiter = limiter
+        self.router = router
+        self.compactor = compactor
+        self.token_counter = token_counter or TokenCounter('estimate')
+        self.max_tokens = max_tokens or {}
+        self.context_tokens = context_tokens
+        self.prompt_tokens = {}
+
+        # Initialize the OpenAI ChatCompletion instance, unless the router answers every task
+        self.openai_llm = llm
+        if llm is None and router is None:
+            self.openai_llm = ChatOpenAI(
+                model=llm_model,
+                temperature=0,
+                max_tokens=None,
+                timeout=timeout,
+                max_retries=max_retries,
+                api_key=api_key,
+                base_url=llm_host,
+                http_client=httpx.Client(transport=LimitedTransport(limiter)) if limiter else None,
+                http_async_client=httpx.AsyncClient(transport=AsyncLimitedTransport(limiter)) if limiter else None
+            )
+
+        # Build the chains once; the format instructions serialize the pydantic JSON schema
+        self.combined_chains = {
+            tasks: self._build_chain('combined', combined_prompt(tasks), combined_model(tasks), tasks=tasks)
+            for size in range(len(ANALYSIS_TASKS), 1, -1) for tasks in combinations(ANALYSIS_TASKS, size)
+        }
+        self.chains = {
+            'analyze': self._build_chain('analyze', ANALYZE_PROMPT, NewsInfo, format_instructions=False),
+            'segment': self._build_chain('segment', SEGMENTATION_PROMPT, NewsSegments),
+            'grammar': self._build_chain('grammar', GRAMMAR_CHECK_PROMPT, GrammarErrors),
+            'combined': self.combined_chains[ANALYSIS_TASKS]
+        }
+
+        # Shared by every synchronous analyze call
+        self.executor = ThreadPoolExecutor(max_workers=max_workers)
+
+        self._task_methods = {
+            'analyze': self.analyze_text,
+            'segment': self.segment_text,
+            'grammar': self.grammar_check
+        }
+        self._atask_methods = {
+            'analyze': self.aanalyze_text,
+            'segment': self.asegment_text,
+            'grammar': self.agrammar_check
+        }
 
         # Define the prompt templates
         self.seo_prompt = PromptTemplate(
@@ -71,14 +254,7 @@ class AnalysisPipeline:
         Returns:
             NewsSegments: The segmented news content as a NewsSegments object.
         """
-        parser = JsonOutputParser(pydantic_object=NewsSegments)
-        prompt = PromptTemplate(
-            template=SEGMENTATION_PROMPT,
-            input_variables=['text'],
-            partial_variables={"format_instructions": parser.get_format_instructions()},
-        )
-        chain = prompt | self.openai_llm | parser
-        result = chain.invoke({"text": text})
+        result = self.chains['segment'].invoke({"text": text}, config=self._run_config())
         return result
 
     def grammar_check(self, text: str) -> GrammarErrors:
@@ -91,14 +267,7 @@ class AnalysisPipeline:
         Returns:
             GrammarErrors: An object containing the grammar errors found in the text.
         """
-        parser = JsonOutputParser(pydantic_object=GrammarErrors)
-        prompt = PromptTemplate(
-            template=GRAMMAR_CHECK_PROMPT,
-            input_variables=['text'],
-            partial_variables={"format_instructions": parser.get_format_instructions()},
-        )
-        chain = prompt | self.openai_llm | parser
-        result = chain.invoke({"text": text})
+        result = self.chains['grammar'].invoke({"text": text}, config=self._run_config())
         return result
     
     def analyze_text(self, text: str) -> NewsInfo:
@@ -111,41 +280,697 @@ class AnalysisPipeline:
         Returns:
             NewsInfo: The extracted news information as a NewsInfo object.
         """
-        prompt = PromptTemplate(
-            input_variables=["text"],
-            template=ANALYZE_PROMPT
-        )
-        parser = JsonOutputParser(pydantic_object=NewsInfo)
-        chain = prompt | self.openai_llm | parser
-        result = chain.invoke({"text": text})
+        result = self.chains['analyze'].invoke({"text": text}, config=self._run_config())
         return result
     
-    def analyze(self, text: str) -> dict:
+    def analyze_combined(self, text: str, tasks=ANALYSIS_TASKS) -> dict:
+        """
+        Analyzes the given text, checks its grammar and segments it with a single request, covering the
+        selected tasks only.
+
+        Args:
+            text (str): The text to be analyzed.
+            tasks (tuple): Two or more sub-analyses among 'analyze', 'segment' and 'grammar', in this order.
+
+        Returns:
+            dict: The result of the selected tasks, with the keys of a CombinedAnalysis object.
+        """
+        result = self.combined_chains[tasks].invoke({"text": text}, config=self._run_config())
+        return result
+
+    def analyze(self, text: str, mode: str = None, tasks=None) -> dict:
         """
         Analyzes the given text using multiple concurrent tasks.
-        This method performs text analysis, grammar checking, and text segmentation
-        concurrently using a ThreadPoolExecutor. The results from these tasks are
-        then combined into a single dictionary and returned.
+        In 'split' mode, this method performs the selected tasks among text analysis,
+        grammar checking, and text segmentation concurrently on the shared executor.
+        In 'combined' mode, a single request covers the selected tasks. The results are
+        then combined into a single dictionary and returned. Results are served from and
+        stored in the cache when one is configured.
+        Args:
+            text (str): The text to be analyzed.
+            mode (str): 'split' or 'combined'; defaults to the mode of the pipeline.
+            tasks (Iterable[str]): The sub-analyses to run among 'analyze', 'segment' and 'grammar';
+                defaults to the tasks of the pipeline.
+        Returns:
+            dict: A dictionary containing the combined results of the selected tasks.
+        """
+        mode = mode or self.mode
+        tasks = self._select_tasks(tasks)
+        key = self._cache_key(text, mode, tasks)
+        if self.cache is not None:
+            cached = self.cache.get(key)
+            if cached is not None:
+                return cached
+
+        if self._is_long(text):
+            result = self.analyze_chunked(text, mode, tasks)
+        elif mode == 'combined' and len(tasks) > 1:
+            result = self._normalize_combined(self.analyze_combined(text, tasks), tasks)
+        else:
+            futures = [self._submit(self._task_methods[task], text) for task in tasks]
+
+            result = {}
+            for future in futures:
+                result.update(future.result())
+
+        if self.cache is not None:
+            self.cache.set(key, result)
+        return result
+
+    def analyze_chunked(self, text: str, mode: str = 'split', tasks=ANALYSIS_TASKS) -> dict:
+        """
+        Analyzes the given text in map-reduce mode.
+        The text is split into chunks of at most `chunk_tokens` tokens, on subtitle timestamp
+        boundaries for subtitle text and on paragraphs otherwise. Every selected sub-analysis
+        of every chunk runs concurrently. The segments are then merged by timestamp, the grammar
+        errors are deduplicated, and the overall summary and title are built from the chunk summaries.
+        Args:
+            text (str): The text to be analyzed.
+            mode (str): 'split' or 'combined', the analysis mode used for every chunk.
+            tasks (Iterable[str]): The sub-analyses to run among 'analyze', 'segment' and 'grammar'.
+        Returns:
+            dict: A dictionary containing the merged results of the selected tasks.
+        """
+        chunks = split_text(text, self.chunk_tokens, self.token_counter)
+        if mode == 'combined' and len(tasks) > 1:
+            futures = [self._submit(self.analyze_combined, chunk, tasks) for chunk in chunks]
+            results = [self._normalize_combined(future.result(), tasks) for future in futures]
+            summary = None
+            if 'analyze' in tasks:
+                summary = self.analyze_text(self._join_summaries(results)) if len(results) > 1 else results[0]
+            return self._merge_combined(results, summary, tasks)
+
+        futures = {
+            task: [self._submit(self._task_methods[task], chunk) for chunk in chunks]
+            for task in tasks
+        }
+
+        result = {}
+        if 'analyze' in futures:
+            news_infos = [future.result() for future in futures['analyze']]
+            summary = self.analyze_text(self._join_summaries(news_infos)) if len(news_infos) > 1 else news_infos[0]
+            result.update(merge_news_info(news_infos, summary))
+        if 'segment' in futures:
+            result.update(merge_segments([future.result() for future in futures['segment']]))
+        if 'grammar' in futures:
+            result.update(merge_grammar_errors([future.result() for future in futures['grammar']]))
+        return result
+
+    def analyze_many(
+        self, texts: List[str], mode: str = None, tasks=None, return_exceptions: bool = False, metadata: list = None
+    ) -> list:
+        """
+        Analyzes many texts, sending the requests of each task together.
+        The inputs of each selected task are sent with `chain.batch` in batches of at most
+        `batch_size` inputs and `batch_concurrency` concurrent requests, so an inference server
+        with continuous batching receives them together. The tasks run concurrently on the
+        shared executor. Cached texts are not sent, and texts exceeding the chunk budget are
+        analyzed one by one in map-reduce mode.
+        Args:
+            texts (List[str]): The texts to be analyzed.
+            mode (str): 'split' or 'combined'; defaults to the mode of the pipeline.
+            tasks (Iterable[str]): The sub-analyses to run; defaults to the tasks of the pipeline.
+            return_exceptions (bool): Return the exception of a failed text in its place instead of raising it.
+            metadata (list): Optional metadata of every text, attached to the runs of its requests so that
+                callback handlers can tell the texts of a batch apart.
+        Returns:
+            list: The result dictionary of every text, in input order.
+        """
+        mode = mode or self.mode
+        tasks = self._select_tasks(tasks)
+        metadata = metadata or [None] * len(texts)
+        results, keys, batched, singles = self._partition(texts, mode, tasks)
+
+        inputs = [{"text": texts[index]} for index in batched]
+        batched_metadata = [metadata[index] for index in batched]
+        futures = [
+            self._submit(self._batch_chain, chain, inputs, batched_metadata)
+            for chain in self._chains(mode, tasks)
+        ] if inputs else []
+
+        for index in singles:
+            token = RUN_METADATA.set(metadata[index])
+            try:
+                results[index] = self.analyze(texts[index], mode, tasks)
+            except Exception as e:
+                results[index] = e
+            finally:
+                RUN_METADATA.reset(token)
+
+        self._collect(results, keys, batched, [future.result() for future in futures], mode, tasks)
+        return self._raise_or_return(results, return_exceptions)
+
+    async def asegment_text(self, text: str) -> NewsSegments:
+        """
+        Asynchronously segments the given text into news segments.
+
+        Args:
+            text (str): The input text to be segmented.
+
+        Returns:
+            NewsSegments: The segmented news content as a NewsSegments object.
+        """
+        result = await self.chains['segment'].ainvoke({"text": text}, config=self._run_config())
+        return result
+
+    async def astream_segments(self, text: str) -> AsyncIterator[dict]:
+        """
+        Segments the given text, yielding each segment as soon as it is complete.
+        The model output is streamed and parsed as partial JSON. A segment is complete once
+        the model starts the next one, or once the stream ends. Inputs exceeding the chunk
+        budget are split into chunks streamed concurrently, so segments of different chunks
+        may interleave; each segment carries its own timestamps. The segmentation is served
+        from and stored in the cache under the key of a split 'segment' analysis.
+
+        Args:
+            text (str): The input text to be segmented.
+
+        Yields:
+            dict: The completed segments, as NewsSegment dictionaries.
+        """
+        key = self._cache_key(text, 'split', ('segment',))
+        if self.cache is not None:
+            cached = await self.cache.aget(key)
+            if cached is not None:
+                for segment in cached['segments']:
+                    yield segment
+                return
+
+        segments = []
+        async for segment in self._astream_segments(text):
+            segments.append(segment)
+            yield segment
+        if self.cache is not None:
+            await self.cache.aset(key, merge_segments([{'segments': segments}]))
+
+    async def _astream_segments(self, text: str) -> AsyncIterator[dict]:
+        """
+        Streams the segmentation of the given text, chunked when it exceeds the chunk budget.
+        """
+        chunks = split_text(text, self.chunk_tokens, self.token_counter) if self._is_long(text) else [text]
+        if len(chunks) == 1:
+            async for segment in self._astream_chunk_segments(chunks[0]):
+                yield segment
+            return
+
+        queue = asyncio.Queue()
+
+        async def pump(chunk):
+            try:
+                async for segment in self._astream_chunk_segments(chunk):
+                    await queue.put(segment)
+                await queue.put(None)
+            except Exception as e:
+                await queue.put(e)
+
+        pumps = [asyncio.create_task(pump(chunk)) for chunk in chunks]
+        try:
+            remaining = len(pumps)
+            while remaining:
+                item = await queue.get()
+                if item is None:
+                    remaining -= 1
+                elif isinstance(item, Exception):
+                    raise item
+                else:
+                    yield item
+        finally:
+            for task in pumps:
+                task.cancel()
+
+    async def _astream_chunk_segments(self, text: str) -> AsyncIterator[dict]:
+        """
+        Streams the segmentation of a single input, yielding each segment once it is complete.
+        """
+        emitted, segments = 0, []
+        async for partial in self.chains['segment'].astream({"text": text}, config=self._run_config()):
+            segments = (partial or {}).get('segments') or []
+            while emitted < len(segments) - 1:
+                yield segments[emitted]
+                emitted += 1
+        while emitted < len(segments):
+            yield segments[emitted]
+            emitted += 1
+
+    async def agrammar_check(self, text: str) -> GrammarErrors:
+        """
+        Asynchronously checks the grammar of the given text.
+
+        Args:
+            text (str): The text to be checked for grammar errors.
+
+        Returns:
+            GrammarErrors: An object containing the grammar errors found in the text.
+        """
+        result = await self.chains['grammar'].ainvoke({"text": text}, config=self._run_config())
+        return result
+
+    async def aanalyze_text(self, text: str) -> NewsInfo:
+        """
+        Asynchronously analyzes the given text and extracts news information.
+
+        Args:
+            text (str): The text to be analyzed.
+
+        Returns:
+            NewsInfo: The extracted news information as a NewsInfo object.
+        """
+        result = await self.chains['analyze'].ainvoke({"text": text}, config=self._run_config())
+        return result
+
+    async def aanalyze_combined(self, text: str, tasks=ANALYSIS_TASKS) -> dict:
+        """
+        Asynchronously analyzes the given text, checks its grammar and segments it with a single request,
+        covering the selected tasks only.
+
+        Args:
+            text (str): The text to be analyzed.
+            tasks (tuple): Two or more sub-analyses among 'analyze', 'segment' and 'grammar', in this order.
+
+        Returns:
+            dict: The result of the selected tasks, with the keys of a CombinedAnalysis object.
+        """
+        result = await self.combined_chains[tasks].ainvoke({"text": text}, config=self._run_config())
+        return result
+
+    async def aanalyze(self, text: str, mode: str = None, tasks=None) -> dict:
+        """
+        Asynchronously analyzes the given text.
+        In 'split' mode, the requests of the selected tasks are awaited concurrently on
+        the running event loop, so no worker thread is held while the language model
+        responds. In 'combined' mode, a single request covers the selected tasks.
+        Results are served from and stored in the cache when one is configured.
         Args:
             text (str): The text to be analyzed.
+            mode (str): 'split' or 'combined'; defaults to the mode of the pipeline.
+            tasks (Iterable[str]): The sub-analyses to run among 'analyze', 'segment' and 'grammar';
+                defaults to the tasks of the pipeline.
+        Returns:
+            dict: A dictionary containing the combined results of the selected tasks.
+        """
+        mode = mode or self.mode
+        tasks = self._select_tasks(tasks)
+        key = self._cache_key(text, mode, tasks)
+        if self.cache is not None:
+            cached = await self.cache.aget(key)
+            if cached is not None:
+                return cached
+
+        if self._is_long(text):
+            result = await self.aanalyze_chunked(text, mode, tasks)
+        elif mode == 'combined' and len(tasks) > 1:
+            result = self._normalize_combined(await self.aanalyze_combined(text, tasks), tasks)
+        else:
+            result = {}
+            for task_result in await asyncio.gather(*(self._atask_methods[task](text) for task in tasks)):
+                result.update(task_result)
+
+        if self.cache is not None:
+            await self.cache.aset(key, result)
+        return result
+
+    async def aanalyze_chunked(self, text: str, mode: str = 'split', tasks=ANALYSIS_TASKS) -> dict:
+        """
+        Asynchronously analyzes the given text in map-reduce mode.
+        See `analyze_chunked`. The reduce call building the overall summary starts as soon
+        as the chunk analyses are done, while the other sub-analyses may still be running.
+        Args:
+            text (str): The text to be analyzed.
+            mode (str): 'split' or 'combined', the analysis mode used for every chunk.
+            tasks (Iterable[str]): The sub-analyses to run among 'analyze', 'segment' and 'grammar'.
+        Returns:
+            dict: A dictionary containing the merged results of the selected tasks.
+        """
+        chunks = split_text(text, self.chunk_tokens, self.token_counter)
+        if mode == 'combined' and len(tasks) > 1:
+            results = [
+                self._normalize_combined(result, tasks)
+                for result in await asyncio.gather(*(self.aanalyze_combined(chunk, tasks) for chunk in chunks))
+            ]
+            summary = None
+            if 'analyze' in tasks:
+                summary = await self.aanalyze_text(self._join_summaries(results)) if len(results) > 1 else results[0]
+            return self._merge_combined(results, summary, tasks)
+
+        async def news_info():
+            news_infos = await asyncio.gather(*(self.aanalyze_text(chunk) for chunk in chunks))
+            summary = await self.aanalyze_text(self._join_summaries(news_infos)) if len(news_infos) > 1 else news_infos[0]
+            return merge_news_info(news_infos, summary)
+
+        async def merged(task):
+            if task == 'analyze':
+                return await news_info()
+            results = await asyncio.gather(*(self._atask_methods[task](chunk) for chunk in chunks))
+            return merge_segments(results) if task == 'segment' else merge_grammar_errors(results)
+
+        result = {}
+        for task_result in await asyncio.gather(*(merged(task) for task in tasks)):
+            result.update(task_result)
+        return result
+
+    async def aanalyze_many(
+        self, texts: List[str], mode: str = None, tasks=None, return_exceptions: bool = False, metadata: list = None
+    ) -> list:
+        """
+        Asynchronously analyzes many texts, sending the requests of each task together.
+        See `analyze_many`; the inputs are sent with `chain.abatch`.
+        Args:
+            texts (List[str]): The texts to be analyzed.
+            mode (str): 'split' or 'combined'; defaults to the mode of the pipeline.
+            tasks (Iterable[str]): The sub-analyses to run; defaults to the tasks of the pipeline.
+            return_exceptions (bool): Return the exception of a failed text in its place instead of raising it.
+            metadata (list): Optional metadata of every text, attached to the runs of its requests.
+        Returns:
+            list: The result dictionary of every text, in input order.
+        """
+        mode = mode or self.mode
+        tasks = self._select_tasks(tasks)
+        metadata = metadata or [None] * len(texts)
+        results, keys, batched, singles = await self._off_loop(self._partition, texts, mode, tasks)
+
+        async def single(index):
+            # Every single runs in its own task, so the metadata only applies to its requests
+            RUN_METADATA.set(metadata[index])
+            try:
+                results[index] = await self.aanalyze(texts[index], mode, tasks)
+            except Exception as e:
+                results[index] = e
+
+        inputs = [{"text": texts[index]} for index in batched]
+        batched_metadata = [metadata[index] for index in batched]
+        chain_outputs, _ = await asyncio.gather(
+            asyncio.gather(*(
+                self._abatch_chain(chain, inputs, batched_metadata)
+                for chain in (self._chains(mode, tasks) if inputs else ())
+            )),
+            asyncio.gather(*(single(index) for index in singles))
+        )
+
+        await self._off_loop(self._collect, results, keys, batched, chain_outputs, mode, tasks)
+        return self._raise_or_return(results, return_exceptions)
+
+    def predict_tokens(self, task: str, text: str) -> int:
+        """
+        Predicts the prompt tokens of `task` for `text` with the token counter.
+
+        Args:
+            task (str): The task among 'analyze', 'segment', 'grammar' and 'combined'.
+            text (str): The input text.
+
         Returns:
-            dict: A dictionary containing the combined results of the text analysis,
-                  grammar check, and text segmentation.
+            int: The predicted prompt tokens.
         """
-        with ThreadPoolExecutor() as executor:
-            analyze_future = executor.submit(self.analyze_text, text)
-            grammar_future = executor.submit(self.grammar_check, text)
-            segments_future = executor.submit(self.segment_text, text)
+        return self.prompt_tokens[task] + self.token_counter.count(text)
 
-            analyze_result = analyze_future.result()
-            grammar_errors = grammar_future.result()
-            segments = segments_future.result()
-            
-            result = {
-                **analyze_result,
-                **segments,
-                **grammar_errors
-            }
+    def _is_long(self, text: str) -> bool:
+        """
+        Tells whether `text` exceeds the chunk budget and is analyzed in map-reduce mode.
+        """
+        return self.chunk_tokens is not None and self.token_counter.count(text) > self.chunk_tokens
+
+    @staticmethod
+    def _join_summaries(news_infos: list) -> str:
+        """
+        Joins the chunk summaries into the input of the reduce call.
+        """
+        return '\n\n'.join(news_info['summary'] for news_info in news_infos)
+
+    def close(self):
+        """
+        Shuts down the shared executor, waiting for the running calls.
+        """
+        self.executor.shutdown(wait=True)
+
+    def _build_chain(self, name: str, template: str, pydantic_object, format_instructions: bool = True,
+                     tasks: tuple = None):
+        """
+        Builds the prompt | model | JSON parser chain of a task.
+
+        Args:
+            name (str): The task name, used as run name and tag of the chain.
+            template (str): The prompt template, with a `text` input variable.
+            pydantic_object (type): The model describing the expected JSON output.
+            format_instructions (bool): Whether the template has a `format_instructions` variable to fill
+                with the JSON schema of `pydantic_object`.
+            tasks (tuple): The tasks answered by the chain, for a 'combined' chain; defaults to `name` alone.
+
+        Returns:
+            Runnable: The chain.
+        """
+        parser = JsonOutputParser(pydantic_object=pydantic_object)
+        partial_variables = {"format_instructions": parser.get_format_instructions()} if format_instructions else {}
+        prompt = PromptTemplate(
+            template=template,
+            input_variables=['text'],
+            partial_variables=partial_variables,
+        )
+        config = {'run_name': name, 'tags': [name]}
+        if self.callbacks:
+            config['callbacks'] = self.callbacks
+        # The combined chains share the entry of their name, which keeps the largest prompt
+        prompt_tokens = self.token_counter.count_prompt(prompt.format(text=''))
+        self.prompt_tokens[name] = max(self.prompt_tokens.get(name, 0), prompt_tokens)
+
+        chat_model = self.router.for_task(name) if self.router is not None else self.openai_llm
+        if self.max_tokens.get(name):
+            chat_model = chat_model.bind(max_tokens=self.max_tokens[name])
+        chain = prompt | chat_model | parser
+        if self.compactor is not None or self.context_tokens:
+            chain = RunnableLambda(self._prepare_input(name, tasks or (name,)), name=f'{name}_input') | chain
+        return chain.with_fallbacks(
+            [self._build_repair(name, parser, chat_model)],
+            exceptions_to_handle=(OutputParserException,),
+            exception_key='error'
+        ).with_config(config)
+
+    def _prepare_input(self, name: str, tasks: tuple):
+        """
+        Returns the first step of the chain `name` answering `tasks`: compacts the text, reported with the trace of
+        the message, and refuses a prompt that would not fit in the context window.
+        """
+        def prepare(inputs: dict, config) -> dict:
+            text = inputs['text']
+            if self.compactor is not None:
+                text = self.compactor.compact(name, text, (config.get('metadata') or {}).get('trace_id'), tasks)
+            if self.context_tokens:
+                tokens = self.predict_tokens(name, text)
+                if tokens + self.max_tokens.get(name, 0) > self.context_tokens:
+                    raise InputTooLongError(
+                        f'the {name} prompt has {tokens} tokens and its answer up to {self.max_tokens.get(name, 0)},'
+                        f' over the context window of {self.context_tokens}'
+                    )
+            return {**inputs, 'text': text}
+        return prepare
 
+    @staticmethod
+    def _build_repair(name: str, parser, chat_model):
+        """
+        Builds the fallback of the chain `name` when the answer of the model is not valid JSON. The answer is
+        repaired locally when possible; otherwise the model is asked once to rewrite its own answer, without
+        the input text, so only the failed task is sent again.
+        """
+        prompt = PromptTemplate(
+            template=REPAIR_PROMPT,
+            input_variables=['error', 'answer'],
+            partial_variables={"format_instructions": parser.get_format_instructions()},
+        )
+        reask = prompt | chat_model | parser
+
+        def reask_inputs(error: OutputParserException) -> dict:
+            log('json_repair', level='warning', task=name, method='reask', error=str(error)[:200])
+            return {'error': str(error), 'answer': error.llm_output or ''}
+
+        def repair_locally(error: OutputParserException):
+            try:
+                result = repair_json(error.llm_output or '')
+            except ValueError:
+                return None
+            log('json_repair', task=name, method='local')
             return result
 
+        def repair(inputs: dict, config):
+            result = repair_locally(inputs['error'])
+            return result if result is not None else reask.invoke(reask_inputs(inputs['error']), config)
+
+        async def arepair(inputs: dict, config):
+            result = repair_locally(inputs['error'])
+            return result if result is not None else await reask.ainvoke(reask_inputs(inputs['error']), config)
+
+        return RunnableLambda(repair, afunc=arepair, name=f'{name}_repair')
+
+    def _batch_chain(self, chain, inputs: list, metadata: list) -> list:
+        """
+        Runs `chain` on `inputs` in batches, returning the exception of a failed input in its place.
+        """
+        outputs = []
+        for start in range(0, len(inputs), self.batch_size):
+            outputs.extend(chain.batch(
+                inputs[start:start + self.batch_size],
+                config=self._batch_configs(metadata[start:start + self.batch_size]),
+                return_exceptions=True
+            ))
+        return outputs
+
+    async def _abatch_chain(self, chain, inputs: list, metadata: list) -> list:
+        """
+        Asynchronously runs `chain` on `inputs` in batches, returning the exception of a failed input in
+        its place.
+        """
+        outputs = []
+        for start in range(0, len(inputs), self.batch_size):
+            outputs.extend(await chain.abatch(
+                inputs[start:start + self.batch_size],
+                config=self._batch_configs(metadata[start:start + self.batch_size]),
+                return_exceptions=True
+            ))
+        return outputs
+
+    def _batch_configs(self, metadata: list) -> list:
+        """
+        Returns the run config of every input of a batch, with its metadata.
+        """
+        return [
+            {'max_concurrency': self.batch_concurrency, 'metadata': item or {}}
+            for item in metadata
+        ]
+
+    @staticmethod
+    def _run_config() -> dict:
+        """
+        Returns the run config of a chain invoked in the current context, with the metadata of RUN_METADATA.
+        """
+        return {'metadata': RUN_METADATA.get() or {}}
+
+    async def _off_loop(self, function, *args):
+        """
+        Runs `function`, which reads or fills the cache, in a worker thread when the cache blocks on I/O.
+        """
+        if self.cache is not None and self.cache.blocking:
+            return await asyncio.to_thread(function, *args)
+        return function(*args)
+
+    def _submit(self, function, *args):
+        """
+        Submits `function` to the shared executor, running it in a copy of the current context so that
+        RUN_METADATA follows the call.
+        """
+        return self.executor.submit(contextvars.copy_context().run, function, *args)
+
+    @staticmethod
+    def _chain_names(mode: str, tasks: tuple) -> tuple:
+        """
+        Returns the names of the chains that answer `tasks` in `mode`.
+        """
+        return ('combined',) if mode == 'combined' and len(tasks) > 1 else tasks
+
+    def _chains(self, mode: str, tasks: tuple) -> list:
+        """
+        Returns the chains that answer `tasks` in `mode`.
+        """
+        if mode == 'combined' and len(tasks) > 1:
+            return [self.combined_chains[tasks]]
+        return [self.chains[task] for task in tasks]
+
+    def _partition(self, texts: List[str], mode: str, tasks: tuple):
+        """
+        Splits the texts of a batch into cached results, texts sent in batch and long texts analyzed one by one.
+
+        Returns:
+            tuple: The result list holding the cached results, the cache keys, the indexes of the texts sent
+                   in batch and the indexes of the long texts.
+        """
+        results = [None] * len(texts)
+        keys = [self._cache_key(text, mode, tasks) for text in texts]
+        batched, singles = [], []
+        for index, text in enumerate(texts):
+            cached = self.cache.get(keys[index]) if self.cache is not None else None
+            if cached is not None:
+                results[index] = cached
+            elif self._is_long(text):
+                singles.append(index)
+            else:
+                batched.append(index)
+        return results, keys, batched, singles
+
+    def _collect(self, results: list, keys: list, batched: list, chain_outputs: list, mode: str, tasks: tuple):
+        """
+        Combines the batch outputs of the chains answering `tasks` in `mode` into the results of the batched
+        texts and caches them.
+        """
+        combined = self._chain_names(mode, tasks) == ('combined',)
+        for position, index in enumerate(batched):
+            outputs = [outputs[position] for outputs in chain_outputs]
+            error = next((output for output in outputs if isinstance(output, Exception)), None)
+            if error is not None:
+                results[index] = error
+                continue
+            result = {}
+            for output in outputs:
+                result.update(output)
+            if combined:
+                result = self._normalize_combined(result, tasks)
+            if self.cache is not None:
+                self.cache.set(keys[index], result)
+            results[index] = result
+
+    @staticmethod
+    def _raise_or_return(results: list, return_exceptions: bool) -> list:
+        """
+        Raises the first exception of `results` unless `return_exceptions` is set.
+        """
+        if not return_exceptions:
+            for result in results:
+                if isinstance(result, Exception):
+                    raise result
+        return results
+
+    def _select_tasks(self, tasks) -> tuple:
+        """
+        Returns the selected tasks in their canonical order, defaulting to the tasks of the pipeline.
+
+        Raises:
+            ValueError: If a task is unknown or no task is selected.
+        """
+        tasks = set(self.tasks if tasks is None else tasks)
+        unknown = tasks - set(ANALYSIS_TASKS)
+        if unknown:
+            raise ValueError(f'unknown analysis tasks: {sorted(unknown)}')
+        if not tasks:
+            raise ValueError('no analysis task selected')
+        return tuple(task for task in ANALYSIS_TASKS if task in tasks)
+
+    def _cache_key(self, text: str, mode: str, tasks: tuple) -> str:
+        """
+        Builds the cache key of the analyze result of `text` in `mode` for `tasks`, with the models answering them.
+        """
+        if self.router is not None:
+            model = ','.join(self.router.model_for(name) for name in self._chain_names(mode, tasks))
+        else:
+            model = self.llm_model
+        compaction = str(self.compactor) if self.compactor is not None else 'raw'
+        return make_key('analyze', mode, ','.join(tasks), model, PROMPT_VERSION, compaction, normalize_text(text))
+
+    @staticmethod
+    def _normalize_combined(result: dict, tasks: tuple) -> dict:
+        """
+        Keeps the keys of the selected tasks in a combined answer and fills the lists it may omit, so it has the
+        same keys as a split result of `tasks`.
+        """
+        keys = {key for task in tasks for key in TASK_MODELS[task].model_fields}
+        lists = {key: [] for task, key in (('segment', 'segments'), ('grammar', 'grammar_errors')) if task in tasks}
+        return {**lists, **{key: value for key, value in result.items() if key in keys}}
+
+    @staticmethod
+    def _merge_combined(results: list, summary: dict, tasks: tuple) -> dict:
+        """
+        Merges the combined results of the chunks for the selected tasks; `summary` is the overall news
+        information when 'analyze' is selected.
+        """
+        merged = {}
+        if 'analyze' in tasks:
+            merged.update(merge_news_info(results, summary))
+        if 'segment' in tasks:
+            merged.update(merge_segments(results))
+        if 'grammar' in tasks:
+            merged.update(merge_grammar_errors(results))
+        return merged
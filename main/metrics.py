@@ -0,0 +1,331 @@
+"""
+This module provides the metrics of the workers, exposed in the Prometheus text format on a /metrics endpoint.
+
+The metrics live in a process-wide registry. The runtime counts the messages of every topic and reports its queue
+depth and consumer lag, the workers time each stage of a message, and a LangChain callback handler attached to
+the chains of AnalysisPipeline times every sub-analysis and records the token counts of the language model.
+
+Classes:
+    Metric: Base class of the metrics.
+    Counter: Monotonic counter with labels.
+    Gauge: Value with labels that goes up and down.
+    Histogram: Distribution of observed values over fixed buckets, with labels.
+    Registry: Set of metrics rendered in the Prometheus text format.
+    AnalysisMetrics: LangChain callback handler recording the latency and token counts of the sub-analyses.
+
+Functions:
+    create_app: Creates the FastAPI application serving /metrics.
+    start_server: Serves /metrics in a background thread.
+
+Metrics:
+    MESSAGES: Messages per topic and status: consumed, succeeded, failed, skipped or dead_lettered.
+    STAGE_SECONDS: Latency of the worker stages per topic: decode, transcribe, extract, analyze, serialize and sink.
+    ANALYSIS_SECONDS: Latency of the sub-analyses per task: analyze, segment, grammar and combined.
+    LLM_TOKENS: Prompt and completion tokens per language model request and task.
+    QUEUE_DEPTH: Consumed messages not processed yet per topic.
+    CONSUMER_LAG: Records not fetched yet per topic and partition.
+    LLM_CONCURRENCY: Adaptive concurrency limit and in-flight requests toward the language model.
+    LLM_REQUESTS: Language model HTTP requests per outcome: ok, throttled or failed.
+    INPUT_TOKENS_SAVED: Estimated input tokens removed by the compaction per sub-analysis.
+    MESSAGE_TOKENS: Prompt and completion tokens spent on a message per topic.
+"""
+import time
+import threading
+from contextlib import contextmanager
+
+import uvicorn
+from fastapi import FastAPI
+from fastapi.responses import PlainTextResponse
+from langchain_core.callbacks import BaseCallbackHandler
+
+from tracing import log
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600)
+TOKEN_BUCKETS = (16, 64, 256, 1024, 2048, 4096, 8192, 16384, 32768)
+
+
+class Metric:
+    """
+    Base class of the metrics, holding one value per combination of label values.
+
+    Attributes:
+        name (str): The metric name.
+        help (str): The description of the metric.
+        labelnames (tuple): The names of the labels.
+    """
+    kind = 'untyped'
+
+    def __init__(self, name: str, help: str, labelnames=()):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def _key(self, labels: dict) -> tuple:
+        if set(labels) != set(self.labelnames):
+            raise ValueError(f'{self.name} expects the labels {self.labelnames}, got {tuple(labels)}')
+        return tuple(str(labels[name]) for name in self.labelnames)
+
+    def _format(self, key: tuple, extra: dict = None) -> str:
+        pairs = list(zip(self.labelnames, key)) + list((extra or {}).items())
+        if not pairs:
+            return ''
+        escaped = (str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') for _, value in pairs)
+        return '{' + ','.join(f'{name}="{value}"' for (name, _), value in zip(pairs, escaped)) + '}'
+
+    def render(self) -> list:
+        lines = [f'# HELP {self.name} {self.help}', f'# TYPE {self.name} {self.kind}']
+        with self._lock:
+            values = dict(self._values)
+        for key, value in sorted(values.items()):
+            lines.extend(self._samples(key, value))
+        return lines
+
+    def _samples(self, key: tuple, value) -> list:
+        return [f'{self.name}{self._format(key)} {value}']
+
+
+class Counter(Metric):
+    """
+    Monotonic counter with labels.
+    """
+    kind = 'counter'
+
+    def inc(self, amount: float = 1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+
+class Gauge(Metric):
+    """
+    Value with labels that goes up and down.
+    """
+    kind = 'gauge'
+
+    def set(self, value: float, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = value
+
+
+class Histogram(Metric):
+    """
+    Distribution of observed values over fixed buckets, with labels.
+
+    Attributes:
+        buckets (tuple): The upper bounds of the buckets, in increasing order.
+    """
+    kind = 'histogram'
+
+    def __init__(self, name: str, help: str, labelnames=(), buckets=LATENCY_BUCKETS):
+        super().__init__(name, help, labelnames)
+        self.buckets = tuple(buckets)
+
+    def observe(self, value: float, **labels):
+        key = self._key(labels)
+        with self._lock:
+            counts, total, observed = self._values.get(key, ((0,) * len(self.buckets), 0.0, 0))
+            counts = tuple(count + (value <= bound) for count, bound in zip(counts, self.buckets))
+            self._values[key] = (counts, total + value, observed + 1)
+
+    @contextmanager
+    def time(self, **labels):
+        """
+        Observes the duration of the `with` block in seconds, including when it raises.
+        """
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, **labels)
+
+    def _samples(self, key: tuple, value) -> list:
+        # A value counts in every bucket it fits in, so the bucket counts are cumulative already
+        counts, total, observed = value
+        samples = [f'{self.name}_bucket{self._format(key, {"le": bound})} {count}'
+                   for bound, count in zip(self.buckets, counts)]
+        samples.append(f'{self.name}_bucket{self._format(key, {"le": "+Inf"})} {observed}')
+        samples.append(f'{self.name}_sum{self._format(key)} {total}')
+        samples.append(f'{self.name}_count{self._format(key)} {observed}')
+        return samples
+
+
+class Registry:
+    """
+    Set of metrics rendered together in the Prometheus text format.
+
+    Methods:
+        register(metric) -> Metric:
+            Adds `metric` to the registry and returns it.
+        render() -> str:
+            Returns every metric in the Prometheus text format.
+    """
+    def __init__(self):
+        self._metrics = []
+
+    def register(self, metric: Metric) -> Metric:
+        self._metrics.append(metric)
+        return metric
+
+    def render(self) -> str:
+        return '\n'.join(line for metric in self._metrics for line in metric.render()) + '\n'
+
+
+REGISTRY = Registry()
+
+MESSAGES = REGISTRY.register(Counter(
+    'news_messages_total', 'Messages per topic and status: consumed, succeeded, failed, skipped or dead_lettered.',
+    ('topic', 'status')))
+STAGE_SECONDS = REGISTRY.register(Histogram(
+    'news_stage_seconds', 'Latency of the worker stages of a message.', ('topic', 'stage')))
+ANALYSIS_SECONDS = REGISTRY.register(Histogram(
+    'news_analysis_seconds', 'Latency of the sub-analyses of AnalysisPipeline, including the output parsing.',
+    ('task', 'status')))
+LLM_TOKENS = REGISTRY.register(Histogram(
+    'news_llm_tokens', 'Prompt and completion tokens per language model request.', ('task', 'kind'),
+    buckets=TOKEN_BUCKETS))
+QUEUE_DEPTH = REGISTRY.register(Gauge(
+    'news_queue_depth', 'Consumed messages of a topic not processed yet.', ('topic',)))
+CONSUMER_LAG = REGISTRY.register(Gauge(
+    'news_consumer_lag', 'Records of a partition not fetched yet.', ('topic', 'partition')))
+LLM_CONCURRENCY = REGISTRY.register(Gauge(
+    'news_llm_concurrency', 'Adaptive concurrency limit and in-flight requests toward the language model.',
+    ('kind',)))
+LLM_REQUESTS = REGISTRY.register(Counter(
+    'news_llm_requests_total', 'Language model HTTP requests per outcome: ok, throttled or failed.', ('status',)))
+INPUT_TOKENS_SAVED = REGISTRY.register(Histogram(
+    'news_input_tokens_saved', 'Estimated input tokens removed by the compaction per sub-analysis.', ('task',),
+    buckets=TOKEN_BUCKETS))
+MESSAGE_TOKENS = REGISTRY.register(Histogram(
+    'news_message_tokens', 'Prompt and completion tokens spent on a message, cache hits included.', ('topic', 'kind'),
+    buckets=TOKEN_BUCKETS))
+
+
+class AnalysisMetrics(BaseCallbackHandler):
+    """
+    LangChain callback handler recording the latency of every sub-analysis and the token counts of every
+    language model request in ANALYSIS_SECONDS and LLM_TOKENS.
+
+    The chains of AnalysisPipeline are tagged with their task name, which the handler reads from the tags of
+    the runs. Only the top-level run of a chain is timed, so a sub-analysis is observed once per input.
+
+    The token counts are also added up per message, from the `trace_id` metadata of the runs, until the worker
+    collects them with `pop_usage` once the message is analyzed. The requests still running when the usage is
+    collected are no longer counted toward the message, and the counts nobody collects expire after `usage_ttl`
+    seconds, so abandoned messages do not accumulate.
+
+    Attributes:
+        tasks (tuple): The task names looked up in the tags.
+        usage_ttl (float): The seconds after its last update the usage of a message is forgotten.
+
+    Methods:
+        pop_usage(trace_id: str) -> dict:
+            Returns and forgets the prompt and completion tokens spent on the message of `trace_id`.
+    """
+    # The handler only updates in-memory metrics, so it runs in the calling thread or event loop
+    run_inline = True
+
+    def __init__(self, tasks=('analyze', 'segment', 'grammar', 'combined'), usage_ttl: float = 600.0):
+        self.tasks = tuple(tasks)
+        self.usage_ttl = usage_ttl
+        self._starts = {}
+        # Trace id of the running language model requests, and tokens and last update per trace id
+        self._traces = {}
+        self._usage = {}
+        self._lock = threading.Lock()
+
+    def on_chain_start(self, serialized, inputs, *, run_id, parent_run_id=None, tags=None, **kwargs):
+        task = self._task(tags)
+        if parent_run_id is None and task is not None:
+            self._starts[run_id] = (task, time.perf_counter())
+
+    def on_chain_end(self, outputs, *, run_id, **kwargs):
+        self._observe(run_id, 'success')
+
+    def on_chain_error(self, error, *, run_id, **kwargs):
+        self._observe(run_id, 'error')
+
+    def on_chat_model_start(self, serialized, messages, *, run_id, metadata=None, **kwargs):
+        trace_id = (metadata or {}).get('trace_id')
+        if trace_id is not None:
+            self._traces[run_id] = trace_id
+
+    def on_llm_error(self, error, *, run_id, **kwargs):
+        self._traces.pop(run_id, None)
+
+    def on_llm_end(self, response, *, run_id=None, tags=None, **kwargs):
+        task = self._task(tags) or 'unknown'
+        trace_id = self._traces.pop(run_id, None)
+        usage = (response.llm_output or {}).get('token_usage') or {}
+        prompt_tokens, completion_tokens = usage.get('prompt_tokens'), usage.get('completion_tokens')
+        if prompt_tokens is None:
+            # Streamed responses report their usage on the messages
+            metadata = [getattr(getattr(generation, 'message', None), 'usage_metadata', None) or {}
+                        for generations in response.generations for generation in generations]
+            if not any(metadata):
+                return
+            prompt_tokens = sum(item.get('input_tokens', 0) for item in metadata)
+            completion_tokens = sum(item.get('output_tokens', 0) for item in metadata)
+        LLM_TOKENS.observe(prompt_tokens, task=task, kind='prompt')
+        LLM_TOKENS.observe(completion_tokens or 0, task=task, kind='completion')
+        if trace_id is not None:
+            with self._lock:
+                now = time.monotonic()
+                self._expire(now)
+                usage, _ = self._usage.pop(trace_id, None) or ({'prompt': 0, 'completion': 0}, now)
+                usage['prompt'] += prompt_tokens
+                usage['completion'] += completion_tokens or 0
+                # Reinserted so the entries stay ordered by last update
+                self._usage[trace_id] = (usage, now)
+
+    def pop_usage(self, trace_id: str) -> dict:
+        with self._lock:
+            # A request ending after this point belongs to a message already accounted for
+            for run_id in [run_id for run_id, trace in list(self._traces.items()) if trace == trace_id]:
+                del self._traces[run_id]
+            usage, _ = self._usage.pop(trace_id, None) or ({'prompt': 0, 'completion': 0}, None)
+            return usage
+
+    def _expire(self, now: float):
+        while self._usage:
+            trace_id, (_, updated) = next(iter(self._usage.items()))
+            if now - updated < self.usage_ttl:
+                break
+            del self._usage[trace_id]
+
+    def _observe(self, run_id, status: str):
+        started = self._starts.pop(run_id, None)
+        if started is not None:
+            task, start = started
+            ANALYSIS_SECONDS.observe(time.perf_counter() - start, task=task, status=status)
+
+    def _task(self, tags) -> str:
+        return next((tag for tag in tags or () if tag in self.tasks), None)
+
+
+def create_app(registry: Registry = REGISTRY) -> FastAPI:
+    """
+    Creates the FastAPI application serving the metrics of `registry` on GET /metrics.
+    """
+    app = FastAPI(title='news-analyzer metrics')
+
+    @app.get('/metrics', response_class=PlainTextResponse)
+    def metrics():
+        return PlainTextResponse(registry.render(), media_type='text/plain; version=0.0.4; charset=utf-8')
+
+    return app
+
+
+def start_server(host: str, port: int) -> uvicorn.Server:
+    """
+    Serves /metrics on `host`:`port` in a daemon thread, next to the event loop of the workers.
+
+    Returns:
+        uvicorn.Server: The server; set its `should_exit` attribute to stop it.
+    """
+    server = uvicorn.Server(uvicorn.Config(create_app(), host=host, port=port, log_level='warning'))
+    threading.Thread(target=server.run, name='metrics', daemon=True).start()
+    log('metrics_server', url=f'http://{host}:{port}/metrics')
+    return server
@@ -1,6 +1,6 @@
 from turtle import title
 from typing import List, Dict
-from pydantic import BaseModel, Field
+from pydantic import BaseModel, Field, create_model
 
 class SeoScore(BaseModel):
     """
@@ -84,6 +84,42 @@ class GrammarErrors(BaseModel):
     """
     grammar_errors: List[GrammarError] = Field(description="List of errors")
 
+class CombinedAnalysis(NewsInfo):
+    """
+    CombinedAnalysis model representing the result of the news analysis, the segmentation and the grammar check
+    produced by a single request.
+
+    Attributes:
+        summary (str): A brief summary of the news article.
+        title (str): The title of the news article.
+        keywords (List[str]): A list of keywords associated with the news article.
+        tags (List[str]): A list of tags categorizing the news article.
+        spelling (Dict[str, str]): A dictionary containing spelling corrections or mappings.
+        personage (List[str]): A list of notable persons mentioned in the news article.
+        segments (List[NewsSegment]): List of news segments.
+        grammar_errors (List[GrammarError]): A list of grammar errors.
+    """
+    segments: List[NewsSegment] = Field(description="list of segments")
+    grammar_errors: List[GrammarError] = Field(description="List of errors")
+
+# The model of the answer of every sub-analysis
+TASK_MODELS = {
+    'analyze': NewsInfo,
+    'segment': NewsSegments,
+    'grammar': GrammarErrors
+}
+
+def combined_model(tasks) -> type:
+    """
+    Returns the model of the answer of a combined request covering `tasks`: CombinedAnalysis for every
+    sub-analysis, or a model with the fields of the requested ones only.
+    """
+    tasks = tuple(tasks)
+    if set(tasks) == set(TASK_MODELS):
+        return CombinedAnalysis
+    # The fields of the last base come first
+    return create_model('CombinedAnalysis', __base__=tuple(TASK_MODELS[task] for task in reversed(tasks)))
+
 class InputText(BaseModel):
     """
     InputText is a Pydantic model that represents the input text data.
@@ -1,3 +1,5 @@
+import hashlib
+
 ANALYZE_PROMPT = """
 <input>{text}</input>
 ###TASK
@@ -62,3 +64,66 @@ Input text:
 
 {format_instructions}
 """
+
+
+
+COMBINED_PROMPT = """
+Act as a news analyzer. Read the input text and complete all of the following tasks in a single answer.
+{tasks}
+- Language: Multilingual
+
+Input text:
+{{text}}
+
+{{format_instructions}}
+"""
+
+# The numbered items of every sub-analysis in COMBINED_PROMPT, which only lists the requested ones
+COMBINED_TASKS = {
+    'analyze': (
+        "Summary: You must summary base on the news content, write in semantic way",
+        "Title: The title that sum up the news content. Not exceed 50 characters",
+        "Keywords",
+        "Tags",
+        "Spelling: Check wrong pronunciation word and promote an alter word",
+        "Personage: Person name in the input text",
+    ),
+    'segment': (
+        "Segments: The input is a subtitle in .srt format; review, summarize, and segment it.\n"
+        "Where possible, merge shorter segments to create unified, complete ideas without losing meaning.\n"
+        "Summarize each segment succinctly, capturing key points and ideas in a clear and concise manner.",
+    ),
+    'grammar': (
+        "Grammar errors: Identify grammar and spelling errors. Only indentify errors for single words not multiple "
+        "words.",
+    ),
+}
+
+
+def combined_prompt(tasks) -> str:
+    """
+    Returns the template of the combined request covering `tasks`, with a `text` and a `format_instructions`
+    input variable.
+    """
+    items = [item for task in tasks for item in COMBINED_TASKS[task]]
+    return COMBINED_PROMPT.format(tasks='\n'.join(f'{number}. {item}' for number, item in enumerate(items, 1)))
+
+
+REPAIR_PROMPT = """
+Your previous answer was expected to be a single JSON object but it could not be parsed.
+
+Error:
+{error}
+
+Previous answer:
+{answer}
+
+Rewrite the previous answer as valid JSON with the same content. Return the JSON object only.
+{format_instructions}
+"""
+
+# Changes whenever a prompt is edited, so cached results of older prompts are not reused
+PROMPT_VERSION = hashlib.sha256(
+    ''.join([ANALYZE_PROMPT, SEO_PROMPT, SEGMENTATION_PROMPT, GRAMMAR_CHECK_PROMPT, COMBINED_PROMPT,
+             *(item for items in COMBINED_TASKS.values() for item in items)]).encode('utf-8')
+).hexdigest()[:12]
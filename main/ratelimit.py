@@ -0,0 +1,340 @@
+"""
+This module provides the client-side limits of the requests sent to the language model.
+
+Every language model request of the process goes through one LlmLimiter, whatever the pipeline, thread or event
+loop sending it. Before a request is sent, the limiter waits for a request of the requests-per-second bucket, for
+the estimated tokens of the request in the tokens-per-minute bucket, and for a slot of the adaptive concurrency
+limit.
+
+The concurrency limit follows AIMD, additive increase and multiplicative decrease. It starts at its minimum and
+doubles every round trip until the first backoff, like TCP slow start, then grows by one slot per round trip
+while the responses are healthy. It is cut by `backoff` when the server answers 429 or 5xx, when a request fails,
+or when the smoothed latency rises above `latency_tolerance` times its baseline, at most once per round trip. The
+baseline is a slower moving average of the latency, so it follows a lasting change of the workload, e.g. longer
+prompts, while a sudden slowdown of the server backs off.
+
+The limiter sits in the HTTP transport of the OpenAI client, so it sees every attempt, including the retries of
+the client, with their status code. A request holds its slot until its response is read to the end, streamed
+responses included.
+
+Classes:
+    TokenBucket: Thread-safe token bucket handing out reservations.
+    AdaptiveConcurrency: AIMD concurrency limit shared by threads and event loops.
+    LlmLimiter: Rate and concurrency limits of the language model requests.
+    LimitedTransport: httpx transport sending the requests of a synchronous client through a limiter.
+    AsyncLimitedTransport: httpx transport sending the requests of an asynchronous client through a limiter.
+
+Functions:
+    estimate_request_tokens: Estimates the tokens a chat completion request consumes.
+"""
+import json
+import time
+import asyncio
+import threading
+
+import httpx
+
+from metrics import LLM_CONCURRENCY, LLM_REQUESTS
+from tracing import log
+
+# Statuses telling that the server is overloaded
+THROTTLING_STATUSES = (429, 500, 502, 503, 504)
+
+
+class TokenBucket:
+    """
+    Thread-safe token bucket. A reservation takes its tokens at once, going into debt if needed, and tells how
+    long the caller waits before using them, so waiting callers are served in order without a queue.
+
+    Attributes:
+        rate (float): Tokens added per second; 0 disables the bucket.
+        capacity (float): Maximum number of tokens, i.e. the largest burst.
+    """
+    def __init__(self, rate: float, capacity: float = None):
+        self.rate = rate
+        self.capacity = capacity if capacity is not None else max(rate, 1.0)
+        self._tokens = self.capacity
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def reserve(self, amount: float = 1) -> float:
+        """
+        Takes `amount` tokens and returns the number of seconds to wait before using them.
+        """
+        if not self.rate:
+            return 0.0
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate) - amount
+            self._updated = now
+            return max(-self._tokens / self.rate, 0.0)
+
+
+class AdaptiveConcurrency:
+    """
+    AIMD limit of the concurrent requests, shared by threads and event loops.
+
+    Attributes:
+        minimum (int): The lowest limit.
+        maximum (int): The highest limit.
+        backoff (float): Factor applied to the limit on a backoff.
+        latency_tolerance (float): Ratio of the smoothed latency to its baseline above which the limit backs off;
+            0 only backs off on errors.
+        smoothing (float): Weight of a new latency in the smoothed latency; the baseline uses a tenth of it.
+        limit (float): The current limit; `int(limit)` requests run concurrently.
+        in_flight (int): The number of running requests.
+
+    Methods:
+        acquire():
+            Waits for a slot in the calling thread.
+        aacquire():
+            Waits for a slot without blocking the event loop.
+        release(latency=None, error=False):
+            Frees a slot and adapts the limit to the outcome of its request.
+    """
+    def __init__(self, minimum: int = 1, maximum: int = 32, backoff: float = 0.5, latency_tolerance: float = 2.0,
+                 smoothing: float = 0.2):
+        self.minimum = max(minimum, 1)
+        self.maximum = max(maximum, self.minimum)
+        self.backoff = backoff
+        self.latency_tolerance = latency_tolerance
+        self.smoothing = smoothing
+        self.limit = float(self.minimum)
+        self.in_flight = 0
+        self._slow_start = True
+        self._latency = None
+        self._baseline = None
+        self._last_backoff = 0.0
+        self._condition = threading.Condition()
+        # (loop, future) of the coroutines waiting for a slot
+        self._waiters = []
+        self._report()
+
+    def acquire(self):
+        with self._condition:
+            while self.in_flight >= int(self.limit):
+                self._condition.wait()
+            self.in_flight += 1
+            self._report()
+
+    async def aacquire(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            with self._condition:
+                if self.in_flight < int(self.limit):
+                    self.in_flight += 1
+                    self._report()
+                    return
+                future = loop.create_future()
+                self._waiters.append((loop, future))
+            await future
+
+    def release(self, latency: float = None, error: bool = False):
+        """
+        Frees a slot. An error backs off; a latency grows the limit, or backs off if the latency is rising.
+        Without latency nor error, e.g. for a cancelled request, the limit is left unchanged.
+        """
+        with self._condition:
+            self.in_flight -= 1
+            if error:
+                self._back_off('error')
+            elif latency is not None:
+                self._observe(latency)
+            waiters, self._waiters = self._waiters, []
+            self._condition.notify_all()
+            self._report()
+        # The woken coroutines check the limit again and wait anew if it is still reached
+        for loop, future in waiters:
+            loop.call_soon_threadsafe(_wake, future)
+
+    def _observe(self, latency: float):
+        if self._latency is None:
+            self._latency = self._baseline = latency
+        else:
+            self._latency += self.smoothing * (latency - self._latency)
+            self._baseline += self.smoothing / 10 * (latency - self._baseline)
+
+        if self.latency_tolerance and self._latency > self.latency_tolerance * self._baseline:
+            self._back_off('latency')
+        elif self._slow_start:
+            self.limit = min(self.limit + 1, self.maximum)
+        else:
+            self.limit = min(self.limit + 1 / self.limit, self.maximum)
+
+    def _back_off(self, reason: str):
+        # The responses of the requests sent before a backoff reflect the previous limit
+        now = time.monotonic()
+        if self.limit <= self.minimum or now - self._last_backoff < (self._latency or 0.0):
+            return
+        self._last_backoff = now
+        self._slow_start = False
+        self.limit = max(self.limit * self.backoff, self.minimum)
+        log('llm_backoff', level='warning', reason=reason, limit=int(self.limit), in_flight=self.in_flight)
+
+    def _report(self):
+        LLM_CONCURRENCY.set(int(self.limit), kind='limit')
+        LLM_CONCURRENCY.set(self.in_flight, kind='in_flight')
+
+
+def _wake(future):
+    if not future.done():
+        future.set_result(None)
+
+
+class LlmLimiter:
+    """
+    Rate and concurrency limits of the language model requests, shared by every client of the process.
+
+    Attributes:
+        requests (TokenBucket): The requests per second; unlimited when 0.
+        tokens (TokenBucket): The tokens per minute; unlimited when 0.
+        concurrency (AdaptiveConcurrency): The limit of concurrent requests.
+
+    Methods:
+        acquire(tokens: int):
+            Waits in the calling thread until a request of `tokens` tokens may be sent.
+        aacquire(tokens: int):
+            Waits without blocking the event loop until a request of `tokens` tokens may be sent.
+        release(status: int = None, latency: float = None, cancelled: bool = False):
+            Records the outcome of a request and frees its slot.
+    """
+    def __init__(self, requests_per_second: float = 0, tokens_per_minute: int = 0, min_concurrency: int = 1,
+                 max_concurrency: int = 32, latency_tolerance: float = 2.0):
+        self.requests = TokenBucket(requests_per_second)
+        self.tokens = TokenBucket(tokens_per_minute / 60, capacity=tokens_per_minute)
+        self.concurrency = AdaptiveConcurrency(min_concurrency, max_concurrency, latency_tolerance=latency_tolerance)
+
+    def acquire(self, tokens: int):
+        time.sleep(max(self.requests.reserve(1), self.tokens.reserve(tokens)))
+        self.concurrency.acquire()
+
+    async def aacquire(self, tokens: int):
+        await asyncio.sleep(max(self.requests.reserve(1), self.tokens.reserve(tokens)))
+        await self.concurrency.aacquire()
+
+    def release(self, status: int = None, latency: float = None, cancelled: bool = False):
+        """
+        Records the outcome of a request: its HTTP status, None if it failed without response, and its latency.
+        """
+        if cancelled:
+            self.concurrency.release()
+            return
+        error = status is None or status in THROTTLING_STATUSES
+        LLM_REQUESTS.inc(status='failed' if status is None else 'throttled' if error else 'ok')
+        self.concurrency.release(latency, error)
+
+
+def estimate_request_tokens(request: httpx.Request) -> int:
+    """
+    Estimates the tokens consumed by a chat completion request: four characters per token of the request body,
+    plus its `max_tokens` when set.
+    """
+    content = request.content
+    try:
+        max_tokens = json.loads(content).get('max_tokens') or 0
+    except (ValueError, AttributeError):
+        max_tokens = 0
+    return len(content) // 4 + max_tokens
+
+
+class _ReleasingStream(httpx.SyncByteStream):
+    def __init__(self, stream, on_close):
+        self.stream = stream
+        self.on_close = on_close
+
+    def __iter__(self):
+        yield from self.stream
+
+    def close(self):
+        try:
+            self.stream.close()
+        finally:
+            on_close, self.on_close = self.on_close, None
+            if on_close is not None:
+                on_close()
+
+
+class _AsyncReleasingStream(httpx.AsyncByteStream):
+    def __init__(self, stream, on_close):
+        self.stream = stream
+        self.on_close = on_close
+
+    async def __aiter__(self):
+        async for chunk in self.stream:
+            yield chunk
+
+    async def aclose(self):
+        try:
+            await self.stream.aclose()
+        finally:
+            on_close, self.on_close = self.on_close, None
+            if on_close is not None:
+                on_close()
+
+
+class LimitedTransport(httpx.BaseTransport):
+    """
+    httpx transport sending every request through `limiter`, for the synchronous OpenAI client.
+
+    Attributes:
+        limiter (LlmLimiter): The shared limiter.
+        transport (httpx.BaseTransport): The transport sending the requests.
+    """
+    def __init__(self, limiter: LlmLimiter, transport: httpx.BaseTransport = None):
+        self.limiter = limiter
+        self.transport = transport or httpx.HTTPTransport()
+
+    def handle_request(self, request: httpx.Request) -> httpx.Response:
+        self.limiter.acquire(estimate_request_tokens(request))
+        start = time.perf_counter()
+        try:
+            response = self.transport.handle_request(request)
+        except Exception:
+            self.limiter.release(None, time.perf_counter() - start)
+            raise
+        except BaseException:
+            self.limiter.release(cancelled=True)
+            raise
+
+        def release():
+            self.limiter.release(response.status_code, time.perf_counter() - start)
+
+        return httpx.Response(response.status_code, headers=response.headers, extensions=response.extensions,
+                              stream=_ReleasingStream(response.stream, release))
+
+    def close(self):
+        self.transport.close()
+
+
+class AsyncLimitedTransport(httpx.AsyncBaseTransport):
+    """
+    httpx transport sending every request through `limiter`, for the asynchronous OpenAI client.
+
+    Attributes:
+        limiter (LlmLimiter): The shared limiter.
+        transport (httpx.AsyncBaseTransport): The transport sending the requests.
+    """
+    def __init__(self, limiter: LlmLimiter, transport: httpx.AsyncBaseTransport = None):
+        self.limiter = limiter
+        self.transport = transport or httpx.AsyncHTTPTransport()
+
+    async def handle_async_request(self, request: httpx.Request) -> httpx.Response:
+        await self.limiter.aacquire(estimate_request_tokens(request))
+        start = time.perf_counter()
+        try:
+            response = await self.transport.handle_async_request(request)
+        except Exception:
+            self.limiter.release(None, time.perf_counter() - start)
+            raise
+        except BaseException:
+            self.limiter.release(cancelled=True)
+            raise
+
+        def release():
+            self.limiter.release(response.status_code, time.perf_counter() - start)
+
+        return httpx.Response(response.status_code, headers=response.headers, extensions=response.extensions,
+                              stream=_AsyncReleasingStream(response.stream, release))
+
+    async def aclose(self):
+        await self.transport.aclose()
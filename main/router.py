@@ -0,0 +1,357 @@
+"""
+This module provides the routing of the language model requests over several OpenAI-compatible endpoints.
+
+An LlmRouter holds the replicas serving the language model and sends every request to the best available one:
+the endpoint with the fewest outstanding requests, or with the lowest expected latency, i.e. its smoothed latency
+times its outstanding requests plus one. Every task may use its own model, e.g. a smaller model for the grammar
+check, on the same endpoints.
+
+Each endpoint has a circuit breaker. After `failure_threshold` consecutive failures, i.e. connection errors,
+timeouts, 429 or 5xx responses, the circuit opens and the endpoint stops receiving requests for `cooldown`
+seconds. Then a single trial request is let through: its success closes the circuit, its failure opens it again.
+Endpoints failing their periodic health check are skipped as well. When no endpoint is available the requests go
+to the remaining ones anyway, so a single replica deployment degrades to retrying instead of failing every message.
+
+A failed request is retried on another endpoint, up to `max_attempts` attempts. A streamed request is only
+retried until its first chunk arrived.
+
+The router plugs into AnalysisPipeline through RoutedChatModel, a Runnable standing for the chat model of one
+task in the prompt | model | parser chains.
+
+Classes:
+    Endpoint: State of one endpoint: outstanding requests, latency, health and circuit breaker.
+    LlmRouter: Routes the requests of every task to the best available endpoint.
+    RoutedChatModel: Chat model of one task, sending its requests through an LlmRouter.
+"""
+import time
+import random
+import asyncio
+import threading
+from typing import Any, AsyncIterator, Optional
+
+import httpx
+import openai
+from langchain_openai import ChatOpenAI
+from langchain_core.runnables import Runnable, RunnableConfig
+from langchain_core.language_models import LanguageModelInput
+from langchain_core.messages import BaseMessage
+
+from ratelimit import LimitedTransport, AsyncLimitedTransport
+from tracing import log
+
+BALANCING = ('least_outstanding', 'latency')
+
+# Errors caused by the endpoint rather than by the request; APIConnectionError covers the timeouts
+FAILOVER_ERRORS = (openai.APIConnectionError, openai.RateLimitError, openai.InternalServerError)
+
+
+class Endpoint:
+    """
+    State of one OpenAI-compatible endpoint.
+
+    Attributes:
+        url (str): The base URL of the API, e.g. http://llm-0:8000/v1.
+        outstanding (int): The number of requests being served.
+        latency (float): The smoothed latency of its successful requests, None before the first one.
+        failures (int): The number of consecutive failures.
+        opened_at (float): The monotonic time the circuit opened, None while it is closed.
+        trial (bool): Whether the trial request of a half-open circuit is running.
+        healthy (bool): The outcome of the last health check.
+    """
+    def __init__(self, url: str):
+        self.url = url.rstrip('/')
+        self.outstanding = 0
+        self.latency = None
+        self.failures = 0
+        self.opened_at = None
+        self.trial = False
+        self.healthy = True
+
+    def available(self, now: float, cooldown: float) -> bool:
+        if not self.healthy:
+            return False
+        if self.opened_at is None:
+            return True
+        return now - self.opened_at >= cooldown and not self.trial
+
+
+class LlmRouter:
+    """
+    Routes the language model requests of every task to the best available endpoint.
+
+    Attributes:
+        endpoints (list): The Endpoint of every URL.
+        model (str): The default model.
+        task_models (dict): The model of a task when it differs from `model`, e.g. {'grammar': 'small-model'}.
+        balancing (str): 'least_outstanding' or 'latency'.
+        failure_threshold (int): Consecutive failures opening the circuit of an endpoint.
+        cooldown (float): Seconds an open circuit rejects requests before letting a trial request through.
+        max_attempts (int): Attempts of a request over the endpoints, at least one per endpoint.
+        limiter (LlmLimiter): Optional rate and concurrency limiter shared by every endpoint.
+        timeout (float): Seconds allowed for a request; None waits indefinitely.
+
+    Methods:
+        model_for(task: str) -> str:
+            Returns the model of `task`.
+        for_task(task: str) -> RoutedChatModel:
+            Returns the chat model of `task` to use in a chain.
+        call(task, send):
+            Calls `send` with the chat model of the best endpoint, failing over to the others.
+        acall(task, send):
+            Asynchronous counterpart of `call`.
+        astream(task, send) -> AsyncIterator:
+            Streams the chunks of `send` from the best endpoint, failing over until the first chunk.
+        check_health():
+            Probes the /models path of every endpoint.
+        monitor(interval: float):
+            Checks the health of the endpoints every `interval` seconds until cancelled.
+    """
+    def __init__(
+        self,
+        endpoints: list,
+        model: str,
+        task_models: dict = None,
+        api_key: str = '...',
+        balancing: str = 'least_outstanding',
+        failure_threshold: int = 5,
+        cooldown: float = 30.0,
+        max_attempts: int = 3,
+        limiter=None,
+        timeout: float = None
+    ):
+        if not endpoints:
+            raise ValueError('at least one endpoint is required')
+        if balancing not in BALANCING:
+            raise ValueError(f'unknown balancing: {balancing}')
+        self.endpoints = [Endpoint(url) for url in endpoints]
+        self.model = model
+        self.task_models = dict(task_models or {})
+        self.api_key = api_key
+        self.balancing = balancing
+        self.failure_threshold = failure_threshold
+        self.cooldown = cooldown
+        self.max_attempts = max(max_attempts, len(self.endpoints))
+        self.limiter = limiter
+        self.timeout = timeout
+        self._chat_models = {}
+        self._lock = threading.Lock()
+
+    def model_for(self, task: str) -> str:
+        return self.task_models.get(task, self.model)
+
+    def for_task(self, task: str) -> 'RoutedChatModel':
+        return RoutedChatModel(self, task)
+
+    def call(self, task: str, send):
+        """
+        Calls `send(chat_model)` with the chat model of `task` on the best endpoint and returns its result,
+        retrying on another endpoint when it fails with one of FAILOVER_ERRORS.
+        """
+        tried = []
+        for attempt in range(self.max_attempts):
+            endpoint, trial = self._acquire(tried)
+            try:
+                time.sleep(self._backoff(attempt, endpoint, tried))
+                start = time.perf_counter()
+                result = send(self._chat_model(endpoint, task))
+            except FAILOVER_ERRORS as e:
+                self._release(endpoint, trial, error=True)
+                self._fail_over(task, endpoint, e, attempt)
+                tried.append(endpoint)
+                continue
+            except BaseException:
+                self._release(endpoint, trial)
+                raise
+            self._release(endpoint, trial, time.perf_counter() - start)
+            return result
+
+    async def acall(self, task: str, send):
+        """
+        Asynchronous counterpart of `call`; `send` returns an awaitable.
+        """
+        tried = []
+        for attempt in range(self.max_attempts):
+            endpoint, trial = self._acquire(tried)
+            try:
+                await asyncio.sleep(self._backoff(attempt, endpoint, tried))
+                start = time.perf_counter()
+                result = await send(self._chat_model(endpoint, task))
+            except FAILOVER_ERRORS as e:
+                self._release(endpoint, trial, error=True)
+                self._fail_over(task, endpoint, e, attempt)
+                tried.append(endpoint)
+                continue
+            except BaseException:
+                self._release(endpoint, trial)
+                raise
+            self._release(endpoint, trial, time.perf_counter() - start)
+            return result
+
+    async def astream(self, task: str, send) -> AsyncIterator:
+        """
+        Yields the chunks of `send(chat_model)`, an async iterator, from the best endpoint. A request failing
+        before its first chunk is retried on another endpoint; a failure in the middle of the stream is raised.
+        """
+        tried = []
+        for attempt in range(self.max_attempts):
+            endpoint, trial = self._acquire(tried)
+            try:
+                await asyncio.sleep(self._backoff(attempt, endpoint, tried))
+                start = time.perf_counter()
+                stream = send(self._chat_model(endpoint, task))
+                first = await stream.__anext__()
+            except StopAsyncIteration:
+                self._release(endpoint, trial, time.perf_counter() - start)
+                return
+            except FAILOVER_ERRORS as e:
+                self._release(endpoint, trial, error=True)
+                self._fail_over(task, endpoint, e, attempt)
+                tried.append(endpoint)
+                continue
+            except BaseException:
+                self._release(endpoint, trial)
+                raise
+
+            try:
+                yield first
+                async for chunk in stream:
+                    yield chunk
+            except FAILOVER_ERRORS:
+                self._release(endpoint, trial, error=True)
+                raise
+            except BaseException:
+                self._release(endpoint, trial)
+                raise
+            self._release(endpoint, trial, time.perf_counter() - start)
+            return
+
+    async def check_health(self):
+        """
+        Probes GET {url}/models on every endpoint and marks the endpoints answering with an error or not at all
+        as unhealthy, until their next successful check.
+        """
+        async with httpx.AsyncClient(timeout=5.0, headers={'Authorization': f'Bearer {self.api_key}'}) as client:
+            async def probe(endpoint):
+                try:
+                    healthy = (await client.get(f'{endpoint.url}/models')).status_code < 500
+                except httpx.HTTPError:
+                    healthy = False
+                if healthy != endpoint.healthy:
+                    log('llm_endpoint_health', level='info' if healthy else 'warning', endpoint=endpoint.url,
+                        healthy=healthy)
+                endpoint.healthy = healthy
+
+            await asyncio.gather(*(probe(endpoint) for endpoint in self.endpoints))
+
+    async def monitor(self, interval: float):
+        while True:
+            await self.check_health()
+            await asyncio.sleep(interval)
+
+    def _acquire(self, tried: list) -> tuple:
+        """
+        Picks the best available endpoint not tried yet and counts the request as outstanding on it.
+
+        Returns:
+            tuple: The endpoint, and whether the request is the trial request of its half-open circuit.
+        """
+        with self._lock:
+            now = time.monotonic()
+            fresh = [endpoint for endpoint in self.endpoints if endpoint not in tried] or self.endpoints
+            candidates = [endpoint for endpoint in fresh if endpoint.available(now, self.cooldown)] or fresh
+            endpoint = min(candidates, key=lambda endpoint: (self._score(endpoint), random.random()))
+            trial = endpoint.opened_at is not None and endpoint.available(now, self.cooldown)
+            if trial:
+                endpoint.trial = True
+            endpoint.outstanding += 1
+            return endpoint, trial
+
+    def _release(self, endpoint: Endpoint, trial: bool, latency: float = None, error: bool = False):
+        """
+        Counts the request as done on `endpoint` and updates its circuit: an error counts as a failure, a
+        latency as a success, and neither, e.g. for a rejected or cancelled request, leaves it as it is. The
+        trial request of a half-open circuit lets the next one through once it is done.
+        """
+        with self._lock:
+            endpoint.outstanding -= 1
+            if trial:
+                endpoint.trial = False
+            if error:
+                endpoint.failures += 1
+                if endpoint.opened_at is not None or endpoint.failures >= self.failure_threshold:
+                    if endpoint.opened_at is None:
+                        log('llm_circuit_open', level='warning', endpoint=endpoint.url, failures=endpoint.failures)
+                    endpoint.opened_at = time.monotonic()
+            elif latency is not None:
+                endpoint.latency = latency if endpoint.latency is None else endpoint.latency + 0.2 * (
+                    latency - endpoint.latency)
+                if endpoint.opened_at is not None:
+                    log('llm_circuit_closed', endpoint=endpoint.url)
+                endpoint.failures, endpoint.opened_at = 0, None
+
+    def _score(self, endpoint: Endpoint) -> float:
+        if self.balancing == 'latency':
+            # Endpoints without latency yet are tried first
+            return (endpoint.outstanding + 1) * (endpoint.latency or 0.0)
+        return endpoint.outstanding
+
+    @staticmethod
+    def _backoff(attempt: int, endpoint: Endpoint, tried: list) -> float:
+        # Retrying an endpoint that already failed this request waits, like the retries of the OpenAI client
+        return min(0.5 * 2 ** attempt, 8.0) if endpoint in tried else 0.0
+
+    def _fail_over(self, task: str, endpoint: Endpoint, error: Exception, attempt: int):
+        if attempt + 1 >= self.max_attempts:
+            raise error
+        log('llm_failover', level='warning', task=task, endpoint=endpoint.url, attempt=attempt + 1, error=repr(error))
+
+    def _chat_model(self, endpoint: Endpoint, task: str) -> ChatOpenAI:
+        """
+        Returns the ChatOpenAI client of the model of `task` on `endpoint`, created on first use. The router
+        retries on the other endpoints, so the client itself does not retry.
+        """
+        model = self.model_for(task)
+        key = (endpoint.url, model)
+        with self._lock:
+            chat_model = self._chat_models.get(key)
+            if chat_model is None:
+                chat_model = self._chat_models[key] = ChatOpenAI(
+                    model=model,
+                    temperature=0,
+                    max_tokens=None,
+                    timeout=self.timeout,
+                    max_retries=0,
+                    api_key=self.api_key,
+                    base_url=endpoint.url,
+                    http_client=httpx.Client(transport=LimitedTransport(self.limiter)) if self.limiter else None,
+                    http_async_client=(httpx.AsyncClient(transport=AsyncLimitedTransport(self.limiter))
+                                       if self.limiter else None)
+                )
+        return chat_model
+
+
+class RoutedChatModel(Runnable[LanguageModelInput, BaseMessage]):
+    """
+    Chat model of one task, sending every request through an LlmRouter. It takes the place of ChatOpenAI in a
+    chain: batches run one routed request per input, and streams yield the chunks of the chosen endpoint.
+
+    Attributes:
+        router (LlmRouter): The router.
+        task (str): The task, selecting the model.
+    """
+    def __init__(self, router: LlmRouter, task: str):
+        self.router = router
+        self.task = task
+
+    def invoke(self, input: LanguageModelInput, config: Optional[RunnableConfig] = None, **kwargs: Any) -> BaseMessage:
+        return self.router.call(self.task, lambda chat_model: chat_model.invoke(input, config, **kwargs))
+
+    async def ainvoke(self, input: LanguageModelInput, config: Optional[RunnableConfig] = None,
+                      **kwargs: Any) -> BaseMessage:
+        return await self.router.acall(self.task, lambda chat_model: chat_model.ainvoke(input, config, **kwargs))
+
+    async def astream(self, input: LanguageModelInput, config: Optional[RunnableConfig] = None,
+                      **kwargs: Any) -> AsyncIterator[BaseMessage]:
+        async for chunk in self.router.astream(self.task,
+                                               lambda chat_model: chat_model.astream(input, config, **kwargs)):
+            yield chunk
@@ -0,0 +1,358 @@
+"""
+This module provides the asyncio runtime that drives the Kafka consumers.
+
+A single event loop serves the topics of a process. Each topic gets its own processing pool: a poll loop feeds
+consumed records into a bounded queue and a fixed number of workers process them concurrently, so a slow
+transcription or language model call only occupies one worker of its topic instead of stalling it. When the
+queue is full the assigned partitions are paused, which stops fetching without leaving the consumer group.
+
+Offsets are committed in order. A record only counts as done once its handler returned, i.e. once its result
+has been produced, and the committed offset of a partition never moves past a record that is still being
+processed. A record whose handler raised is never marked done either: its partition is paused and rewound to it,
+and it is consumed again after a backoff doubling on every consecutive failure, followed by the records after
+it, while the other partitions keep flowing. A handler commits a failure by handling it itself, e.g. by
+returning 'dead_lettered' once the record was delivered to a dead-letter topic.
+
+When the consumer group rebalances, the partitions taken away from this consumer are handed off gracefully:
+queued records of these partitions are dropped, the records being processed are given a bounded time to finish,
+and the watermark is committed before the partitions are reassigned, so the new owner resumes right after the
+last processed record.
+
+Classes:
+    OffsetTracker: Tracks processed offsets per partition and computes the commit watermark.
+    RebalanceListener: Hands off revoked partitions of a TopicPool.
+    TopicPool: Bounded worker pool of one topic with backpressure and ordered offset commits.
+"""
+import time
+import asyncio
+from collections import deque
+
+from kafka import ConsumerRebalanceListener
+from kafka.structs import OffsetAndMetadata
+
+from metrics import MESSAGES, QUEUE_DEPTH, CONSUMER_LAG
+from tracing import log
+
+# Longest wait before a failed record is consumed again
+MAX_REDELIVERY_BACKOFF = 60.0
+
+
+class OffsetTracker:
+    """
+    Tracks the offsets of consumed records per partition and computes the commit watermark.
+
+    Records of a partition are registered in consumption order with `add` and may complete in any order
+    with `done`. The watermark of a partition is the offset following the longest prefix of completed records.
+    A registration is identified by the token returned by `add`, so a record consumed again after a rewind or a
+    rebalance is told apart from the earlier copy still being processed.
+
+    Methods:
+        add(tp, offset) -> object:
+            Registers a consumed record and returns its token.
+        registered(tp, offset, token) -> bool:
+            Tells whether `token` is the current registration of the record.
+        done(tp, offset):
+            Marks a registered record as processed.
+        rewind(tp, offset):
+            Forgets the records of the partition from `offset` on, which are consumed again.
+        watermarks() -> dict:
+            Returns the partitions whose watermark advanced since the last call, with their new watermark.
+        release(tps) -> dict:
+            Returns the advanced watermarks like `watermarks`, then forgets the given partitions.
+        pending() -> int:
+            Returns the number of registered records that are not processed yet.
+    """
+    def __init__(self):
+        self._offsets = {}
+        self._tokens = {}
+        self._done = {}
+        self._committed = {}
+
+    def add(self, tp, offset: int) -> object:
+        token = object()
+        self._offsets.setdefault(tp, deque()).append(offset)
+        self._tokens.setdefault(tp, {})[offset] = token
+        return token
+
+    def registered(self, tp, offset: int, token) -> bool:
+        return self._tokens.get(tp, {}).get(offset) is token
+
+    def done(self, tp, offset: int):
+        self._done.setdefault(tp, set()).add(offset)
+
+    def rewind(self, tp, offset: int):
+        offsets, tokens, done = self._offsets.get(tp, ()), self._tokens.get(tp, {}), self._done.get(tp, set())
+        while offsets and offsets[-1] >= offset:
+            forgotten = offsets.pop()
+            tokens.pop(forgotten, None)
+            done.discard(forgotten)
+
+    def watermarks(self) -> dict:
+        advanced = {}
+        for tp, offsets in self._offsets.items():
+            done = self._done.get(tp, set())
+            last = None
+            while offsets and offsets[0] in done:
+                last = offsets.popleft()
+                done.discard(last)
+                self._tokens[tp].pop(last, None)
+            if last is not None and self._committed.get(tp) != last + 1:
+                self._committed[tp] = last + 1
+                advanced[tp] = last + 1
+        return advanced
+
+    def release(self, tps) -> dict:
+        advanced = self.watermarks()
+        for tp in tps:
+            self._offsets.pop(tp, None)
+            self._tokens.pop(tp, None)
+            self._done.pop(tp, None)
+            self._committed.pop(tp, None)
+        return advanced
+
+    def pending(self) -> int:
+        return sum(len(offsets) for offsets in self._offsets.values())
+
+
+class RebalanceListener(ConsumerRebalanceListener):
+    """
+    Hands off the partitions revoked from a TopicPool during a consumer group rebalance.
+
+    The listener is called by the consumer from within `poll`, which the pool runs in an executor thread, so
+    it can wait for the event loop to drain the revoked partitions and then commit on the consumer directly.
+
+    Attributes:
+        pool (TopicPool): The pool owning the consumer.
+    """
+    def __init__(self, pool):
+        self.pool = pool
+
+    def on_partitions_revoked(self, revoked):
+        if not revoked or self.pool.loop is None:
+            return
+        future = asyncio.run_coroutine_threadsafe(self.pool.release(revoked), self.pool.loop)
+        offsets = future.result()
+        if offsets:
+            try:
+                self.pool.consumer.commit(offsets={
+                    tp: OffsetAndMetadata(offset, None) for tp, offset in offsets.items()
+                })
+            except Exception as e:
+                log('commit_failed', level='error', error=repr(e))
+        log('partitions_revoked', partitions=sorted(str(tp) for tp in revoked))
+
+    def on_partitions_assigned(self, assigned):
+        log('partitions_assigned', partitions=sorted(str(tp) for tp in assigned))
+
+
+class TopicPool:
+    """
+    Bounded processing pool of a single topic.
+
+    Attributes:
+        consumer_factory (Callable[[ConsumerRebalanceListener], KafkaConsumer]): Creates the Kafka consumer of
+            the topic, subscribed with the given listener. The consumer must use enable_auto_commit=False.
+        handler (Callable[[ConsumerRecord], Awaitable[Optional[Union[bool, str]]]]): Coroutine function processing
+            a single record. It must only return once the result of the record has been produced, and returns
+            False when it skipped the record without producing a result, or the status counted in MESSAGES for
+            another outcome, e.g. 'dead_lettered'. A record whose handler raised stays uncommitted and is
+            consumed again.
+        concurrency (int): Number of records processed concurrently.
+        queue_size (int): Maximum number of consumed records waiting for or under processing.
+            Partition fetching is paused while this limit is reached.
+        poll_timeout_ms (int): Maximum time to wait in a single poll when the topic is idle. A poll returns as soon
+            as records are fetched, so this only bounds how often paused partitions and commits are checked.
+        commit_interval (float): Minimum number of seconds between two offset commits.
+        handoff_timeout (float): Maximum number of seconds a rebalance waits for the records of the revoked
+            partitions to finish. Records still running afterwards may be processed again by the new owner.
+        redelivery_backoff (float): Seconds before a failed record is consumed again, doubled on every
+            consecutive failure of its partition up to MAX_REDELIVERY_BACKOFF.
+        name (str): The topic label of the metrics of the pool.
+
+    Methods:
+        run():
+            Creates the consumer and runs the poll loop and the workers until cancelled, then commits the
+            final watermark and closes the consumer.
+        release(revoked) -> dict:
+            Drains the revoked partitions and returns the offsets to commit.
+    """
+    def __init__(
+        self,
+        consumer_factory,
+        handler,
+        concurrency: int,
+        queue_size: int,
+        poll_timeout_ms: int = 1000,
+        commit_interval: float = 1.0,
+        handoff_timeout: float = 30.0,
+        redelivery_backoff: float = 1.0,
+        name: str = 'default'
+    ):
+        self.consumer_factory = consumer_factory
+        self.handler = handler
+        self.concurrency = concurrency
+        self.queue_size = max(queue_size, concurrency)
+        self.poll_timeout_ms = poll_timeout_ms
+        self.commit_interval = commit_interval
+        self.handoff_timeout = handoff_timeout
+        self.redelivery_backoff = redelivery_backoff
+        self.name = name
+
+        self.consumer = None
+        self.loop = None
+        self.tracker = OffsetTracker()
+        self.queue = asyncio.Queue()
+        self._last_commit = 0.0
+        self._active = {}
+        self._releasing = set()
+        # The partitions waiting to be rewound: (failed offset, loop time of the redelivery)
+        self._redeliveries = {}
+        # The last failed offset of a partition and its number of consecutive failures
+        self._failures = {}
+
+    async def run(self):
+        self.loop = asyncio.get_running_loop()
+        self.consumer = self.consumer_factory(RebalanceListener(self))
+        workers = [asyncio.create_task(self._work()) for _ in range(self.concurrency)]
+        try:
+            await self._poll_loop()
+        finally:
+            for worker in workers:
+                worker.cancel()
+            await asyncio.gather(*workers, return_exceptions=True)
+            await self._commit(force=True)
+            await self.loop.run_in_executor(None, self.consumer.close)
+
+    async def release(self, revoked) -> dict:
+        revoked = set(revoked)
+        self._releasing |= revoked
+        for tp in revoked:
+            self._redeliveries.pop(tp, None)
+            self._failures.pop(tp, None)
+
+        deadline = self.loop.time() + self.handoff_timeout
+        while any(self._active.get(tp) for tp in revoked) and self.loop.time() < deadline:
+            await asyncio.sleep(0.05)
+
+        offsets = self.tracker.release(revoked)
+        self._releasing -= revoked
+        return offsets
+
+    async def _poll_loop(self):
+        """
+        Polls the consumer, applies backpressure and commits the watermark.
+
+        Every call on the consumer is issued from this loop, one at a time, because KafkaConsumer is not
+        thread-safe. Blocking calls run in the default executor so the workers keep running.
+        """
+        while True:
+            await self._commit()
+
+            now = self.loop.time()
+            for tp, (offset, due) in list(self._redeliveries.items()):
+                if due <= now:
+                    del self._redeliveries[tp]
+                    self.consumer.seek(tp, offset)
+
+            # Pausing on every iteration also covers the partitions assigned by a rebalance
+            free = self.queue_size - self.tracker.pending()
+            assignment = self.consumer.assignment()
+            paused = assignment if free <= 0 else assignment & set(self._redeliveries)
+            if paused - self.consumer.paused():
+                self.consumer.pause(*(paused - self.consumer.paused()))
+            if self.consumer.paused() - paused:
+                self.consumer.resume(*(self.consumer.paused() - paused))
+
+            # Paused partitions still need to be polled to stay in the consumer group
+            max_records = max(min(free, self.consumer.config['max_poll_records']), 1)
+            records = await self.loop.run_in_executor(
+                None, lambda: self.consumer.poll(timeout_ms=self.poll_timeout_ms, max_records=max_records)
+            )
+            for tp, messages in records.items():
+                # Records fetched after a failure of their partition are consumed again after the rewind
+                if tp in self._redeliveries:
+                    continue
+                for message in messages:
+                    self.queue.put_nowait((self.tracker.add(tp, message.offset), tp, message))
+                MESSAGES.inc(len(messages), topic=self.name, status='consumed')
+            self._report()
+
+    async def _work(self):
+        while True:
+            token, tp, message = await self.queue.get()
+            # Records of a revoked or rewound partition are dropped, they are consumed again
+            if tp in self._releasing or not self.tracker.registered(tp, message.offset, token):
+                self.queue.task_done()
+                continue
+
+            self._active[tp] = self._active.get(tp, 0) + 1
+            failed = False
+            try:
+                result = await self.handler(message)
+                status = result if isinstance(result, str) else 'skipped' if result is False else 'succeeded'
+                MESSAGES.inc(topic=self.name, status=status)
+            except Exception as e:
+                failed = True
+                MESSAGES.inc(topic=self.name, status='failed')
+                log('message_failed', level='error', topic=self.name, partition=tp.partition,
+                    offset=message.offset, error=repr(e))
+            finally:
+                self._active[tp] -= 1
+            # A cancelled record is left pending so its offset is not committed, and so is a record finishing
+            # after its partition was handed off or rewound
+            if self.tracker.registered(tp, message.offset, token):
+                if not failed:
+                    self.tracker.done(tp, message.offset)
+                    if self._failures.get(tp, (None,))[0] == message.offset:
+                        del self._failures[tp]
+                elif tp not in self._releasing:
+                    self._redeliver(tp, message.offset)
+            self.queue.task_done()
+
+    def _redeliver(self, tp, offset: int):
+        """
+        Rewinds the partition of a failed record to it. The partition is paused until its backoff elapsed, then
+        the poll loop seeks it back to the record.
+        """
+        failed_offset, failures = self._failures.get(tp, (None, 0))
+        failures = failures + 1 if failed_offset == offset else 1
+        self._failures[tp] = (offset, failures)
+        delay = min(self.redelivery_backoff * 2 ** (failures - 1), MAX_REDELIVERY_BACKOFF)
+
+        pending = self._redeliveries.get(tp)
+        self._redeliveries[tp] = (min(offset, pending[0]) if pending else offset, self.loop.time() + delay)
+        self.tracker.rewind(tp, self._redeliveries[tp][0])
+        log('message_redelivery', level='warning', topic=self.name, partition=tp.partition, offset=offset,
+            failures=failures, delay=delay)
+
+    def _report(self):
+        """
+        Reports the queue depth and the lag of the partitions whose end offset is known from a fetch.
+        """
+        QUEUE_DEPTH.set(self.tracker.pending(), topic=self.name)
+        for tp in self.consumer.assignment():
+            highwater = self.consumer.highwater(tp)
+            if highwater is not None:
+                lag = max(highwater - self.consumer.position(tp), 0)
+                CONSUMER_LAG.set(lag, topic=self.name, partition=tp.partition)
+
+    async def _commit(self, force: bool = False):
+        """
+        Commits the offsets of the partitions whose watermark advanced.
+
+        Args:
+            force (bool): Commit regardless of the time elapsed since the last commit.
+        """
+        now = time.monotonic()
+        if not force and now - self._last_commit < self.commit_interval:
+            return
+        self._last_commit = now
+
+        watermarks = self.tracker.watermarks()
+        if not watermarks:
+            return
+        offsets = {tp: OffsetAndMetadata(offset, None) for tp, offset in watermarks.items()}
+        try:
+            await self.loop.run_in_executor(None, lambda: self.consumer.commit(offsets=offsets))
+        except Exception as e:
+            log('commit_failed', level='error', topic=self.name, error=repr(e))
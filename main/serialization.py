@@ -0,0 +1,83 @@
+"""
+This module provides the JSON serializers of the consumed messages and the produced results.
+
+The results carry a full subtitle, so their serialization is on the hot path of every message. The serializer
+encodes to and decodes from bytes directly, without an intermediate str, and uses orjson or msgspec when one of
+them is installed, falling back to the standard library otherwise. Every backend produces compact UTF-8 JSON,
+which any JSON parser reads back to the same values.
+
+Classes:
+    Serializer: Encodes and decodes JSON with one backend.
+
+Functions:
+    available_backends: Returns the installed backends, fastest first.
+    create_serializer: Creates the serializer of the requested or the fastest available backend.
+"""
+import json
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import msgspec
+except ImportError:
+    msgspec = None
+
+BACKENDS = ('orjson', 'msgspec', 'json')
+
+
+class Serializer:
+    """
+    Encodes and decodes JSON with one backend.
+
+    Attributes:
+        name (str): The backend, 'orjson', 'msgspec' or 'json'.
+
+    Methods:
+        dumps(value) -> bytes:
+            Encodes `value` to UTF-8 JSON.
+        loads(data: bytes):
+            Decodes UTF-8 JSON bytes.
+        dumps_field(value) -> str:
+            Encodes a nested field that the result format carries as a JSON string.
+    """
+    def __init__(self, name: str):
+        self.name = name
+        if name == 'orjson':
+            self.dumps, self.loads = orjson.dumps, orjson.loads
+        elif name == 'msgspec':
+            self.dumps, self.loads = msgspec.json.Encoder().encode, msgspec.json.Decoder().decode
+        else:
+            self.dumps, self.loads = self._json_dumps, json.loads
+
+    def dumps_field(self, value) -> str:
+        return self.dumps(value).decode('utf-8')
+
+    @staticmethod
+    def _json_dumps(value) -> bytes:
+        return json.dumps(value, ensure_ascii=False, separators=(',', ':')).encode('utf-8')
+
+
+def available_backends() -> tuple:
+    """
+    Returns the installed backends, fastest first.
+    """
+    installed = {'orjson': orjson is not None, 'msgspec': msgspec is not None, 'json': True}
+    return tuple(name for name in BACKENDS if installed[name])
+
+
+def create_serializer(name: str = 'auto') -> Serializer:
+    """
+    Creates the serializer of the backend `name`, or of the fastest installed backend for 'auto'.
+
+    Raises:
+        ValueError: If the backend is unknown or not installed.
+    """
+    backends = available_backends()
+    if name == 'auto':
+        name = backends[0]
+    if name not in backends:
+        raise ValueError(f"JSON backend '{name}' is not installed")
+    return Serializer(name)
@@ -0,0 +1,134 @@
+"""
+This module provides the client of the speech-to-text (STT) service.
+
+All requests go through one pooled keep-alive HTTP client, so media files do not each pay for a new TCP/TLS
+connection. Requests have connect and read timeouts, are retried with jittered exponential backoff on 5xx
+responses and connection errors, and the number of concurrent requests toward the STT server is bounded.
+
+Classes:
+    SttError: Raised when the STT service keeps failing after the retries.
+    SttClient: Async client of the STT service.
+"""
+import random
+import asyncio
+import httpx
+
+from cache import make_key
+from tracing import log
+
+RETRYABLE_ERRORS = (httpx.NetworkError, httpx.ConnectTimeout, httpx.RemoteProtocolError)
+
+
+class SttError(Exception):
+    """
+    Raised when the STT service keeps failing after the retries.
+    """
+
+
+class SttClient:
+    """
+    Async client of the STT service.
+
+    Attributes:
+        url (str): The URL of the STT service.
+        connect_timeout (float): Seconds allowed to establish a connection.
+        read_timeout (float): Seconds allowed to wait for the transcription; None waits indefinitely.
+        max_retries (int): Number of retries after a 5xx response or a connection error.
+        backoff_base (float): Base delay of the exponential backoff, in seconds.
+        backoff_max (float): Maximum delay between two attempts, in seconds.
+        max_concurrency (int): Maximum number of concurrent requests toward the STT server.
+        cache (ResultCache): Optional cache of the successful transcriptions, keyed by file path.
+
+    Methods:
+        transcribe(file_path: str) -> dict:
+            Transcribes the media file at `file_path`.
+        aclose():
+            Closes the pooled connections.
+    """
+    def __init__(
+        self,
+        url: str,
+        connect_timeout: float = 5.0,
+        read_timeout: float = 600.0,
+        max_retries: int = 3,
+        backoff_base: float = 0.5,
+        backoff_max: float = 10.0,
+        max_concurrency: int = 8,
+        cache=None
+    ):
+        self.url = url
+        self.connect_timeout = connect_timeout
+        self.read_timeout = read_timeout
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.max_concurrency = max_concurrency
+        self.cache = cache
+
+        self._semaphore = asyncio.Semaphore(max_concurrency)
+        self._client = httpx.AsyncClient(
+            timeout=httpx.Timeout(read_timeout, connect=connect_timeout),
+            limits=httpx.Limits(max_connections=max_concurrency, max_keepalive_connections=max_concurrency)
+        )
+
+    async def transcribe(self, file_path: str) -> dict:
+        """
+        Sends the media file at `file_path` to the STT service.
+        Successful transcriptions are cached by file path, so a re-published or replayed file is not
+        transcribed again.
+
+        Args:
+            file_path (str): URL of the audio or video file to transcribe.
+
+        Returns:
+            dict: The `data` field of the STT response, containing the `raw` and `srt` texts,
+                  or None if the STT service answered without a successful status.
+
+        Raises:
+            SttError: If the STT service still answers with a 5xx status or cannot be reached after the retries.
+            httpx.TimeoutException: If the transcription exceeds the read timeout; it is not retried since the
+                server may still be working on it.
+        """
+        key = make_key('stt', self.url, file_path)
+        if self.cache is not None:
+            cached = await self.cache.aget(key)
+            if cached is not None:
+                return cached
+
+        response = await self._post({'input': file_path})
+        if response.status_code == 200:
+            res = response.json()
+            if res['code'] == 200:
+                if self.cache is not None:
+                    await self.cache.aset(key, res['data'])
+                return res['data']
+        return None
+
+    async def aclose(self):
+        await self._client.aclose()
+
+    async def _post(self, payload: dict) -> httpx.Response:
+        """
+        Posts `payload` to the STT service, retrying 5xx responses and connection errors.
+        """
+        for attempt in range(self.max_retries + 1):
+            try:
+                async with self._semaphore:
+                    response = await self._client.post(self.url, data=payload)
+                if response.status_code < 500:
+                    return response
+                error = SttError(f'STT service answered {response.status_code}')
+            except RETRYABLE_ERRORS as e:
+                error = SttError(f'STT service unreachable: {e!r}')
+
+            if attempt < self.max_retries:
+                delay = self._backoff(attempt)
+                log('stt_retry', level='warning', attempt=attempt + 1, delay=round(delay, 3), error=str(error))
+                await asyncio.sleep(delay)
+        raise error
+
+    def _backoff(self, attempt: int) -> float:
+        """
+        Returns the delay before the retry following `attempt`, with full jitter.
+        """
+        return random.uniform(0, min(self.backoff_max, self.backoff_base * 2 ** attempt))
@@ -0,0 +1,125 @@
+"""
+This module counts tokens locally, so the prompts are budgeted before they are sent to the language model.
+
+The counter never downloads anything. A tiktoken encoding is only loaded from the tiktoken cache directory
+(TIKTOKEN_CACHE_DIR), e.g. filled when the image is built, and a Hugging Face tokenizer from a local
+tokenizer.json file. When the requested tokenizer cannot be loaded, the counter falls back to the estimate of
+four characters per token and logs a warning.
+
+Classes:
+    TokenCounter: Counts the tokens of a text with one backend.
+
+Functions:
+    create_token_counter: Creates the counter of a tokenizer specification.
+"""
+import os
+import hashlib
+import tempfile
+
+from tracing import log
+from chunking import estimate_tokens
+
+try:
+    import tiktoken
+except ImportError:
+    tiktoken = None
+
+try:
+    from tokenizers import Tokenizer
+except ImportError:
+    Tokenizer = None
+
+# Tokens added by the chat format around a single user message and the reply priming
+CHAT_OVERHEAD = 7
+
+# The files of the tiktoken encodings, cached by tiktoken under the SHA-1 of their URL
+TIKTOKEN_FILES = {
+    'cl100k_base': 'https://openaipublic.blob.core.windows.net/encodings/cl100k_base.tiktoken',
+    'o200k_base': 'https://openaipublic.blob.core.windows.net/encodings/o200k_base.tiktoken',
+    'p50k_base': 'https://openaipublic.blob.core.windows.net/encodings/p50k_base.tiktoken',
+    'r50k_base': 'https://openaipublic.blob.core.windows.net/encodings/r50k_base.tiktoken'
+}
+
+
+class TokenCounter:
+    """
+    Counts the tokens of a text with one backend. An instance is a `count_tokens` callable, so it replaces
+    `estimate_tokens` in the chunking and the compaction.
+
+    Attributes:
+        name (str): The loaded tokenizer: 'tiktoken:<encoding>', 'hf:<path>' or 'estimate'.
+
+    Methods:
+        count(text: str) -> int:
+            Returns the number of tokens of `text`.
+        count_prompt(text: str) -> int:
+            Returns the number of tokens of `text` sent as the single user message of a chat completion.
+    """
+    def __init__(self, name: str, encode=None):
+        self.name = name
+        self._encode = encode
+
+    def count(self, text: str) -> int:
+        if self._encode is None:
+            return estimate_tokens(text)
+        return len(self._encode(text))
+
+    def count_prompt(self, text: str) -> int:
+        return self.count(text) + CHAT_OVERHEAD
+
+    def __call__(self, text: str) -> int:
+        return self.count(text)
+
+
+def _tiktoken_cache_path(encoding: str) -> str:
+    """
+    Returns the path of the file of `encoding` in the tiktoken cache, looked up like tiktoken does.
+    """
+    if encoding not in TIKTOKEN_FILES:
+        raise ValueError(f'unknown tiktoken encoding: {encoding}')
+    cache_dir = os.environ.get('TIKTOKEN_CACHE_DIR', os.environ.get('DATA_GYM_CACHE_DIR'))
+    if cache_dir is None:
+        cache_dir = os.path.join(tempfile.gettempdir(), 'data-gym-cache')
+    return os.path.join(cache_dir, hashlib.sha1(TIKTOKEN_FILES[encoding].encode()).hexdigest())
+
+
+def _load_tiktoken(encoding: str):
+    # tiktoken fetches the encodings missing from its cache; loading only the cached ones keeps the counter offline
+    path = _tiktoken_cache_path(encoding)
+    if not os.path.isfile(path):
+        raise OSError(f'{encoding} is not in the tiktoken cache ({path}) and tokenizers are never downloaded')
+    return tiktoken.get_encoding(encoding).encode_ordinary
+
+
+def _load_hf(path: str):
+    tokenizer = Tokenizer.from_file(path)
+    return lambda text: tokenizer.encode(text, add_special_tokens=False).ids
+
+
+def create_token_counter(spec: str = 'auto') -> TokenCounter:
+    """
+    Creates the token counter of `spec`.
+
+    Args:
+        spec (str): 'tiktoken:<encoding>' for a cached tiktoken encoding, 'hf:<path>' for a Hugging Face
+            tokenizer.json file, 'estimate' for four characters per token, or 'auto' for the cl100k_base
+            encoding when it is available and the estimate otherwise.
+
+    Returns:
+        TokenCounter: The counter, estimating when the tokenizer cannot be loaded.
+    """
+    if spec == 'estimate':
+        return TokenCounter('estimate')
+    if spec == 'auto':
+        spec = 'tiktoken:cl100k_base'
+    backend, _, argument = spec.partition(':')
+    try:
+        if backend == 'tiktoken' and tiktoken is not None:
+            return TokenCounter(spec, _load_tiktoken(argument))
+        if backend == 'hf' and Tokenizer is not None:
+            return TokenCounter(spec, _load_hf(argument))
+        error = f'{backend} is not installed'
+    except Exception as e:
+        error = repr(e)
+    log('tokenizer_unavailable', level='warning', tokenizer=spec, error=error)
+    return TokenCounter('estimate')
@@ -0,0 +1,231 @@
+"""
+This module provides the structured logs, the per-message tracing and the profiling hook of the workers.
+
+Every log record is a single JSON line on stdout. Each consumed message gets a trace whose id is derived from its
+Id and RefId, so the records of a message, of its retries and of its replays share the same trace id. The stages
+of a message run in spans, logged when they end with their duration and status, and nested spans point to their
+parent. The trace follows the message across the tasks it spawns, since it is held in a context variable, and
+across the analysis batches shared with other messages, since the batcher attaches it to the runs of every text.
+
+Profiling is opt-in: a Profiler runs every Nth message under cProfile and dumps the profile to disk, for offline
+analysis with snakeviz or a flamegraph converter. The profile covers everything the event loop thread runs during
+the message, including the other messages processed concurrently.
+
+Classes:
+    Trace: Trace of one message.
+    Profiler: Profiles every Nth message with cProfile.
+    SpanCallback: LangChain callback handler logging a span for every sub-analysis.
+
+Functions:
+    log: Writes a structured log record.
+    trace_id_of: Derives the trace id of a message from its Id and RefId.
+    bind_message: Sets the trace id of the current message once its payload is decoded.
+    trace_metadata: Returns the trace context to attach to work done on behalf of the current message.
+    span: Context manager timing a stage of the current message.
+    traced: Decorator tracing and optionally profiling a message handler.
+"""
+import os
+import sys
+import json
+import time
+import hashlib
+import cProfile
+import functools
+import threading
+import contextvars
+from contextlib import contextmanager
+
+from langchain_core.callbacks import BaseCallbackHandler
+
+# (Trace, span id) of the span running in the current context
+_current = contextvars.ContextVar('span', default=None)
+_write_lock = threading.Lock()
+
+
+class Trace:
+    """
+    Trace of one message. The id is set once the payload of the message is decoded.
+    """
+    __slots__ = ('trace_id',)
+
+    def __init__(self, trace_id: str = None):
+        self.trace_id = trace_id
+
+
+def log(event: str, level: str = 'info', **fields):
+    """
+    Writes a structured log record as one JSON line, with the trace and span of the current context.
+
+    Args:
+        event (str): The name of the event.
+        level (str): 'debug', 'info', 'warning' or 'error'.
+        **fields: The fields of the record.
+    """
+    record = {'ts': round(time.time(), 6), 'level': level, 'event': event}
+    current = _current.get()
+    if current is not None and 'trace_id' not in fields:
+        record['trace_id'] = current[0].trace_id
+        record['span_id'] = current[1]
+    record.update(fields)
+    line = json.dumps(record, ensure_ascii=False, default=str)
+    with _write_lock:
+        sys.stdout.write(line + '\n')
+        sys.stdout.flush()
+
+
+def trace_id_of(data: dict) -> str:
+    """
+    Derives the trace id of a message from its Id and RefId, as 32 hex digits.
+    """
+    return hashlib.sha256(f"{data.get('Id')}/{data.get('RefId')}".encode('utf-8')).hexdigest()[:32]
+
+
+def bind_message(data: dict):
+    """
+    Sets the trace id of the current message from its decoded payload.
+    """
+    current = _current.get()
+    if current is not None:
+        current[0].trace_id = trace_id_of(data)
+
+
+def trace_metadata() -> dict:
+    """
+    Returns the trace context of the current span, to attach to the work done for the current message in
+    another context, e.g. in an analysis batch. Returns None outside of a span.
+    """
+    current = _current.get()
+    if current is None:
+        return None
+    return {'trace_id': current[0].trace_id, 'span_id': current[1]}
+
+
+@contextmanager
+def span(name: str, trace: Trace = None, parent_id: str = None, **attributes):
+    """
+    Runs the `with` block in a span of the current trace and logs the span when the block ends.
+
+    Args:
+        name (str): The name of the stage.
+        trace (Trace): The trace of the span; defaults to the trace of the current span, or a new trace.
+        parent_id (str): The parent span; defaults to the current span.
+        **attributes: Additional fields of the span record.
+    """
+    current = _current.get()
+    if trace is None:
+        trace, parent_id = (current[0], current[1]) if current is not None else (Trace(), None)
+    span_id = os.urandom(8).hex()
+    token = _current.set((trace, span_id))
+    start, started = time.time(), time.perf_counter()
+    status, error = 'ok', None
+    try:
+        yield
+    except BaseException as e:
+        status, error = 'error', repr(e)
+        raise
+    finally:
+        _current.reset(token)
+        fields = {'error': error} if error is not None else {}
+        log('span', name=name, trace_id=trace.trace_id, span_id=span_id, parent_id=parent_id, start=round(start, 6),
+            duration_ms=round((time.perf_counter() - started) * 1000, 3), status=status, **fields, **attributes)
+
+
+class Profiler:
+    """
+    Profiles every Nth message with cProfile and dumps the profile in `directory`.
+
+    Attributes:
+        every (int): Profile one message out of `every`; 0 disables profiling.
+        directory (str): Directory of the .prof files.
+    """
+    def __init__(self, every: int = 0, directory: str = 'profiles'):
+        self.every = every
+        self.directory = directory
+        self._count = 0
+        self._active = False
+
+    @contextmanager
+    def profile(self, name: str):
+        """
+        Profiles the `with` block if it is the Nth message and no other message is being profiled.
+        """
+        self._count += 1
+        if not self.every or self._count % self.every or self._active:
+            yield
+            return
+
+        self._active = True
+        profile = cProfile.Profile()
+        profile.enable()
+        try:
+            yield
+        finally:
+            profile.disable()
+            self._active = False
+            os.makedirs(self.directory, exist_ok=True)
+            path = os.path.join(self.directory, f'{name}-{int(time.time() * 1000)}.prof')
+            profile.dump_stats(path)
+            log('profile', path=path)
+
+
+def traced(topic: str, profiler: Profiler = None):
+    """
+    Decorates a message handler so that every message runs in the root span of a new trace, named 'message',
+    and every Nth message is profiled when a profiler is given.
+    """
+    def decorate(handler):
+        @functools.wraps(handler)
+        async def wrapper(message):
+            trace = Trace()
+            with span('message', trace=trace, topic=topic, partition=message.partition, offset=message.offset):
+                if profiler is None:
+                    return await handler(message)
+                with profiler.profile(f'{topic}-{message.partition}-{message.offset}'):
+                    return await handler(message)
+        return wrapper
+    return decorate
+
+
+class SpanCallback(BaseCallbackHandler):
+    """
+    LangChain callback handler logging a span for every sub-analysis of AnalysisPipeline.
+
+    The span belongs to the trace found in the `trace_id` metadata of the run, attached by the batcher for the
+    texts of a batch, or else to the trace of the current context.
+
+    Attributes:
+        names (dict): The span name of every task tag of the chains.
+    """
+    run_inline = True
+
+    def __init__(self, names=None):
+        self.names = names or {
+            'analyze': 'analyze_text',
+            'segment': 'segment_text',
+            'grammar': 'grammar_check',
+            'combined': 'analyze_combined'
+        }
+        self._runs = {}
+
+    def on_chain_start(self, serialized, inputs, *, run_id, parent_run_id=None, tags=None, metadata=None, **kwargs):
+        name = next((self.names[tag] for tag in tags or () if tag in self.names), None)
+        if parent_run_id is not None or name is None:
+            return
+        context = metadata if (metadata or {}).get('trace_id') else trace_metadata() or {}
+        self._runs[run_id] = (name, context.get('trace_id'), context.get('span_id'), time.time(), time.perf_counter())
+
+    def on_chain_end(self, outputs, *, run_id, **kwargs):
+        self._end(run_id, None)
+
+    def on_chain_error(self, error, *, run_id, **kwargs):
+        self._end(run_id, error)
+
+    def _end(self, run_id, error):
+        run = self._runs.pop(run_id, None)
+        if run is None:
+            return
+        name, trace_id, parent_id, start, started = run
+        fields = {'error': repr(error)} if error is not None else {}
+        log('span', name=name, trace_id=trace_id, span_id=os.urandom(8).hex(), parent_id=parent_id,
+            start=round(start, 6), duration_ms=round((time.perf_counter() - started) * 1000, 3),
+            status='error' if error is not None else 'ok', **fields)
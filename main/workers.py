@@ -1,219 +1,561 @@
-import json
 import time
-import requests
-import newspaper
+import asyncio
 
 from llm import AnalysisPipeline
-from kafka_helper import consumer_audio, consumer_video, consumer_document, producer
-from constant import CONSUME_TOPIC, PRODUCE_TOPIC, LLM_HOST, LLM_MODEL, STT_URL
-
-analyze_chain = AnalysisPipeline(
-    api_key='...',
-    llm_host=LLM_HOST,
-    llm_model=LLM_MODEL
+from batching import MicroBatcher
+from cache import create_cache
+from stt import SttClient
+from extraction import HtmlExtractor
+from ratelimit import LlmLimiter
+from compaction import Compactor
+from tokenizer import create_token_counter
+from router import LlmRouter
+from metrics import STAGE_SECONDS, MESSAGE_TOKENS, AnalysisMetrics
+from tracing import Profiler, SpanCallback, traced, span, bind_message, trace_metadata, log
+from kafka_helper import publish, serializer
+from constant import (
+    PRODUCE_TOPIC, LLM_HOST, LLM_MODEL, STT_URL,
+    LLM_TIMEOUT, LLM_MAX_RETRIES, LLM_MAX_TOKENS, LLM_CONTEXT_TOKENS, TOKENIZER,
+    LLM_REQUESTS_PER_SECOND, LLM_TOKENS_PER_MINUTE,
+    LLM_MIN_CONCURRENCY, LLM_MAX_CONCURRENCY, LLM_LATENCY_TOLERANCE,
+    LLM_HOSTS, LLM_TASK_MODELS, LLM_BALANCING, LLM_BREAKER_FAILURES, LLM_BREAKER_COOLDOWN_MS,
+    CACHE_BACKEND, CACHE_PATH, CACHE_TTL, CACHE_MAX_ENTRIES, ANALYSIS_MODE, ANALYSIS_TASKS, CHUNK_TOKENS,
+    STREAM_SEGMENTS, EARLY_PUBLISH, BATCH_SIZE, BATCH_WAIT_MS, BATCH_CONCURRENCY,
+    STT_CONNECT_TIMEOUT, STT_READ_TIMEOUT, STT_MAX_RETRIES, STT_MAX_CONCURRENCY,
+    EXTRACT_PROCESSES, EXTRACT_TIMEOUT_MS, PROFILE_EVERY, PROFILE_DIR, STAGE_CONCURRENCY,
+    DEAD_LETTER_TOPIC, STAGE_RETRIES, STAGE_RETRY_BACKOFF_MS, COMPACT_INPUT, COMPACT_INDEX_CHARS
 )
 
-def audio_worker():
+class Resources:
+    """
+    The clients shared by the pipelines of a process. They are created by the process serving the topics, for
+    these topics only: the speech-to-text client for the media topics, the extraction processes for the
+    documents, and the language model clients for every topic.
+
+    Attributes:
+        analyze_cache (Cache): Cache of the analyses.
+        stt_cache (Cache): Cache of the transcriptions; None without a media topic.
+        llm_limiter (LlmLimiter): Shared by every language model request of the process, from the batches, the
+            threads and the streams.
+        llm_router (LlmRouter): Spreads the language model requests over the LLM_HOSTS replicas, with the model
+            of every task.
+        token_counter (TokenCounter): Counts the prompt tokens locally, for the chunking, the compaction report
+            and the context window check.
+        analysis_metrics (AnalysisMetrics): Records the latency and the tokens of the sub-analyses, and adds up
+            the tokens spent on every message.
+        analyze_chain (AnalysisPipeline): The analysis of the texts.
+        analyze_batcher (MicroBatcher): Groups the analyze calls of concurrently processed messages into batches.
+        stt_client (SttClient): Shared pooled client for the speech-to-text service; None without a media topic.
+        profiler (Profiler): Profiles every PROFILE_EVERY-th message of the process when enabled.
+        html_extractor (HtmlExtractor): Extracts the text of HTML documents off the event loop, in dedicated
+            processes; None without the document topic.
+
+    Methods:
+        start():
+            Starts the extraction processes, before the process starts any thread.
+        aclose():
+            Closes the clients.
     """
-    Continuously consumes audio messages from a Kafka topic, processes them, and produces results to another Kafka topic.
+    def __init__(self, topics):
+        media = any(topic in ('audio', 'video') for topic in topics)
+        cache_options = dict(path=CACHE_PATH, max_entries=CACHE_MAX_ENTRIES, ttl=CACHE_TTL)
+        self.analyze_cache = create_cache(CACHE_BACKEND, 'analyze', **cache_options)
+        self.stt_cache = create_cache(CACHE_BACKEND, 'stt', **cache_options) if media else None
+
+        self.llm_limiter = LlmLimiter(
+            requests_per_second=LLM_REQUESTS_PER_SECOND,
+            tokens_per_minute=LLM_TOKENS_PER_MINUTE,
+            min_concurrency=LLM_MIN_CONCURRENCY,
+            max_concurrency=LLM_MAX_CONCURRENCY,
+            latency_tolerance=LLM_LATENCY_TOLERANCE
+        )
+        self.llm_router = LlmRouter(
+            LLM_HOSTS,
+            model=LLM_MODEL,
+            task_models=LLM_TASK_MODELS,
+            balancing=LLM_BALANCING,
+            failure_threshold=LLM_BREAKER_FAILURES,
+            cooldown=LLM_BREAKER_COOLDOWN_MS / 1000,
+            max_attempts=LLM_MAX_RETRIES + 1,
+            limiter=self.llm_limiter,
+            timeout=LLM_TIMEOUT or None
+        )
+        self.token_counter = create_token_counter(TOKENIZER)
+        self.analysis_metrics = AnalysisMetrics()
+        self.analyze_chain = AnalysisPipeline(
+            api_key='...',
+            llm_host=LLM_HOST,
+            llm_model=LLM_MODEL,
+            cache=self.analyze_cache,
+            chunk_tokens=CHUNK_TOKENS or None,
+            batch_size=BATCH_SIZE,
+            batch_concurrency=BATCH_CONCURRENCY,
+            callbacks=[self.analysis_metrics, SpanCallback()],
+            limiter=self.llm_limiter,
+            router=self.llm_router,
+            compactor=Compactor(index_chars=COMPACT_INDEX_CHARS, count_tokens=self.token_counter)
+            if COMPACT_INPUT else None,
+            token_counter=self.token_counter,
+            max_tokens=LLM_MAX_TOKENS,
+            context_tokens=LLM_CONTEXT_TOKENS or None,
+            timeout=LLM_TIMEOUT or None,
+            max_retries=LLM_MAX_RETRIES
+        )
+        self.analyze_batcher = MicroBatcher(self.analyze_chain, max_batch_size=BATCH_SIZE, max_wait_ms=BATCH_WAIT_MS)
+
+        self.stt_client = SttClient(
+            STT_URL,
+            connect_timeout=STT_CONNECT_TIMEOUT,
+            read_timeout=STT_READ_TIMEOUT or None,
+            max_retries=STT_MAX_RETRIES,
+            max_concurrency=STT_MAX_CONCURRENCY,
+            cache=self.stt_cache
+        ) if media else None
+        self.profiler = Profiler(every=PROFILE_EVERY, directory=PROFILE_DIR)
+        self.html_extractor = HtmlExtractor(
+            max_workers=EXTRACT_PROCESSES,
+            timeout=EXTRACT_TIMEOUT_MS / 1000 or None,
+            language='vi'
+        ) if 'document' in topics else None
 
-    The function performs the following steps:
-    1. Sleeps for 3 seconds in each iteration.
-    2. Consumes messages from the `consumer_audio` Kafka consumer.
-    3. Decodes and parses the message value as JSON.
-    4. Extracts the file path from the message metadata.
-    5. If the file path is a valid URL, sends a POST request to the speech-to-text (STT) service.
-    6. If the STT service responds with a successful status, processes the response data.
-    7. Analyzes the raw text obtained from the STT service.
-    8. Constructs an output JSON with analysis results and metadata.
-    9. Sends the output JSON to the `PRODUCE_TOPIC['audio']` Kafka topic.
+    def start(self):
+        if self.html_extractor is not None:
+            self.html_extractor.start()
 
-    Exceptions:
-        Catches and prints any exceptions that occur during message consumption and processing.
+    async def aclose(self):
+        if self.stt_client is not None:
+            await self.stt_client.aclose()
+        if self.html_extractor is not None:
+            self.html_extractor.close()
 
-    Note:
-        - The function runs indefinitely in a while loop.
-        - Ensure that `consumer_audio`, `STT_URL`, `analyze_chain`, and `producer` are properly initialized before calling this function.
+
+def message_key(data: dict) -> bytes:
     """
-    while True:
-        time.sleep(3)
-        for message in consumer_audio:
-            try:
-                message_info = message.value.decode()
-                data = json.loads(message_info)
-                print("audio consuming: ",
-                      data['Metadata'], '\n\n\n\n\n\n\n\n')
-
-                file_path = data['Metadata']['FilePath']
-                if file_path != '' and file_path.startswith('http'):
-                    payload = {'input': file_path}
-                    response = requests.request("POST", STT_URL, data=payload)
-                    if response.status_code == 200:
-                        res = response.json()
-                        if res['code'] == 200:
-                            output = res['data']
-                            raw_text, srt_text = output['raw'], output['srt']
-                            analyze_result = analyze_chain.analyze(
-                                raw_text)
-                            summary = analyze_result['summary']
-                            title = analyze_result['title']
-                            keywords = analyze_result['keywords']
-                            tags = analyze_result['tags']
-                            spelling = analyze_result['spelling']
-                            personage = analyze_result['personage']
-                            output_json = {"Id": data['Id'],
-                                           'RefId': data['RefId'],
-                                           "Metadata": {
-                                "Subtitle": srt_text,
-                                "Summary": summary,
-                                "Title": title,
-                                "Keyword": json.dumps(keywords),
-                                "Tags": json.dumps(tags),
-                                "Spelling": json.dumps(spelling),
-                                "Personage": json.dumps(personage)
-                            }
-                            }
-                            print("result audio: ", output_json)
-                            producer.send(PRODUCE_TOPIC['audio'], output_json)
-            except Exception as e:
-                print(f"Error occurred while consuming messages: {e}")
+    Returns the Kafka key of the results of a message, its Id.
+    """
+    return str(data['Id']).encode('utf-8')
 
 
-def video_worker():
+async def publish_segments(resources: Resources, topic: str, job: 'Job') -> list:
     """
-    Continuously consumes video messages from a Kafka topic, processes the video data, 
-    and sends the processed results to another Kafka topic.
+    Streams the segmentation of the subtitle of a job and publishes every segment as a partial result as soon
+    as the model completed it, when `STREAM_SEGMENTS[topic]` is enabled. The segmentation of a cached transcript
+    is published at once. When the stage is retried, the segments published by the previous attempts are
+    streamed again but not republished.
+
+    The partial results are sent to `PRODUCE_TOPIC[topic]` keyed by the message Id, so they stay ordered with
+    the final result of the message, and have the following form:
+    {"Id": ..., "RefId": ..., "Partial": true, "Metadata": {"Index": 0, "Segment": {...}}}
 
-    The function performs the following steps:
-    1. Sleeps for 3 seconds in each iteration to avoid busy-waiting.
-    2. Consumes messages from the `consumer_video` Kafka consumer.
-    3. Decodes the message and parses it as JSON.
-    4. Extracts the file path from the message metadata.
-    5. If the file path is a valid URL, sends a POST request to the STT (Speech-to-Text) service.
-    6. If the STT service responds with a successful status, processes the response to extract 
-       raw text and subtitle text.
-    7. Analyzes the raw text to generate a summary, title, keywords, tags, and spelling corrections.
-    8. Constructs an output JSON with the analysis results and sends it to the `PRODUCE_TOPIC['video']` Kafka topic.
-    9. Handles and logs any exceptions that occur during message consumption and processing.
+    Args:
+        resources (Resources): The clients of the process.
+        topic (str): The media topic, 'audio' or 'video'.
+        job (Job): The job, whose subtitle is the transcript in subtitle format.
 
-    Raises:
-        Exception: If any error occurs during message consumption or processing.
+    Returns:
+        list: The segments of the transcript.
     """
-    while True:
-        time.sleep(3)
-        for message in consumer_video:
-            try:
-                message_info = message.value.decode()
-                data = json.loads(message_info)
-                print("video consuming: ",
-                      data['Metadata'], '\n\n\n\n\n\n\n\n')
-
-                file_path = data['Metadata']['FilePath']
-                if file_path != '' and file_path.startswith('http'):
-                    payload = {'input': file_path}
-                    response = requests.request("POST", STT_URL, data=payload)
-                    if response.status_code == 200:
-                        res = response.json()
-                        if res['code'] == 200:
-                            output = res['data']
-                            raw_text, srt_text = output['raw'], output['srt']
-                            analyze_result = analyze_chain.analyze(
-                                raw_text)
-                            summary = analyze_result['summary']
-                            title = analyze_result['title']
-                            keywords = analyze_result['keywords']
-                            tags = analyze_result['tags']
-                            spelling = analyze_result['spelling']
-                            output_json = {"Id": data['Id'],
-                                           'RefId': data['RefId'],
-                                           "Metadata": {
-                                "Subtitle": srt_text,
-                                "Summary": summary,
-                                "Title": title,
-                                "Keyword": json.dumps(keywords),
-                                "Tags": json.dumps(tags),
-                                "Spelling": json.dumps(spelling)
-                            }
-                            }
-                            print("result video: ", output_json)
-                            producer.send(PRODUCE_TOPIC['video'], output_json)
-            except Exception as e:
-                print(f"Error occurred while consuming messages: {e}")
+    if not STREAM_SEGMENTS.get(topic):
+        return []
+
+    data, segments = job.data, []
+    async for segment in resources.analyze_chain.astream_segments(job.subtitle):
+        if len(segments) >= job.partials:
+            partial_json = {"Id": data['Id'],
+                            'RefId': data['RefId'],
+                            "Partial": True,
+                            "Metadata": {
+                "Index": len(segments),
+                "Segment": segment
+            }
+            }
+            await publish(PRODUCE_TOPIC[topic], partial_json, key=message_key(data))
+            job.partials += 1
+        segments.append(segment)
+    return segments
+
+
+# Fields of the result Metadata, besides the Subtitle: the key of the analysis and whether the result carries
+# the value as a JSON string
+RESULT_FIELDS = {
+    'Summary': ('summary', False),
+    'Title': ('title', False),
+    'Keyword': ('keywords', True),
+    'Tags': ('tags', True),
+    'Spelling': ('spelling', True),
+    'Personage': ('personage', True)
+}
+
+# Fields of the result Metadata filled by the slower sub-analyses, published when they ran: the sub-analysis, the
+# key of the analysis and whether the result carries the value as a JSON string
+ENRICHMENT_FIELDS = {
+    'Segments': ('segment', 'segments', True),
+    'GrammarErrors': ('grammar', 'grammar_errors', True)
+}
+
+
+class Job:
+    """
+    State of a message flowing through the stages of a StagePipeline.
+
+    Attributes:
+        message (ConsumerRecord): The consumed Kafka record.
+        data (dict): The decoded message.
+        text (str): The text to analyze: the raw transcript or the article text.
+        subtitle (str): The text published as Subtitle: the transcript in subtitle format or the article text. It
+            is the input of the analyses including the segmentation, which needs the timestamps, and of every
+            analysis when the input is compacted.
+        analysis (dict): The result of the analysis.
+        payload (bytes): The serialized result.
+        partials (int): The number of segments already published as partial results, kept across the retries of
+            the analysis.
+        preliminary (dict): The text analysis published as preliminary result, Version 1, kept across the retries
+            of the analysis; None until it is published.
+    """
+    __slots__ = ('message', 'data', 'text', 'subtitle', 'analysis', 'payload', 'partials', 'preliminary')
+
+    def __init__(self, message):
+        self.message = message
+        self.data = self.text = self.subtitle = self.analysis = self.payload = self.preliminary = None
+        self.partials = 0
 
 
-def document_worker():
+# Errors caused by the content of the message itself, which a retry would raise again
+PERMANENT_ERRORS = (ValueError, KeyError, TypeError, AttributeError)
+
+
+class StageError(Exception):
+    """
+    Raised when a stage failed on a job after its retries.
+
+    Attributes:
+        stage (str): The name of the failed stage.
+        error (Exception): The last error of the stage.
+        attempts (int): The number of attempts made.
     """
-    Continuously consumes messages from the `consumer_document` queue, processes the document content,
-    performs analysis, and sends the results to the specified producer topic.
+    def __init__(self, stage: str, error: Exception, attempts: int):
+        super().__init__(f'{stage} failed after {attempts} attempt(s): {error!r}')
+        self.stage = stage
+        self.error = error
+        self.attempts = attempts
 
-    The function performs the following steps:
-    1. Sleeps for 3 seconds in each iteration.
-    2. Consumes messages from the `consumer_document` queue.
-    3. Decodes the message and parses it as JSON.
-    4. Extracts the raw text content from the message.
-    5. Creates a newspaper article object from the raw text.
-    6. Analyzes the article text using the `analyze_chain` object.
-    7. Extracts analysis results including summary, title, keywords, tags, spelling, and personage.
-    8. Constructs an output JSON object with the analysis results.
-    9. Sends the output JSON to the `PRODUCE_TOPIC['document']` topic.
-    10. Handles and logs any exceptions that occur during message consumption and processing.
 
-    Note:
-    - The function runs indefinitely in a while loop.
-    - The function breaks out of the inner for loop after processing a single message.
+class Stage:
+    """
+    One step of a StagePipeline.
 
-    Raises:
-    - Exception: If any error occurs during message consumption or processing, it is caught and logged.
+    Attributes:
+        name (str): The stage name, used as span name and as `stage` label of STAGE_SECONDS.
+        function (Callable[[StagePipeline, Job], Awaitable[Optional[bool]]]): Coroutine function running the
+            step on a job; returns False to skip the rest of the pipeline.
+        concurrency (int): Maximum number of jobs of the pipeline in this stage at once; None leaves the stage
+            bounded by the messages in flight of the topic only.
+        retries (int): Number of retries of the step after a transient error; PERMANENT_ERRORS are not retried.
+        backoff (float): Seconds before the first retry, doubled on every retry. The job gives its slot of the
+            stage back while it waits.
     """
-    while True:
-        time.sleep(3)
-        for message in consumer_document:
+    def __init__(self, name: str, function, concurrency: int = None, retries: int = 0, backoff: float = 1.0):
+        self.name = name
+        self.function = function
+        self.concurrency = concurrency
+        self.retries = retries
+        self.backoff = backoff
+        self._semaphore = asyncio.Semaphore(concurrency) if concurrency else None
+
+    async def run(self, pipeline, job: Job):
+        """
+        Runs the step on `job`, retrying it on transient errors.
+
+        Raises:
+            StageError: If the step still fails after its retries.
+        """
+        for attempt in range(self.retries + 1):
             try:
-                message_info = message.value.decode()
-                data = json.loads(message_info)
-                print("document consuming: ", data["Id"], '\n\n\n\n\n\n\n\n')
-                raw_text = data['Metadata']["Content"]
-                article = newspaper.article(input_html=raw_text,
-                                            url='', language='vi')
-                analyze_result = analyze_chain.analyze(article.text)
-                summary = analyze_result['summary']
-                title = analyze_result['title']
-                keywords = analyze_result['keywords']
-                tags = analyze_result['tags']
-                spelling = analyze_result['spelling']
-                personage = analyze_result['personage']
-                output_json = {"Id": data['Id'],
-                               'RefId': data['RefId'],
-                               "Metadata": {
-                    "Subtitle": article.text,
-                    "Summary": summary,
-                    "Title": title,
-                    "Keyword": json.dumps(keywords),
-                    "Tags": json.dumps(tags),
-                    "Spelling": json.dumps(spelling),
-                    "Personage": json.dumps(personage)
-                }
-                }
-                print("result document: ", output_json)
-                producer.send(PRODUCE_TOPIC['document'], output_json)
-                break
+                if self._semaphore is None:
+                    return await self.function(pipeline, job)
+                async with self._semaphore:
+                    return await self.function(pipeline, job)
             except Exception as e:
-                print(f"Error occurred while consuming messages: {e}")
-
-
-if __name__ == "__main__":
-    output = analyze_chain.analyze(text="""
-00:00:01 --> 00:00:05 At the meeting, voters of New York City highly appreciated the city of New York
-00:00:05 --> 00:00:08 and the central ministries and branches for their responsibility and active participation,
-00:00:09 --> 00:00:11 in preparing and building the state law, which has been approved by the National Assembly.
-00:00:12 --> 00:00:16 Voters suggested that the city's National Assembly delegation direct departments, branches, and levels
-00:00:16 --> 00:00:20 from the city to districts, towns, and communes to strengthen propaganda,
-00:00:20 --> 00:00:21 dissemination, and implementation of the state law.
-00:00:22 --> 00:00:25 Regarding the arrangement of administrative units at district and commune levels,
-00:00:25 --> 00:00:36 Voters proposed that the city's National Assembly delegation accelerate the approval process of the city's project, facilitating local units to organize party congresses at all levels in early 2025.
-00:00:37 --> 00:00:54 Voters also hoped that the National Assembly would continue to provide opinions for the government to complete, approve, and implement the New York state planning for the period 2021-2030 with a vision to 2050, and the overall adjustment project of the general planning of New York state until 2045 with a vision to 2065.
-00:00:55 --> 00:01:04 On behalf of the city's National Assembly delegation, Secretary of the City Party Committee John Doe acknowledged the voters' opinions and said that they would be explained to voters after the 8th session of the National Assembly.
-00:01:04 --> 00:01:15 Additionally, the Secretary informed voters that in the first nine months of the year, the city's socio-economic situation maintained growth and stability with many highlights despite being heavily affected by natural disasters.
-00:01:15 --> 00:01:22 Especially, the city of New York successfully organized the 70th anniversary of the state's liberation, leaving many impressions on the state's people and the whole country.""")
-
-    print(output)
\ No newline at end of file
+                if attempt == self.retries or isinstance(e, PERMANENT_ERRORS):
+                    raise StageError(self.name, e, attempt + 1) from e
+                delay = self.backoff * 2 ** attempt
+                log('stage_retry', level='warning', topic=pipeline.topic, stage=self.name, attempt=attempt + 1,
+                    delay=delay, error=repr(e))
+                await asyncio.sleep(delay)
+
+
+class StagePipeline:
+    """
+    Processes the messages of one topic through a sequence of stages.
+
+    The source of a pipeline is the TopicPool of its topic, which consumes the messages and runs up to
+    `MAX_IN_FLIGHT[topic]` of them through `process` concurrently. Every stage is timed in the `STAGE_SECONDS`
+    metric and logged as a span of the trace of the message, including the wait for a slot of the stage.
+
+    Attributes:
+        topic (str): The topic, 'audio', 'video' or 'document'.
+        stages (list): The Stage instances, in order.
+        resources (Resources): The clients used by the stages.
+        fields (tuple): The RESULT_FIELDS published in the result Metadata.
+        keyed (bool): Whether the results are keyed by the message Id.
+        dead_letter_topic (str): The topic receiving the messages that failed a stage after its retries. Their
+            offset is only committed once the topic acknowledged them; None propagates the error to the runtime
+            instead, which leaves the offset uncommitted and consumes the message again after a backoff.
+        early_publish (bool): Whether a preliminary result, Version 1, is published as soon as the text analysis
+            completed, and the final result, Version 2, once the slower sub-analyses finished. When the message is
+            dead-lettered after its preliminary result, Version 2 is the preliminary result marked as failed.
+
+    Methods:
+        process(message) -> Optional[Union[bool, str]]:
+            Runs the stages on a consumed record. Returns False if a stage skipped the message, 'dead_lettered'
+            if it was sent to the dead-letter topic, None once its result is produced; other exceptions are
+            propagated to the runtime, which logs them and leaves their offset uncommitted.
+    """
+    def __init__(self, topic: str, stages: list, resources: Resources, fields: tuple = tuple(RESULT_FIELDS),
+                 keyed: bool = True, dead_letter_topic: str = None, early_publish: bool = False):
+        self.topic = topic
+        self.stages = stages
+        self.resources = resources
+        self.fields = fields
+        self.keyed = keyed
+        self.dead_letter_topic = dead_letter_topic
+        self.early_publish = early_publish
+        self.process = traced(topic, resources.profiler)(self._run)
+
+    async def _run(self, message):
+        job = Job(message)
+        try:
+            for stage in self.stages:
+                with STAGE_SECONDS.time(topic=self.topic, stage=stage.name), span(stage.name):
+                    if await stage.run(self, job) is False:
+                        return False
+        except StageError as e:
+            if self.dead_letter_topic is None:
+                raise
+            await self._dead_letter(job, e)
+            if job.preliminary is not None:
+                await self._supersede_preliminary(job)
+            return 'dead_lettered'
+
+    async def _supersede_preliminary(self, job: Job):
+        """
+        Publishes the final result of a dead-lettered message whose preliminary result was published: the text
+        analysis with `"Failed": true`, so the consumers do not wait for a Version 2 that would never come. The
+        message is dead-lettered already, so an error is logged instead of propagated.
+        """
+        key = message_key(job.data) if self.keyed else None
+        try:
+            with span('failed_result'):
+                payload = build_result(self, job, job.preliminary, ('analyze',), version=2, failed=True)
+                await publish(PRODUCE_TOPIC[self.topic], payload, key=key)
+        except Exception as e:
+            log('failed_result_unpublished', level='error', topic=self.topic, id=job.data['Id'], error=repr(e))
+
+    async def _dead_letter(self, job: Job, error: StageError):
+        """
+        Sends the failed message to the dead-letter topic, keyed like the original record, in the form:
+        {"Topic": ..., "Partition": ..., "Offset": ..., "Timestamp": ..., "Key": ..., "Value": "<original record>",
+         "Error": {"Stage": ..., "Type": ..., "Message": ..., "Attempts": ..., "FailedAt": ..., "TraceId": ...}}
+        """
+        message = job.message
+        decode = lambda value: value.decode('utf-8', errors='replace') if value is not None else None
+        envelope = {
+            'Topic': message.topic,
+            'Partition': message.partition,
+            'Offset': message.offset,
+            'Timestamp': message.timestamp,
+            'Key': decode(message.key),
+            'Value': decode(message.value),
+            'Error': {
+                'Stage': error.stage,
+                'Type': type(error.error).__name__,
+                'Message': str(error.error),
+                'Attempts': error.attempts,
+                'FailedAt': round(time.time(), 3),
+                'TraceId': (trace_metadata() or {}).get('trace_id')
+            }
+        }
+        with span('dead_letter'):
+            await publish(self.dead_letter_topic, envelope, key=message.key)
+        log('dead_lettered', level='error', topic=self.topic, stage=error.stage, attempts=error.attempts,
+            partition=message.partition, offset=message.offset, error=repr(error.error))
+
+
+async def decode(pipeline: StagePipeline, job: Job):
+    """
+    Decodes the message and binds its trace.
+    """
+    job.data = serializer.loads(job.message.value)
+    bind_message(job.data)
+    file_path = {'file_path': job.data['Metadata']['FilePath']} if 'FilePath' in job.data['Metadata'] else {}
+    log('consumed', topic=pipeline.topic, id=job.data['Id'], ref_id=job.data['RefId'], **file_path)
+
+
+async def transcribe(pipeline: StagePipeline, job: Job):
+    """
+    Transcribes the media of the message with the STT service. Skips the message if it has no media URL or the
+    service returned no transcription.
+    """
+    file_path = job.data['Metadata']['FilePath']
+    if file_path == '' or not file_path.startswith('http'):
+        return False
+    output = await pipeline.resources.stt_client.transcribe(file_path)
+    if output is None:
+        return False
+    job.text, job.subtitle = output['raw'], output['srt']
+
+
+async def extract(pipeline: StagePipeline, job: Job):
+    """
+    Extracts the article text of the message Content in the extraction process pool, unless it is plain text.
+    """
+    job.text = job.subtitle = await pipeline.resources.html_extractor.extract(job.data['Metadata']['Content'])
+
+
+async def analyze(pipeline: StagePipeline, job: Job):
+    """
+    Analyzes the text in a micro-batch, running only the configured `ANALYSIS_TASKS[topic]`, with an early
+    preliminary result when the pipeline publishes one. Meanwhile, if enabled, publishes every segment of the
+    subtitle as a partial result as soon as it is ready; the streamed segmentation then answers the 'segment'
+    task, which the batched analysis leaves out. The tokens spent on the message, retries included, are
+    recorded in MESSAGE_TOKENS.
+    """
+    topic, tasks, resources = pipeline.topic, ANALYSIS_TASKS[pipeline.topic], pipeline.resources
+    streamed = STREAM_SEGMENTS.get(topic, False)
+    batched = tuple(task for task in tasks if task != 'segment') if streamed else tasks
+    metadata = trace_metadata()
+
+    async def analysis():
+        if not batched:
+            return {}
+        if pipeline.early_publish and 'analyze' in batched and len(batched) > 1:
+            return await analyze_early(pipeline, job, batched, metadata)
+        text = analysis_input(pipeline, job, batched)
+        return await resources.analyze_batcher.analyze(text, ANALYSIS_MODE[topic], batched, metadata=metadata)
+
+    try:
+        job.analysis, segments = await asyncio.gather(
+            analysis(), publish_segments(resources, topic, job))
+        if streamed and 'segment' in tasks:
+            job.analysis = {**job.analysis, 'segments': segments}
+    finally:
+        usage = resources.analysis_metrics.pop_usage((metadata or {}).get('trace_id'))
+        MESSAGE_TOKENS.observe(usage['prompt'], topic=topic, kind='prompt')
+        MESSAGE_TOKENS.observe(usage['completion'], topic=topic, kind='completion')
+        log('token_usage', topic=topic, prompt_tokens=usage['prompt'], completion_tokens=usage['completion'])
+
+
+def analysis_input(pipeline: StagePipeline, job: Job, tasks: tuple) -> str:
+    """
+    Returns the input of the analysis running `tasks`: the subtitle when they include the segmentation, which
+    needs its timestamps, or when the input is compacted, which turns the subtitle into the transcript without
+    the repeated subtitles of the speech-to-text; the text otherwise.
+    """
+    if 'segment' in tasks or pipeline.resources.analyze_chain.compactor is not None:
+        return job.subtitle
+    return job.text
+
+
+async def analyze_early(pipeline: StagePipeline, job: Job, tasks: tuple, metadata: dict) -> dict:
+    """
+    Runs the text analysis and the slower sub-analyses concurrently, in split mode, and publishes the
+    preliminary result of the message as soon as the text analysis completed. A retry of the analysis reuses
+    the published text analysis instead of publishing Version 1 again.
+
+    Returns:
+        dict: The result of every sub-analysis.
+    """
+    analyze_batcher = pipeline.resources.analyze_batcher
+    enrichment_tasks = tuple(task for task in tasks if task != 'analyze')
+    enrichment = asyncio.ensure_future(analyze_batcher.analyze(
+        analysis_input(pipeline, job, enrichment_tasks), 'split', enrichment_tasks, metadata=metadata))
+    # The error of the enrichment is not awaited when the text analysis failed first
+    enrichment.add_done_callback(lambda future: future.cancelled() or future.exception())
+    try:
+        if job.preliminary is None:
+            text = analysis_input(pipeline, job, ('analyze',))
+            news_info = await analyze_batcher.analyze(text, 'split', ('analyze',), metadata=metadata)
+            with span('preliminary'):
+                key = message_key(job.data) if pipeline.keyed else None
+                payload = build_result(pipeline, job, news_info, ('analyze',), version=1)
+                await publish(PRODUCE_TOPIC[pipeline.topic], payload, key=key)
+            job.preliminary = news_info
+        return {**job.preliminary, **await enrichment}
+    finally:
+        enrichment.cancel()
+
+
+def build_result(pipeline: StagePipeline, job: Job, analysis: dict, tasks: tuple, version: int = None,
+                 failed: bool = False) -> bytes:
+    """
+    Builds the result of the message from `analysis` and serializes it:
+    {"Id": ..., "RefId": ..., "Metadata": {"Subtitle": ..., "Summary": ..., "Title": ..., "Keyword": "[...]", ...}}
+
+    The ENRICHMENT_FIELDS are only added when their sub-analysis is among the `tasks` that ran. With early
+    publishing the result carries its `Version`: 1 for the preliminary result, 2 for the final one, which
+    supersedes it. The results of keyed pipelines reach the consumers in this order; the others may not. A
+    final result built from the preliminary one of a dead-lettered message is marked with `"Failed": true`.
+    """
+    metadata = {'Subtitle': job.subtitle}
+    for field in pipeline.fields:
+        key, encoded = RESULT_FIELDS[field]
+        metadata[field] = serializer.dumps_field(analysis[key]) if encoded else analysis[key]
+    for field, (task, key, encoded) in ENRICHMENT_FIELDS.items():
+        if task in tasks:
+            metadata[field] = serializer.dumps_field(analysis[key]) if encoded else analysis[key]
+    result = {'Id': job.data['Id'], 'RefId': job.data['RefId'], 'Metadata': metadata}
+    if version is not None:
+        result['Version'] = version
+    if failed:
+        result['Failed'] = True
+    fields = {'failed': True} if failed else {}
+    log('result', topic=pipeline.topic, id=job.data['Id'], title=analysis['title'], version=version, **fields)
+    return serializer.dumps(result)
+
+
+async def serialize(pipeline: StagePipeline, job: Job):
+    """
+    Builds the final result of the message and serializes it.
+    """
+    version = 2 if pipeline.early_publish else None
+    job.payload = build_result(pipeline, job, job.analysis, ANALYSIS_TASKS[pipeline.topic], version=version)
+
+
+async def sink(pipeline: StagePipeline, job: Job):
+    """
+    Sends the result to `PRODUCE_TOPIC[topic]` and waits for the acknowledgement, so the runtime only commits
+    the offset of the message once its result is delivered.
+    """
+    key = message_key(job.data) if pipeline.keyed else None
+    await publish(PRODUCE_TOPIC[pipeline.topic], job.payload, key=key)
+
+
+def stages(topic: str, *steps) -> list:
+    """
+    Returns the stages running `steps`, named after their function, with their `STAGE_CONCURRENCY[topic]` limit
+    and their `STAGE_RETRIES[topic]` retries.
+    """
+    return [
+        Stage(step.__name__, step, STAGE_CONCURRENCY[topic].get(step.__name__),
+              retries=STAGE_RETRIES[topic].get(step.__name__, 0), backoff=STAGE_RETRY_BACKOFF_MS / 1000)
+        for step in steps
+    ]
+
+
+# The steps of the pipeline of every topic, and its options besides the dead-letter topic and the early publishing
+PIPELINES = {
+    'audio': ((decode, transcribe, analyze, serialize, sink), {}),
+    'video': ((decode, transcribe, analyze, serialize, sink),
+              {'fields': ('Summary', 'Title', 'Keyword', 'Tags', 'Spelling')}),
+    'document': ((decode, extract, analyze, serialize, sink), {'keyed': False})
+}
+
+
+def create_pipeline(topic: str, resources: Resources) -> StagePipeline:
+    """
+    Creates the StagePipeline of `topic`, whose `process` method is the message handler of the topic.
+    """
+    steps, options = PIPELINES[topic]
+    return StagePipeline(topic, stages(topic, *steps), resources, dead_letter_topic=DEAD_LETTER_TOPIC[topic] or None,
+                         early_publish=EARLY_PUBLISH[topic], **options)
+
@@ -0,0 +1,28 @@
+"""
+Shared setup of the tests.
+
+The tests import the application modules from the `main` directory and the local stand-ins of the external
+services from the `benchmarks` directory. The settings are read when `constant` is imported, so the required
+ones are given placeholder values pointing nowhere; no test reaches these services.
+"""
+import os
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path[:0] = [os.path.join(ROOT, 'main'), os.path.join(ROOT, 'benchmarks')]
+
+for name, value in {
+    'KAFKA_SERVER': 'http://localhost:9092',
+    'KAFKA_GROUP_ID': 'tests',
+    'LLM_HOST': 'http://localhost:8000/v1',
+    'LLM_MODEL': 'test-model',
+    'STT_URL': 'http://localhost:9000',
+    'CONSUME_TOPIC_AUDIO': 'audio',
+    'CONSUME_TOPIC_VIDEO': 'video',
+    'CONSUME_TOPIC_DOCUMENT': 'document',
+    'PRODUCE_TOPIC_AUDIO': 'audio-result',
+    'PRODUCE_TOPIC_VIDEO': 'video-result',
+    'PRODUCE_TOPIC_DOCUMENT': 'document-result',
+    'CACHE_BACKEND': 'memory'
+}.items():
+    os.environ.setdefault(name, value)
@@ -0,0 +1,97 @@
+import asyncio
+import contextvars
+
+from batching import MicroBatcher
+from common import fake_llm
+from llm import AnalysisPipeline
+from samples import CANNED_RESULTS, SAMPLE_SRT
+
+MESSAGE = contextvars.ContextVar('message', default=None)
+
+
+class RecordingPipeline:
+    """
+    Stand-in of AnalysisPipeline answering every text with its upper case, or with the error it names.
+    """
+    def __init__(self, error: Exception = None):
+        self.error = error
+        self.calls = []
+
+    async def aanalyze_many(self, texts, mode, tasks, return_exceptions=False, metadata=None):
+        self.calls.append({'texts': texts, 'mode': mode, 'tasks': tasks, 'metadata': metadata,
+                           'message': MESSAGE.get()})
+        if self.error is not None:
+            raise self.error
+        return [ValueError(text) if text.startswith('bad') else text.upper() for text in texts]
+
+
+def _analyze_all(batcher: MicroBatcher, calls: list):
+    async def main():
+        return await asyncio.gather(*(batcher.analyze(*args, **options) for args, options in calls),
+                                    return_exceptions=True)
+    return asyncio.run(main())
+
+
+def test_full_batch_is_sent_at_once():
+    pipeline = RecordingPipeline()
+    batcher = MicroBatcher(pipeline, max_batch_size=2, max_wait_ms=60000)
+
+    assert _analyze_all(batcher, [(('a',), {}), (('b',), {})]) == ['A', 'B']
+    assert [call['texts'] for call in pipeline.calls] == [['a', 'b']]
+
+
+def test_partial_batch_is_sent_after_the_wait():
+    pipeline = RecordingPipeline()
+    batcher = MicroBatcher(pipeline, max_batch_size=16, max_wait_ms=10)
+
+    assert _analyze_all(batcher, [(('a',), {'metadata': {'trace_id': 1}}), (('b',), {})]) == ['A', 'B']
+    assert pipeline.calls == [{'texts': ['a', 'b'], 'mode': None, 'tasks': None,
+                               'metadata': [{'trace_id': 1}, None], 'message': None}]
+
+
+def test_batches_are_grouped_by_mode_and_tasks():
+    pipeline = RecordingPipeline()
+    batcher = MicroBatcher(pipeline, max_batch_size=16, max_wait_ms=10)
+
+    _analyze_all(batcher, [
+        (('a', 'split', ['analyze']), {}), (('b', 'split', ('analyze',)), {}), (('c', 'combined'), {})
+    ])
+    assert sorted((call['mode'], call['tasks'], tuple(call['texts'])) for call in pipeline.calls) == [
+        ('combined', None, ('c',)), ('split', ('analyze',), ('a', 'b'))
+    ]
+
+
+def test_error_of_a_text_only_fails_that_text():
+    batcher = MicroBatcher(RecordingPipeline(), max_batch_size=2, max_wait_ms=10)
+
+    results = _analyze_all(batcher, [(('bad',), {}), (('good',), {})])
+    assert isinstance(results[0], ValueError) and results[1] == 'GOOD'
+
+
+def test_error_of_the_batch_fails_every_text():
+    batcher = MicroBatcher(RecordingPipeline(error=ConnectionError('down')), max_batch_size=2, max_wait_ms=10)
+
+    results = _analyze_all(batcher, [(('a',), {}), (('b',), {})])
+    assert all(isinstance(result, ConnectionError) for result in results)
+
+
+def test_batch_runs_outside_of_the_context_of_a_message():
+    pipeline = RecordingPipeline()
+    batcher = MicroBatcher(pipeline, max_batch_size=1, max_wait_ms=10)
+
+    async def main():
+        MESSAGE.set('first message')
+        return await batcher.analyze('a')
+
+    assert asyncio.run(main()) == 'A'
+    assert pipeline.calls[0]['message'] is None
+
+
+def test_texts_of_a_batch_get_their_own_results():
+    pipeline = AnalysisPipeline(api_key='...', llm_model='fake', llm_host='http://localhost', llm=fake_llm())
+    batcher = MicroBatcher(pipeline, max_batch_size=3, max_wait_ms=10)
+    try:
+        results = _analyze_all(batcher, [((SAMPLE_SRT, 'split', ('analyze', 'grammar')), {})] * 3)
+    finally:
+        pipeline.close()
+    assert results == [{**CANNED_RESULTS['analyze'], **CANNED_RESULTS['grammar']}] * 3
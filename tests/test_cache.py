@@ -0,0 +1,114 @@
+import types
+import asyncio
+
+import pytest
+from langchain_core.runnables import RunnableLambda
+
+from cache import MemoryCache, SQLiteCache, create_cache, make_key, normalize_text
+from llm import AnalysisPipeline
+from samples import CANNED_RESULTS, SAMPLE_SRT, canned_response
+
+
+@pytest.fixture(params=['memory', 'sqlite'])
+def make_cache(request, tmp_path):
+    def make(**options):
+        if request.param == 'memory':
+            return MemoryCache(**options)
+        return SQLiteCache(str(tmp_path / 'cache.db'), **options)
+    return make
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    """
+    Replaces the wall clock of the cache module with one advanced by hand.
+    """
+    now = [1000.0]
+    monkeypatch.setattr('cache.time', types.SimpleNamespace(time=lambda: now[0]))
+    return now
+
+
+def test_key_ignores_insignificant_differences():
+    assert normalize_text('Hà  Nội\n\tnews ') == 'Hà Nội news'
+    assert make_key('analyze', normalize_text('a  b')) == make_key('analyze', normalize_text('a b'))
+    assert make_key('a', 'bc') != make_key('ab', 'c')
+
+
+def test_get_returns_the_stored_value_and_counts(make_cache):
+    cache = make_cache()
+    assert cache.get('key') is None
+    cache.set('key', {'summary': 'text', 'tags': ['a']})
+
+    assert cache.get('key') == {'summary': 'text', 'tags': ['a']}
+    assert cache.stats() == {'hits': 1, 'misses': 1, 'hit_ratio': 0.5}
+
+
+def test_expired_entries_are_missing(make_cache, clock):
+    cache = make_cache(ttl=10)
+    cache.set('key', 'value')
+
+    clock[0] += 9
+    assert cache.get('key') == 'value'
+    clock[0] += 2
+    assert cache.get('key') is None
+
+
+def test_least_recently_used_entry_is_evicted(make_cache, clock):
+    cache = make_cache(max_entries=2)
+    for key in ('a', 'b'):
+        cache.set(key, key)
+        clock[0] += 1
+    assert cache.get('a') == 'a'
+    clock[0] += 1
+
+    cache.set('c', 'c')
+    assert cache.get('b') is None
+    assert cache.get('a') == 'a'
+    assert cache.get('c') == 'c'
+
+
+def test_async_methods_share_the_entries_and_counters(make_cache):
+    cache = make_cache()
+
+    async def main():
+        await asyncio.gather(*(cache.aset(f'key-{index}', index) for index in range(4)))
+        return await asyncio.gather(*(cache.aget(f'key-{index}') for index in range(8)))
+
+    assert asyncio.run(main()) == [0, 1, 2, 3, None, None, None, None]
+    assert cache.stats()['hits'] == 4 and cache.stats()['misses'] == 4
+
+
+def test_sqlite_entries_survive_a_restart(tmp_path):
+    path = str(tmp_path / 'cache.db')
+    SQLiteCache(path, table='analyze').set('key', [1, 2])
+
+    assert SQLiteCache(path, table='analyze').get('key') == [1, 2]
+    assert SQLiteCache(path, table='stt').get('key') is None
+
+
+def test_create_cache_selects_the_backend(tmp_path):
+    assert create_cache('none', 'analyze') is None
+    assert isinstance(create_cache('memory', 'analyze'), MemoryCache)
+    assert isinstance(create_cache('sqlite', 'analyze', path=str(tmp_path / 'cache.db')), SQLiteCache)
+    with pytest.raises(ValueError):
+        create_cache('redis', 'analyze')
+
+
+def test_analyses_are_served_from_the_cache():
+    prompts = []
+
+    def answer(prompt_value):
+        prompts.append(prompt_value)
+        return canned_response(prompt_value.to_string())
+
+    cache = MemoryCache()
+    pipeline = AnalysisPipeline(api_key='...', llm_model='fake', llm_host='http://localhost',
+                                llm=RunnableLambda(answer), cache=cache)
+    try:
+        first = pipeline.analyze(SAMPLE_SRT, mode='split', tasks=('analyze',))
+        second = asyncio.run(pipeline.aanalyze(SAMPLE_SRT + '\n', mode='split', tasks=('analyze',)))
+    finally:
+        pipeline.close()
+    assert first == second == CANNED_RESULTS['analyze']
+    assert len(prompts) == 1
+    assert cache.stats()['hits'] == 1
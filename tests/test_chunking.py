@@ -0,0 +1,93 @@
+from chunking import (
+    is_srt, split_cues, split_srt, split_paragraphs, split_text, merge_segments,
+    merge_grammar_errors, merge_news_info
+)
+from samples import SAMPLE_SRT
+
+STANDARD_SRT = """1
+00:00:01,000 --> 00:00:04,000
+First line of the first cue
+second line of the first cue
+
+2
+00:00:05,000 --> 00:00:08,000
+12
+
+3
+00:00:09,000 --> 00:00:12,000
+Last cue
+"""
+
+
+def test_is_srt_accepts_both_subtitle_forms():
+    assert is_srt(SAMPLE_SRT)
+    assert is_srt(STANDARD_SRT)
+    assert not is_srt('12 people attended.\nThe meeting lasted two hours.')
+    assert not is_srt('')
+
+
+def test_split_cues_keeps_the_text_lines_with_their_cue():
+    cues = split_cues(STANDARD_SRT)
+
+    assert cues == [
+        '1\n00:00:01,000 --> 00:00:04,000\nFirst line of the first cue\nsecond line of the first cue',
+        '2\n00:00:05,000 --> 00:00:08,000\n12',
+        '3\n00:00:09,000 --> 00:00:12,000\nLast cue'
+    ]
+    assert len(split_cues(SAMPLE_SRT)) == len(SAMPLE_SRT.strip().splitlines())
+
+
+def test_split_srt_packs_whole_cues_within_the_budget():
+    count_words = lambda text: len(text.split())
+    chunks = split_srt(SAMPLE_SRT, max_tokens=60, count_tokens=count_words)
+
+    assert len(chunks) > 1
+    assert '\n'.join(chunks) == '\n'.join(split_cues(SAMPLE_SRT))
+    assert all(count_words(chunk) <= 60 or len(split_cues(chunk)) == 1 for chunk in chunks)
+
+
+def test_split_paragraphs_falls_back_to_sentences_and_words():
+    text = 'Short paragraph.\n\n' + 'One sentence here. ' * 20 + '\n\n' + 'word ' * 200
+    count_words = lambda text: len(text.split())
+    chunks = split_paragraphs(text, max_tokens=50, count_tokens=count_words)
+
+    assert chunks[0].startswith('Short paragraph.')
+    assert all(count_words(chunk) <= 50 for chunk in chunks)
+    assert ' '.join(' '.join(chunks).split()) == ' '.join(text.split())
+
+
+def test_split_text_picks_the_splitter_of_the_format():
+    assert split_text(STANDARD_SRT, max_tokens=10) == split_cues(STANDARD_SRT)
+    assert split_text('a\n\nb', max_tokens=10) == ['a\n\nb']
+
+
+def test_merge_segments_orders_by_start():
+    merged = merge_segments([
+        {'segments': [{'start': '00:01:00', 'content': 'b'}]},
+        {'segments': [{'start': '00:00:05', 'content': 'a'}, {'start': None, 'content': 'c'}]}
+    ])
+    assert [segment['content'] for segment in merged['segments']] == ['a', 'b', 'c']
+
+
+def test_merge_grammar_errors_drops_repeated_corrections():
+    error = {'wrong_word': 'teh', 'alter_word': 'the'}
+    merged = merge_grammar_errors([{'grammar_errors': [error]}, {'grammar_errors': [dict(error)]}, {}])
+    assert merged == {'grammar_errors': [error]}
+
+
+def test_merge_news_info_keeps_the_reduced_summary():
+    merged = merge_news_info(
+        [
+            {'keywords': ['Vote', 'law'], 'tags': ['politics'], 'spelling': {'a': 'b'}, 'personage': ['X']},
+            {'keywords': ['vote', 'city'], 'tags': ['Politics'], 'spelling': {'c': 'd'}, 'personage': ['X', 'Y']}
+        ],
+        {'summary': 'overall', 'title': 'title'}
+    )
+    assert merged == {
+        'summary': 'overall',
+        'title': 'title',
+        'keywords': ['Vote', 'law', 'city'],
+        'tags': ['politics'],
+        'spelling': {'a': 'b', 'c': 'd'},
+        'personage': ['X', 'Y']
+    }
@@ -0,0 +1,81 @@
+from chunking import is_srt
+from compaction import Compactor, compact_plain, compact_srt, normalize_whitespace, parse_srt
+from samples import SAMPLE_SRT, raw_text
+
+STANDARD_SRT = """1
+00:00:01,000 --> 00:00:03,000
+Hello and
+
+2
+00:00:03,000 --> 00:00:05,000
+welcome.
+
+3
+00:00:05,000 --> 00:00:07,000
+Welcome.
+
+4
+00:00:07,000 --> 00:00:09,000
+Today we talk
+about the news!
+"""
+
+
+def test_parse_srt_reads_every_cue():
+    assert parse_srt(STANDARD_SRT) == [
+        ('00:00:01', '00:00:03', 'Hello and'),
+        ('00:00:03', '00:00:05', 'welcome.'),
+        ('00:00:05', '00:00:07', 'Welcome.'),
+        ('00:00:07', '00:00:09', 'Today we talk about the news!')
+    ]
+    assert len(parse_srt(SAMPLE_SRT)) == len(SAMPLE_SRT.strip().splitlines())
+
+
+def test_transcript_drops_timestamps_and_repeats():
+    assert compact_srt(STANDARD_SRT, keep_index=False) == 'Hello and welcome. Today we talk about the news!'
+    assert compact_srt(SAMPLE_SRT, keep_index=False) == raw_text(SAMPLE_SRT).strip()
+
+
+def test_index_keeps_one_range_per_sentence():
+    compacted = compact_srt(STANDARD_SRT, keep_index=True)
+
+    assert compacted == (
+        '00:00:01 --> 00:00:07 Hello and welcome.\n'
+        '00:00:07 --> 00:00:09 Today we talk about the news!'
+    )
+    assert is_srt(compacted)
+
+
+def test_index_closes_long_lines_without_sentence_end():
+    text = '\n'.join(f'00:00:{second:02d} --> 00:00:{second + 1:02d} word{second}' for second in range(20))
+    lines = compact_srt(text, keep_index=True, index_chars=30).split('\n')
+
+    assert len(lines) > 1
+    assert lines[0].startswith('00:00:00 --> ')
+
+
+def test_plain_text_loses_boilerplate_and_repeated_lines():
+    text = 'Title  of\tthe article\n\n\n\nFirst paragraph.\nAdvertisement\nFirst paragraph.\n\nTags:\nLast one.'
+    assert compact_plain(text) == 'Title of the article\n\nFirst paragraph.\n\nLast one.'
+
+
+def test_normalize_whitespace():
+    assert normalize_whitespace('  a \t b \n\n\n c  ') == 'a b\n\nc'
+
+
+def test_compactor_keeps_the_index_for_the_segmentation_only():
+    compactor = Compactor(count_tokens=len)
+
+    assert compactor.compact('segment', STANDARD_SRT) == compact_srt(STANDARD_SRT, keep_index=True)
+    assert compactor.compact('analyze', STANDARD_SRT) == compact_srt(STANDARD_SRT, keep_index=False)
+    assert compactor.compact('analyze', 'a\n\n\nb\nb') == 'a\n\nb'
+
+
+def test_combined_request_keeps_the_index_only_when_it_covers_the_segmentation():
+    compactor = Compactor(count_tokens=len)
+
+    indexed = compactor.compact('combined', STANDARD_SRT, tasks=('segment', 'grammar'))
+    plain = compactor.compact('combined', STANDARD_SRT, tasks=('analyze', 'grammar'))
+
+    assert indexed == compact_srt(STANDARD_SRT, keep_index=True)
+    assert plain == compact_srt(STANDARD_SRT, keep_index=False)
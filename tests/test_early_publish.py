@@ -0,0 +1,99 @@
+import types
+import asyncio
+
+import pytest
+
+from constant import PRODUCE_TOPIC
+from kafka_helper import serializer
+from metrics import AnalysisMetrics
+from samples import CANNED_RESULTS, SAMPLE_SRT
+from stubs import InMemoryBroker
+from workers import Stage, StagePipeline, analyze, decode, serialize, sink
+
+MESSAGE = {'Id': 7, 'RefId': 8, 'Metadata': {}}
+
+
+@pytest.fixture
+def broker(monkeypatch):
+    broker = InMemoryBroker()
+    monkeypatch.setattr('kafka_helper.producer', broker.producer())
+    monkeypatch.setattr('workers.ANALYSIS_TASKS', {'audio': ('analyze', 'grammar')})
+    monkeypatch.setattr('workers.STREAM_SEGMENTS', {'audio': False})
+    return broker
+
+
+class FlakyBatcher:
+    """
+    Stand-in of MicroBatcher answering the canned results, failing the grammar check on its first `failures` calls.
+    """
+    def __init__(self, failures: int):
+        self.failures = failures
+        self.calls = []
+
+    async def analyze(self, text, mode, tasks, metadata=None):
+        self.calls.append(tasks)
+        if 'grammar' in tasks and self.failures:
+            self.failures -= 1
+            raise ConnectionError('reset')
+        result = {}
+        for task in tasks:
+            result.update(CANNED_RESULTS[task])
+        return result
+
+
+async def transcribe(pipeline, job):
+    job.text = job.subtitle = SAMPLE_SRT
+
+
+def _process(broker: InMemoryBroker, batcher: FlakyBatcher, analyze_retries: int) -> tuple:
+    resources = types.SimpleNamespace(profiler=None, analyze_batcher=batcher, analysis_metrics=AnalysisMetrics(),
+                                      analyze_chain=types.SimpleNamespace(compactor=None))
+    stages = [Stage('decode', decode), Stage('transcribe', transcribe),
+              Stage('analyze', analyze, retries=analyze_retries, backoff=0), Stage('serialize', serialize),
+              Stage('sink', sink)]
+    pipeline = StagePipeline('audio', stages, resources, dead_letter_topic='dead-letter', early_publish=True)
+    record = broker.send('audio', serializer.dumps(MESSAGE), key=b'7')
+    status = asyncio.run(pipeline.process(record))
+    return status, [(record.key, serializer.loads(record.value)) for record in broker.records(PRODUCE_TOPIC['audio'])]
+
+
+def test_preliminary_result_is_superseded_by_the_final_one(broker):
+    status, results = _process(broker, FlakyBatcher(failures=0), analyze_retries=0)
+
+    assert status is None
+    assert [(key, result['Version']) for key, result in results] == [(b'7', 1), (b'7', 2)]
+    assert 'GrammarErrors' not in results[0][1]['Metadata']
+    assert 'GrammarErrors' in results[1][1]['Metadata']
+    assert 'Failed' not in results[1][1]
+
+
+def test_retry_does_not_republish_the_preliminary_result(broker):
+    batcher = FlakyBatcher(failures=1)
+
+    status, results = _process(broker, batcher, analyze_retries=1)
+
+    assert status is None
+    assert [result['Version'] for _, result in results] == [1, 2]
+    assert batcher.calls.count(('analyze',)) == 1
+    assert batcher.calls.count(('grammar',)) == 2
+
+
+def test_dead_lettered_message_gets_a_failed_final_result(broker):
+    status, results = _process(broker, FlakyBatcher(failures=2), analyze_retries=1)
+
+    assert status == 'dead_lettered'
+    assert len(broker.records('dead-letter')) == 1
+    [(_, preliminary), (key, final)] = results
+    assert (preliminary['Version'], final['Version'], final['Failed'], key) == (1, 2, True, b'7')
+    assert final['Metadata'] == preliminary['Metadata']
+
+
+def test_message_failing_before_the_preliminary_result_gets_no_result(broker):
+    class FailingBatcher(FlakyBatcher):
+        async def analyze(self, text, mode, tasks, metadata=None):
+            raise ConnectionError('reset')
+
+    status, results = _process(broker, FailingBatcher(failures=0), analyze_retries=0)
+
+    assert status == 'dead_lettered'
+    assert results == []
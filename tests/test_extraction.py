@@ -0,0 +1,44 @@
+import re
+import time
+import asyncio
+
+import pytest
+
+from extraction import ExtractionError, HtmlExtractor, is_html
+
+
+def strip_tags(html: str, language: str) -> str:
+    """
+    Extraction of the tests, run in the extraction processes; hangs on the pages asking for it.
+    """
+    if 'hang' in html:
+        time.sleep(60)
+    return re.sub(r'<[^>]+>', ' ', html).strip()
+
+
+def test_plain_text_skips_the_extraction():
+    extractor = HtmlExtractor(max_workers=0)
+    assert not is_html('1 < 2 and 3 > 2')
+    assert asyncio.run(extractor.extract('  Plain text.\n')) == 'Plain text.'
+
+
+def test_hanging_extraction_does_not_hold_the_pool():
+    extractor = HtmlExtractor(max_workers=1, timeout=3.0, function=strip_tags)
+
+    async def main():
+        hung = extractor._executor
+        with pytest.raises(ExtractionError):
+            await extractor.extract('<p>hang</p>')
+        processes = list(hung._processes.values())
+        text = await extractor.extract('<p>next document</p>')
+        await asyncio.gather(*extractor._retiring)
+        return text, processes
+
+    try:
+        text, processes = asyncio.run(main())
+    finally:
+        extractor.close()
+    assert text == 'next document'
+    for process in processes:
+        process.join(5)
+        assert not process.is_alive()
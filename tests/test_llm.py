@@ -0,0 +1,76 @@
+import pytest
+from langchain_core.runnables import RunnableLambda
+
+from common import fake_llm
+from compaction import Compactor
+from llm import AnalysisPipeline, repair_json
+from samples import CANNED_RESULTS, SAMPLE_SRT, canned_response
+
+
+def _pipeline(llm=None, **options) -> AnalysisPipeline:
+    return AnalysisPipeline(api_key='...', llm_model='fake', llm_host='http://localhost', llm=llm or fake_llm(),
+                            **options)
+
+
+def test_repair_json_strips_fences_and_trailing_commas():
+    answer = 'Here is the result:\n```json\n{"title": "News", "tags": ["a", "b",],}\n```'
+    assert repair_json(answer) == {'title': 'News', 'tags': ['a', 'b']}
+
+
+def test_repair_json_raises_without_object():
+    with pytest.raises(ValueError):
+        repair_json('no JSON here')
+
+
+def test_malformed_answer_is_repaired_locally():
+    def answer(prompt_value):
+        return f'```json\n{canned_response(prompt_value.to_string())[:-1]},}}\n```'
+
+    pipeline = _pipeline(llm=RunnableLambda(answer))
+    try:
+        result = pipeline.analyze(SAMPLE_SRT, mode='split', tasks=('grammar',))
+    finally:
+        pipeline.close()
+    assert result == CANNED_RESULTS['grammar']
+
+
+def test_combined_answer_keeps_the_keys_of_the_selected_tasks():
+    pipeline = _pipeline()
+    try:
+        full = pipeline.analyze(SAMPLE_SRT, mode='combined')
+        subset = pipeline.analyze(SAMPLE_SRT, mode='combined', tasks=('segment', 'grammar'))
+    finally:
+        pipeline.close()
+    assert full == CANNED_RESULTS['combined']
+    assert subset == {**CANNED_RESULTS['segment'], **CANNED_RESULTS['grammar']}
+
+
+def test_combined_answer_fills_the_omitted_lists():
+    normalized = AnalysisPipeline._normalize_combined({'title': 'News', 'summary': 'Text'}, ('analyze', 'grammar'))
+    assert normalized == {'title': 'News', 'summary': 'Text', 'grammar_errors': []}
+
+
+def test_split_analysis_runs_the_selected_tasks():
+    pipeline = _pipeline()
+    try:
+        result = pipeline.analyze(SAMPLE_SRT, mode='split', tasks=('analyze', 'grammar'))
+    finally:
+        pipeline.close()
+    assert result == {**CANNED_RESULTS['analyze'], **CANNED_RESULTS['grammar']}
+
+
+def test_combined_prompt_keeps_the_timestamps_only_for_the_segmentation():
+    prompts = []
+
+    def answer(prompt_value):
+        prompts.append(prompt_value.to_string())
+        return canned_response(prompts[-1])
+
+    pipeline = _pipeline(llm=RunnableLambda(answer), compactor=Compactor(count_tokens=len))
+    try:
+        pipeline.analyze(SAMPLE_SRT, mode='combined', tasks=('analyze', 'grammar'))
+        pipeline.analyze(SAMPLE_SRT, mode='combined', tasks=('segment', 'grammar'))
+    finally:
+        pipeline.close()
+    assert '00:00:01 -->' not in prompts[0]
+    assert '00:00:01 -->' in prompts[1]
@@ -0,0 +1,139 @@
+from uuid import uuid4
+
+import pytest
+from langchain_core.messages import AIMessage
+from langchain_core.outputs import ChatGeneration, LLMResult
+
+import metrics
+from metrics import AnalysisMetrics, Counter, Gauge, Histogram, Registry
+
+
+def llm_result(prompt_tokens: int, completion_tokens: int) -> LLMResult:
+    return LLMResult(generations=[[ChatGeneration(message=AIMessage(content='{}'))]],
+                     llm_output={'token_usage': {'prompt_tokens': prompt_tokens,
+                                                 'completion_tokens': completion_tokens}})
+
+
+def request(handler: AnalysisMetrics, trace_id: str):
+    run_id = uuid4()
+    handler.on_chat_model_start({}, [[]], run_id=run_id, metadata={'trace_id': trace_id})
+    return run_id
+
+
+def test_counter_and_gauge_render_one_sample_per_label_values():
+    registry = Registry()
+    counter = registry.register(Counter('messages_total', 'Messages.', ('topic',)))
+    gauge = registry.register(Gauge('depth', 'Depth.', ('topic',)))
+
+    counter.inc(topic='audio')
+    counter.inc(2, topic='audio')
+    counter.inc(topic='video')
+    gauge.set(5, topic='audio')
+    gauge.set(3, topic='audio')
+
+    assert registry.render().splitlines() == [
+        '# HELP messages_total Messages.',
+        '# TYPE messages_total counter',
+        'messages_total{topic="audio"} 3',
+        'messages_total{topic="video"} 1',
+        '# HELP depth Depth.',
+        '# TYPE depth gauge',
+        'depth{topic="audio"} 3',
+    ]
+
+
+def test_histogram_buckets_are_cumulative():
+    histogram = Histogram('latency', 'Latency.', ('stage',), buckets=(1, 5))
+
+    for value in (0.5, 3, 10):
+        histogram.observe(value, stage='decode')
+
+    assert histogram.render()[2:] == [
+        'latency_bucket{stage="decode",le="1"} 1',
+        'latency_bucket{stage="decode",le="5"} 2',
+        'latency_bucket{stage="decode",le="+Inf"} 3',
+        'latency_sum{stage="decode"} 13.5',
+        'latency_count{stage="decode"} 3',
+    ]
+
+
+def test_histogram_times_a_block_that_raises():
+    histogram = Histogram('latency', 'Latency.', ('stage',))
+
+    with pytest.raises(RuntimeError):
+        with histogram.time(stage='sink'):
+            raise RuntimeError
+
+    assert 'latency_count{stage="sink"} 1' in histogram.render()
+
+
+def test_label_values_are_escaped_and_checked():
+    counter = Counter('messages_total', 'Messages.', ('topic',))
+    counter.inc(topic='a"b\\c\nd')
+
+    assert counter.render()[2] == 'messages_total{topic="a\\"b\\\\c\\nd"} 1'
+    with pytest.raises(ValueError):
+        counter.inc(status='ok')
+
+
+def test_usage_is_added_up_per_message():
+    handler = AnalysisMetrics()
+
+    for trace_id, prompt_tokens in (('a', 100), ('a', 50), ('b', 10)):
+        handler.on_llm_end(llm_result(prompt_tokens, 5), run_id=request(handler, trace_id), tags=['segment'])
+
+    assert handler.pop_usage('a') == {'prompt': 150, 'completion': 10}
+    assert handler.pop_usage('a') == {'prompt': 0, 'completion': 0}
+    assert handler.pop_usage('b') == {'prompt': 10, 'completion': 5}
+
+
+def test_request_ending_after_the_usage_is_collected_is_dropped():
+    handler = AnalysisMetrics()
+    run_id = request(handler, 'a')
+
+    assert handler.pop_usage('a') == {'prompt': 0, 'completion': 0}
+    handler.on_llm_end(llm_result(100, 5), run_id=run_id, tags=['grammar'])
+
+    assert handler._usage == {}
+    # A retry of the message starts new requests, which are counted again
+    handler.on_llm_end(llm_result(20, 1), run_id=request(handler, 'a'), tags=['grammar'])
+    assert handler.pop_usage('a') == {'prompt': 20, 'completion': 1}
+
+
+def test_usage_nobody_collects_expires(monkeypatch):
+    handler = AnalysisMetrics(usage_ttl=10)
+    now = [1000.0]
+    monkeypatch.setattr(metrics.time, 'monotonic', lambda: now[0])
+
+    handler.on_llm_end(llm_result(100, 5), run_id=request(handler, 'abandoned'), tags=['analyze'])
+    now[0] += 5
+    handler.on_llm_end(llm_result(10, 1), run_id=request(handler, 'kept'), tags=['analyze'])
+    now[0] += 6
+    handler.on_llm_end(llm_result(10, 1), run_id=request(handler, 'kept'), tags=['analyze'])
+
+    assert list(handler._usage) == ['kept']
+    assert handler.pop_usage('kept') == {'prompt': 20, 'completion': 2}
+
+
+def test_failed_request_is_not_counted():
+    handler = AnalysisMetrics()
+    run_id = request(handler, 'a')
+
+    handler.on_llm_error(RuntimeError(), run_id=run_id)
+    handler.on_llm_end(llm_result(100, 5), run_id=run_id, tags=['analyze'])
+
+    assert handler.pop_usage('a') == {'prompt': 0, 'completion': 0}
+
+
+def test_top_level_chain_of_a_task_is_timed():
+    handler = AnalysisMetrics()
+    before = dict(metrics.ANALYSIS_SECONDS._values)
+    run_id = uuid4()
+
+    handler.on_chain_start({}, {}, run_id=run_id, tags=['combined'])
+    handler.on_chain_start({}, {}, run_id=uuid4(), parent_run_id=run_id, tags=['combined'])
+    handler.on_chain_end({}, run_id=run_id)
+
+    key = ('combined', 'success')
+    observed = metrics.ANALYSIS_SECONDS._values[key][2] - before.get(key, ((), 0.0, 0))[2]
+    assert observed == 1
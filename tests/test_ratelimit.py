@@ -0,0 +1,100 @@
+import asyncio
+
+import pytest
+
+from ratelimit import AdaptiveConcurrency, LlmLimiter, TokenBucket
+
+
+def test_token_bucket_bursts_then_spaces_the_reservations():
+    bucket = TokenBucket(rate=10, capacity=2)
+
+    assert bucket.reserve() == 0.0
+    assert bucket.reserve() == 0.0
+    assert bucket.reserve() == pytest.approx(0.1, abs=0.01)
+    assert bucket.reserve() == pytest.approx(0.2, abs=0.01)
+
+
+def test_token_bucket_without_rate_never_waits():
+    assert TokenBucket(rate=0).reserve(1000) == 0.0
+
+
+def _complete(concurrency: AdaptiveConcurrency, latency: float = None, error: bool = False):
+    concurrency.acquire()
+    concurrency.release(latency, error)
+
+
+def test_limit_grows_in_slow_start_and_halves_on_error():
+    concurrency = AdaptiveConcurrency(minimum=1, maximum=8, latency_tolerance=0)
+    for _ in range(5):
+        _complete(concurrency, latency=0.001)
+    assert int(concurrency.limit) == 6
+
+    _complete(concurrency, error=True)
+    assert int(concurrency.limit) == 3
+
+    # Past slow start the limit grows by one per window of requests
+    _complete(concurrency, latency=0.001)
+    assert concurrency.limit == pytest.approx(3 + 1 / 3)
+
+
+def test_limit_stays_within_its_bounds():
+    concurrency = AdaptiveConcurrency(minimum=2, maximum=4, latency_tolerance=0)
+    for _ in range(10):
+        _complete(concurrency, latency=0.001)
+    assert concurrency.limit == 4
+
+    _complete(concurrency, error=True)
+    assert concurrency.limit == 2
+    _complete(concurrency, error=True)
+    assert concurrency.limit == 2
+
+
+def test_rising_latency_backs_off():
+    concurrency = AdaptiveConcurrency(minimum=1, maximum=32, latency_tolerance=2.0)
+    for _ in range(4):
+        _complete(concurrency, latency=0.01)
+    limit = concurrency.limit
+
+    _complete(concurrency, latency=1.0)
+    assert concurrency.limit == limit / 2
+
+
+def test_cancelled_request_leaves_the_limit_unchanged():
+    limiter = LlmLimiter(min_concurrency=1, max_concurrency=8)
+    limiter.acquire(100)
+    limiter.release(200, latency=0.001)
+    limit = limiter.concurrency.limit
+
+    limiter.acquire(100)
+    limiter.release(cancelled=True)
+    assert limiter.concurrency.limit == limit
+    assert limiter.concurrency.in_flight == 0
+
+
+def test_throttling_status_backs_off():
+    limiter = LlmLimiter(min_concurrency=1, max_concurrency=8, latency_tolerance=0)
+    for _ in range(3):
+        limiter.acquire(100)
+        limiter.release(200, latency=0.001)
+    assert int(limiter.concurrency.limit) == 4
+
+    limiter.acquire(100)
+    limiter.release(429, latency=0.001)
+    assert int(limiter.concurrency.limit) == 2
+
+
+def test_coroutines_wait_for_a_free_slot():
+    concurrency = AdaptiveConcurrency(minimum=1, maximum=1)
+
+    async def main():
+        await concurrency.aacquire()
+        waiting = asyncio.create_task(concurrency.aacquire())
+        await asyncio.sleep(0.01)
+        assert not waiting.done()
+
+        concurrency.release()
+        await asyncio.wait_for(waiting, 1)
+        assert concurrency.in_flight == 1
+        concurrency.release()
+
+    asyncio.run(main())
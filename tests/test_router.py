@@ -0,0 +1,93 @@
+import time
+import asyncio
+
+import httpx
+import openai
+import pytest
+
+from router import LlmRouter
+
+
+def _connection_error():
+    return openai.APIConnectionError(request=httpx.Request('POST', 'http://llm/v1/chat/completions'))
+
+
+def _fail(router: LlmRouter, endpoint, times: int):
+    # Counts `times` failed requests on `endpoint`, whichever endpoint the balancing would pick
+    for _ in range(times):
+        endpoint.outstanding += 1
+        router._release(endpoint, False, error=True)
+
+
+def test_request_fails_over_to_another_endpoint():
+    router = LlmRouter(['http://llm-0/v1', 'http://llm-1/v1'], 'test-model', max_attempts=2)
+    calls = []
+
+    async def send(chat_model):
+        calls.append(chat_model.openai_api_base)
+        if chat_model.openai_api_base == 'http://llm-0/v1':
+            raise _connection_error()
+        return 'answer'
+
+    for _ in range(5):
+        assert asyncio.run(router.acall('analyze', send)) == 'answer'
+    assert calls.count('http://llm-1/v1') == 5
+    assert all(endpoint.outstanding == 0 for endpoint in router.endpoints)
+
+
+def test_last_failure_is_raised():
+    router = LlmRouter(['http://llm-0/v1'], 'test-model', max_attempts=1)
+
+    async def send(chat_model):
+        raise _connection_error()
+
+    with pytest.raises(openai.APIConnectionError):
+        asyncio.run(router.acall('analyze', send))
+    assert router.endpoints[0].failures == 1
+
+
+def test_circuit_opens_after_consecutive_failures():
+    router = LlmRouter(['http://llm-0/v1', 'http://llm-1/v1'], 'test-model', failure_threshold=2, cooldown=60)
+    failing, healthy = router.endpoints
+
+    _fail(router, failing, 1)
+    assert failing.opened_at is None
+    _fail(router, failing, 1)
+    assert failing.opened_at is not None
+
+    for _ in range(10):
+        endpoint, trial = router._acquire([])
+        assert endpoint is healthy and not trial
+        router._release(endpoint, trial, latency=0.01)
+
+
+def test_one_trial_request_closes_the_circuit_after_the_cooldown():
+    router = LlmRouter(['http://llm-0/v1'], 'test-model', failure_threshold=1, cooldown=0.05)
+    endpoint = router.endpoints[0]
+    _fail(router, endpoint, 1)
+    assert not endpoint.available(time.monotonic(), router.cooldown)
+
+    time.sleep(0.06)
+    _, trial = router._acquire([])
+    assert trial and endpoint.trial
+    # Requests sent while the trial runs do not release the trial, even when they fail
+    _, other = router._acquire([])
+    assert not other
+    router._release(endpoint, other, error=True)
+    assert endpoint.trial
+
+    router._release(endpoint, trial, latency=0.01)
+    assert endpoint.opened_at is None and endpoint.failures == 0 and not endpoint.trial
+
+
+def test_failed_trial_reopens_the_circuit():
+    router = LlmRouter(['http://llm-0/v1'], 'test-model', failure_threshold=1, cooldown=0.05)
+    endpoint = router.endpoints[0]
+    _fail(router, endpoint, 1)
+    opened_at = endpoint.opened_at
+
+    time.sleep(0.06)
+    _, trial = router._acquire([])
+    router._release(endpoint, trial, error=True)
+    assert endpoint.opened_at > opened_at
+    assert not endpoint.available(time.monotonic(), router.cooldown)
@@ -0,0 +1,167 @@
+import asyncio
+
+from kafka.structs import TopicPartition
+
+from runtime import OffsetTracker, TopicPool
+from stubs import InMemoryBroker
+
+TP = TopicPartition('audio', 0)
+
+
+def test_watermark_follows_the_completed_prefix():
+    tracker = OffsetTracker()
+    for offset in range(4):
+        tracker.add(TP, offset)
+
+    tracker.done(TP, 1)
+    assert tracker.watermarks() == {}
+    tracker.done(TP, 0)
+    assert tracker.watermarks() == {TP: 2}
+    assert tracker.watermarks() == {}
+    tracker.done(TP, 3)
+    tracker.done(TP, 2)
+    assert tracker.watermarks() == {TP: 4}
+    assert tracker.pending() == 0
+
+
+def test_release_returns_the_watermark_and_forgets_the_partition():
+    tracker = OffsetTracker()
+    tracker.add(TP, 0)
+    tracker.add(TP, 1)
+    tracker.done(TP, 0)
+
+    assert tracker.release([TP]) == {TP: 1}
+    assert tracker.pending() == 0
+    assert tracker.watermarks() == {}
+
+
+def test_rewind_forgets_the_records_to_consume_again():
+    tracker = OffsetTracker()
+    tokens = [tracker.add(TP, offset) for offset in range(4)]
+    tracker.done(TP, 3)
+
+    tracker.rewind(TP, 2)
+    assert tracker.pending() == 2
+    assert tracker.registered(TP, 1, tokens[1])
+    assert not tracker.registered(TP, 2, tokens[2])
+
+    replayed = tracker.add(TP, 2)
+    assert not tracker.registered(TP, 2, tokens[2]) and tracker.registered(TP, 2, replayed)
+    for offset in range(3):
+        tracker.done(TP, offset)
+    assert tracker.watermarks() == {TP: 3}
+
+
+async def _consume(broker: InMemoryBroker, handler, expected: int, **options) -> list:
+    """
+    Runs a pool on the 'audio' topic of `broker` until `expected` records were handled, then stops it.
+
+    Returns:
+        list: The (partition, offset) of the handled records, in completion order.
+    """
+    handled = []
+
+    async def counted(message):
+        try:
+            return await handler(message)
+        finally:
+            handled.append((message.partition, message.offset))
+
+    pool = TopicPool(lambda listener: broker.consumer('audio', listener), counted, poll_timeout_ms=20,
+                     commit_interval=0, **{'concurrency': 2, 'queue_size': 4, **options})
+    task = asyncio.create_task(pool.run())
+    try:
+        await asyncio.wait_for(_handled(handled, expected), 10)
+    finally:
+        task.cancel()
+        await asyncio.gather(task, return_exceptions=True)
+    return handled
+
+
+async def _handled(handled: list, expected: int):
+    while len(handled) < expected:
+        await asyncio.sleep(0.01)
+
+
+def test_pool_commits_every_handled_record():
+    broker = InMemoryBroker()
+    for index in range(10):
+        broker.send('audio', str(index).encode())
+
+    async def handler(message):
+        await asyncio.sleep(0.001 * (10 - message.offset))
+
+    asyncio.run(_consume(broker, handler, 10))
+    assert broker.committed('audio') == {TP: 10}
+
+
+def test_failed_record_stays_uncommitted():
+    broker = InMemoryBroker()
+    for index in range(5):
+        broker.send('audio', str(index).encode())
+
+    async def handler(message):
+        if message.offset == 2:
+            raise RuntimeError('poison')
+
+    handled = asyncio.run(_consume(broker, handler, 3, redelivery_backoff=60))
+    assert (0, 2) in handled
+    assert broker.committed('audio') == {TP: 2}
+
+
+def test_failed_record_is_consumed_again_with_the_later_ones():
+    broker = InMemoryBroker()
+    for index in range(30):
+        broker.send('audio', str(index).encode())
+    failures = []
+
+    async def handler(message):
+        if message.offset == 2 and not failures:
+            failures.append(message.offset)
+            raise RuntimeError('transient')
+
+    handled = asyncio.run(_consume(broker, handler, 31, redelivery_backoff=0.01))
+    assert {offset for _, offset in handled} == set(range(30))
+    assert handled.count((0, 2)) == 2
+    assert broker.committed('audio') == {TP: 30}
+
+
+def test_poison_record_only_blocks_its_partition():
+    broker = InMemoryBroker(partitions=2)
+    for index in range(20):
+        broker.send('audio', str(index).encode())
+
+    async def handler(message):
+        if message.partition == 0 and message.offset == 2:
+            raise RuntimeError('poison')
+
+    asyncio.run(_consume(broker, handler, 13, redelivery_backoff=60))
+    assert broker.committed('audio') == {TP: 2, TopicPartition('audio', 1): 10}
+
+
+def test_release_waits_for_the_active_records_and_drops_the_queued_ones():
+    broker = InMemoryBroker()
+    for index in range(4):
+        broker.send('audio', str(index).encode())
+    handled = []
+
+    async def main():
+        started = asyncio.Event()
+
+        async def handler(message):
+            started.set()
+            await asyncio.sleep(0.05)
+            handled.append(message.offset)
+
+        pool = TopicPool(lambda listener: broker.consumer('audio', listener), handler, concurrency=1,
+                         queue_size=4, poll_timeout_ms=20, commit_interval=60)
+        task = asyncio.create_task(pool.run())
+        await started.wait()
+        offsets = await pool.release([TP])
+        task.cancel()
+        await asyncio.gather(task, return_exceptions=True)
+        return offsets
+
+    offsets = asyncio.run(main())
+    assert handled == [0]
+    assert offsets == {TP: 1}
@@ -0,0 +1,41 @@
+import json
+
+import pytest
+
+from serialization import available_backends, create_serializer
+
+VALUE = {'Id': 1, 'Metadata': {'Title': 'Hà Nội', 'Keyword': ['bầu cử', 'quốc hội'], 'Score': 0.5, 'Empty': None}}
+
+
+@pytest.fixture(params=available_backends())
+def serializer(request):
+    return create_serializer(request.param)
+
+
+def test_round_trip(serializer):
+    data = serializer.dumps(VALUE)
+
+    assert isinstance(data, bytes)
+    assert serializer.loads(data) == VALUE
+    assert json.loads(data) == VALUE
+
+
+def test_output_is_compact_utf8(serializer):
+    assert serializer.dumps(VALUE) == json.dumps(VALUE, ensure_ascii=False, separators=(',', ':')).encode('utf-8')
+
+
+def test_fields_are_the_same_with_every_backend(serializer):
+    field = serializer.dumps_field(['bầu cử', {'a': 1}])
+
+    assert isinstance(field, str)
+    assert field == create_serializer('json').dumps_field(['bầu cử', {'a': 1}]) == '["bầu cử",{"a":1}]'
+
+
+def test_auto_picks_the_fastest_installed_backend():
+    assert create_serializer().name == available_backends()[0]
+    assert available_backends()[-1] == 'json'
+
+
+def test_unknown_backend_is_rejected():
+    with pytest.raises(ValueError):
+        create_serializer('pickle')
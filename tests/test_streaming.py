@@ -0,0 +1,94 @@
+import types
+import asyncio
+
+import pytest
+from langchain_core.runnables import RunnableLambda
+
+from cache import MemoryCache
+from constant import PRODUCE_TOPIC
+from kafka_helper import serializer
+from llm import AnalysisPipeline
+from samples import CANNED_RESULTS, SAMPLE_SRT, canned_response
+from stubs import InMemoryBroker
+from workers import Job, publish_segments
+
+SEGMENTS = CANNED_RESULTS['segment']['segments']
+DATA = {'Id': 7, 'RefId': 8, 'Metadata': {}}
+
+
+@pytest.fixture
+def broker(monkeypatch):
+    broker = InMemoryBroker()
+    monkeypatch.setattr('kafka_helper.producer', broker.producer())
+    monkeypatch.setattr('workers.STREAM_SEGMENTS', {'audio': True})
+    return broker
+
+
+class FlakyChain:
+    """
+    Stand-in of AnalysisPipeline streaming the canned segments, failing after the first one on the first call.
+    """
+    def __init__(self):
+        self.calls = 0
+
+    async def astream_segments(self, text):
+        self.calls += 1
+        for index, segment in enumerate(SEGMENTS):
+            if self.calls == 1 and index == 1:
+                raise ConnectionError('stream reset')
+            yield segment
+
+
+def _job() -> Job:
+    job = Job(None)
+    job.data, job.subtitle = DATA, SAMPLE_SRT
+    return job
+
+
+def _partials(broker: InMemoryBroker) -> list:
+    return [(record.key, serializer.loads(record.value)) for record in broker.records(PRODUCE_TOPIC['audio'])]
+
+
+def test_segments_are_published_as_partial_results(broker):
+    prompts = []
+
+    def answer(prompt_value):
+        prompts.append(prompt_value)
+        return canned_response(prompt_value.to_string())
+
+    pipeline = AnalysisPipeline(api_key='...', llm_model='fake', llm_host='http://localhost',
+                                llm=RunnableLambda(answer), cache=MemoryCache())
+    resources = types.SimpleNamespace(analyze_chain=pipeline)
+    try:
+        first = asyncio.run(publish_segments(resources, 'audio', _job()))
+        again = asyncio.run(publish_segments(resources, 'audio', _job()))
+    finally:
+        pipeline.close()
+
+    assert first == again == SEGMENTS
+    # The second transcript is segmented from the cache
+    assert len(prompts) == 1
+    partials = _partials(broker)
+    assert [value['Metadata']['Index'] for _, value in partials] == [0, 1, 0, 1]
+    assert partials[0] == (b'7', {'Id': 7, 'RefId': 8, 'Partial': True,
+                                  'Metadata': {'Index': 0, 'Segment': SEGMENTS[0]}})
+
+
+def test_retry_does_not_republish_segments(broker):
+    resources = types.SimpleNamespace(analyze_chain=FlakyChain())
+    job = _job()
+
+    with pytest.raises(ConnectionError):
+        asyncio.run(publish_segments(resources, 'audio', job))
+    assert asyncio.run(publish_segments(resources, 'audio', job)) == SEGMENTS
+
+    assert [value['Metadata']['Segment'] for _, value in _partials(broker)] == SEGMENTS
+    assert job.partials == len(SEGMENTS)
+
+
+def test_nothing_is_published_without_streaming(broker, monkeypatch):
+    monkeypatch.setattr('workers.STREAM_SEGMENTS', {'audio': False})
+    resources = types.SimpleNamespace(analyze_chain=FlakyChain())
+
+    assert asyncio.run(publish_segments(resources, 'audio', _job())) == []
+    assert _partials(broker) == [] and resources.analyze_chain.calls == 0
@@ -0,0 +1,96 @@
+import asyncio
+
+import httpx
+import pytest
+
+from cache import MemoryCache
+from samples import SAMPLE_SRT
+from stt import SttClient, SttError
+from stubs import StubSttServer
+
+
+@pytest.fixture
+def server():
+    server = StubSttServer()
+    server.url = server.start()
+    yield server
+    server.stop()
+
+
+def _transcribe(client: SttClient, *file_paths):
+    async def main():
+        try:
+            return await asyncio.gather(*(client.transcribe(file_path) for file_path in file_paths))
+        finally:
+            await client.aclose()
+    return asyncio.run(main())
+
+
+def _mocked(handler, **options) -> SttClient:
+    client = SttClient('http://stt/', backoff_base=0, **options)
+    client._client = httpx.AsyncClient(transport=httpx.MockTransport(handler))
+    return client
+
+
+def test_requests_share_keep_alive_connections(server):
+    client = SttClient(server.url, max_concurrency=2)
+
+    results = _transcribe(client, *(f'http://media/{index}.mp3' for index in range(8)))
+    assert all(result['srt'] == SAMPLE_SRT for result in results)
+    assert server.requests == 8
+    assert server.connections <= 2
+
+
+def test_transcriptions_are_cached_by_file_path(server):
+    cache = MemoryCache()
+
+    _transcribe(SttClient(server.url, cache=cache), 'http://media/a.mp3')
+    _transcribe(SttClient(server.url, cache=cache), 'http://media/a.mp3', 'http://media/b.mp3')
+    assert server.requests == 2
+
+
+def test_unsuccessful_answer_returns_none(server):
+    assert _transcribe(SttClient(server.url), '') == [None]
+
+
+def test_server_errors_are_retried():
+    statuses = [503, 502, 200]
+
+    def handler(request):
+        status = statuses.pop(0)
+        return httpx.Response(status, json={'code': 200, 'data': {'raw': 'text', 'srt': 'srt'}})
+
+    assert _transcribe(_mocked(handler, max_retries=2), 'http://media/a.mp3') == [{'raw': 'text', 'srt': 'srt'}]
+    assert statuses == []
+
+
+def test_error_is_raised_after_the_retries():
+    requests = []
+
+    def handler(request):
+        requests.append(request)
+        raise httpx.ConnectError('refused', request=request)
+
+    with pytest.raises(SttError):
+        _transcribe(_mocked(handler, max_retries=2), 'http://media/a.mp3')
+    assert len(requests) == 3
+
+
+def test_read_timeout_is_not_retried():
+    requests = []
+
+    def handler(request):
+        requests.append(request)
+        raise httpx.ReadTimeout('slow', request=request)
+
+    with pytest.raises(httpx.ReadTimeout):
+        _transcribe(_mocked(handler, max_retries=2), 'http://media/a.mp3')
+    assert len(requests) == 1
+
+
+def test_backoff_is_bounded():
+    client = SttClient('http://stt/', backoff_base=1, backoff_max=3)
+    try:
+        assert all(0 <= client._backoff(attempt) <= 3 for attempt in range(10))
+    finally:
+        asyncio.run(client.aclose())
@@ -0,0 +1,90 @@
+import os
+from types import SimpleNamespace
+
+import pytest
+
+import tokenizer
+from chunking import estimate_tokens
+from tokenizer import CHAT_OVERHEAD, TokenCounter, create_token_counter
+
+TEXT = 'Voters suggested that the delegation direct the departments of the city.'
+
+
+@pytest.fixture
+def cache_dir(tmp_path, monkeypatch):
+    monkeypatch.setenv('TIKTOKEN_CACHE_DIR', str(tmp_path))
+    return tmp_path
+
+
+@pytest.fixture
+def fake_tiktoken(monkeypatch):
+    """
+    Replaces tiktoken with an encoding of one token per word, so the cached path runs without the encoding files.
+    """
+    loaded = []
+
+    def get_encoding(name):
+        loaded.append(name)
+        return SimpleNamespace(encode_ordinary=str.split)
+
+    monkeypatch.setattr(tokenizer, 'tiktoken', SimpleNamespace(get_encoding=get_encoding))
+    return loaded
+
+
+def test_estimate_counts_four_characters_per_token():
+    counter = create_token_counter('estimate')
+
+    assert counter.name == 'estimate'
+    assert counter.count(TEXT) == counter(TEXT) == estimate_tokens(TEXT)
+
+
+def test_prompt_count_adds_the_chat_overhead():
+    counter = TokenCounter('words', str.split)
+
+    assert counter.count('a b c') == 3
+    assert counter.count_prompt('a b c') == 3 + CHAT_OVERHEAD
+
+
+def test_encoding_missing_from_the_cache_falls_back_to_the_estimate(cache_dir, fake_tiktoken):
+    counter = create_token_counter('auto')
+
+    assert counter.name == 'estimate'
+    assert counter(TEXT) == estimate_tokens(TEXT)
+    assert fake_tiktoken == []
+
+
+def test_cached_encoding_is_loaded(cache_dir, fake_tiktoken):
+    open(tokenizer._tiktoken_cache_path('cl100k_base'), 'w').close()
+
+    counter = create_token_counter('auto')
+
+    assert counter.name == 'tiktoken:cl100k_base'
+    assert counter(TEXT) == len(TEXT.split())
+    assert fake_tiktoken == ['cl100k_base']
+
+
+def test_unknown_encoding_falls_back_to_the_estimate(cache_dir, fake_tiktoken):
+    assert create_token_counter('tiktoken:unknown_base').name == 'estimate'
+
+
+def test_missing_backend_falls_back_to_the_estimate(monkeypatch):
+    monkeypatch.setattr(tokenizer, 'tiktoken', None)
+    monkeypatch.setattr(tokenizer, 'Tokenizer', None)
+
+    assert create_token_counter('tiktoken:cl100k_base').name == 'estimate'
+    assert create_token_counter('hf:/models/tokenizer.json').name == 'estimate'
+
+
+def test_missing_hf_file_falls_back_to_the_estimate(tmp_path):
+    pytest.importorskip('tokenizers')
+
+    assert create_token_counter(f'hf:{tmp_path / "tokenizer.json"}').name == 'estimate'
+
+
+@pytest.mark.skipif(tokenizer.tiktoken is None or not os.path.isfile(tokenizer._tiktoken_cache_path('cl100k_base')),
+                    reason='the cl100k_base encoding is not in the tiktoken cache')
+def test_real_cached_encoding_counts_tokens():
+    counter = create_token_counter('tiktoken:cl100k_base')
+
+    assert counter.name == 'tiktoken:cl100k_base'
+    assert counter('hello world') == 2
@@ -0,0 +1,118 @@
+import types
+import asyncio
+
+import pytest
+
+from kafka_helper import serializer
+from runtime import TopicPool
+from stubs import InMemoryBroker
+from tracing import trace_id_of
+from workers import Stage, StageError, StagePipeline, decode
+
+RESOURCES = types.SimpleNamespace(profiler=None)
+
+
+@pytest.fixture
+def broker(monkeypatch):
+    broker = InMemoryBroker()
+    monkeypatch.setattr('kafka_helper.producer', broker.producer())
+    return broker
+
+
+def _failing(error: Exception, failures: int = None):
+    """
+    Returns a stage function raising `error` on its first `failures` calls, or on every call when None.
+    """
+    calls = []
+
+    async def function(pipeline, job):
+        calls.append(job)
+        if failures is None or len(calls) <= failures:
+            raise error
+
+    function.calls = calls
+    return function
+
+
+def _pipeline(*stages, dead_letter_topic: str = 'dead-letter') -> StagePipeline:
+    return StagePipeline('audio', list(stages), RESOURCES, dead_letter_topic=dead_letter_topic)
+
+
+def _process(pipeline: StagePipeline, broker: InMemoryBroker, value: dict, key: bytes = b'key'):
+    record = broker.send('audio', serializer.dumps(value), key=key)
+    return asyncio.run(pipeline.process(record))
+
+
+def test_transient_error_is_retried(broker):
+    function = _failing(ConnectionError('reset'), failures=2)
+    pipeline = _pipeline(Stage('transcribe', function, retries=2, backoff=0))
+
+    assert _process(pipeline, broker, {'Id': 1}) is None
+    assert len(function.calls) == 3
+    assert broker.records('dead-letter') == []
+
+
+def test_failed_message_is_dead_lettered_with_its_error(broker):
+    function = _failing(ConnectionError('reset'))
+    pipeline = _pipeline(Stage('decode', decode), Stage('transcribe', function, retries=1, backoff=0))
+    message = {'Id': 1, 'RefId': 2, 'Metadata': {}}
+
+    assert _process(pipeline, broker, message) == 'dead_lettered'
+    [record] = broker.records('dead-letter')
+    envelope = serializer.loads(record.value)
+    assert record.key == b'key'
+    assert (envelope['Topic'], envelope['Partition'], envelope['Offset']) == ('audio', 0, 0)
+    assert serializer.loads(envelope['Value'].encode()) == message
+    assert envelope['Error']['Stage'] == 'transcribe'
+    assert envelope['Error']['Type'] == 'ConnectionError'
+    assert envelope['Error']['Attempts'] == 2
+    assert envelope['Error']['TraceId'] == trace_id_of(message)
+
+
+def test_permanent_error_is_not_retried(broker):
+    function = _failing(KeyError('Metadata'))
+    pipeline = _pipeline(Stage('decode', function, retries=3, backoff=0))
+
+    assert _process(pipeline, broker, {'Id': 1}) == 'dead_lettered'
+    assert len(function.calls) == 1
+    assert serializer.loads(broker.records('dead-letter')[0].value)['Error']['Attempts'] == 1
+
+
+def test_error_is_raised_without_dead_letter_topic(broker):
+    pipeline = _pipeline(Stage('decode', _failing(ValueError('bad'))), dead_letter_topic=None)
+
+    with pytest.raises(StageError) as raised:
+        _process(pipeline, broker, {'Id': 1})
+    assert raised.value.stage == 'decode' and raised.value.attempts == 1
+
+
+def test_dead_lettered_offsets_are_committed(broker):
+    for index in range(3):
+        broker.send('audio', serializer.dumps({'Id': index}))
+
+    async def fail_second(pipeline, job):
+        if job.message.offset == 1:
+            raise ValueError('bad message')
+
+    pipeline = _pipeline(Stage('decode', fail_second))
+
+    async def main():
+        handled = []
+
+        async def handler(message):
+            try:
+                return await pipeline.process(message)
+            finally:
+                handled.append(message.offset)
+
+        pool = TopicPool(lambda listener: broker.consumer('audio', listener), handler, concurrency=2,
+                         queue_size=4, poll_timeout_ms=20, commit_interval=0)
+        task = asyncio.create_task(pool.run())
+        while len(handled) < 3:
+            await asyncio.sleep(0.01)
+        task.cancel()
+        await asyncio.gather(task, return_exceptions=True)
+
+    asyncio.run(main())
+    assert list(broker.committed('audio').values()) == [3]
+    assert [serializer.loads(record.value)['Offset'] for record in broker.records('dead-letter')] == [1]